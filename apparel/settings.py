@@ -101,6 +101,29 @@ if 'DATABASE_URL' in os.environ:
         conn_health_checks=True,
     )
 
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+# Versions and counters of products (see products/cache_versions.py) have to be shared
+# by all the processes, so production needs Redis or Memcached, f.e. CACHE_URL=redis://127.0.0.1:6379/1
+# or CACHE_URL=memcached://127.0.0.1:11211, the local memory cache is only fit for a single process
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+if os.getenv('CACHE_URL', '').startswith(('redis://', 'rediss://')):
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ['CACHE_URL'],
+    }
+elif os.getenv('CACHE_URL', '').startswith('memcached://'):
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.memcached.PyMemcacheCache',
+        'LOCATION': os.environ['CACHE_URL'].removeprefix('memcached://'),
+    }
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -150,5 +173,40 @@ STORAGES = {
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Resolve product list filters with an in-process bitset index
+# instead of db joins (see products/inventory_index.py)
+PRODUCTS_INVENTORY_INDEX = False
+
+# Max age (in seconds) of cached price bounds of product listings,
+# they are invalidated on price changes, but not on changes of availability
+# (see products/price_bounds.py)
+PRODUCTS_PRICE_BOUNDS_TIMEOUT = 60 * 15
+
+# Full-text search of the search list: an in-process inverted index,
+# or products.search.SQLiteFTS5Backend / products.search.PostgresBackend
+# to keep the index in the db (see products/search.py), the FTS5 table
+# is created by the 'rebuild_search_index' command after enabling it
+PRODUCTS_SEARCH_BACKEND = "products.search.LocalIndexBackend"
+
+# Views of Products are counted in cache and written to the db
+# at most once per this number of seconds (see products/view_counter.py)
+PRODUCTS_VIEWS_FLUSH_INTERVAL = 60
+
+# Keep recently viewed products of visitors without a session in a signed cookie,
+# so that product pages don't create db sessions (see products/view_dedup.py)
+PRODUCTS_VIEWED_COOKIE = True
+
+# Max age (in seconds) of cached HTML of product cards, they are invalidated on changes
+# sent with signals, bulk changes are reflected once they expire (see products/cards.py)
+PRODUCTS_CARD_TIMEOUT = 60 * 60
+
+# Builds URLs of images (with a public id and a transformation, see products/images.py),
+# "products.images.local_url" serves them from MEDIA_URL, f.e. without a Cloudinary account
+PRODUCTS_IMAGE_URL_BUILDER = "products.images.cloudinary_url"
+
+# Max age (in seconds) of cached pages of product lists served to anonymous visitors,
+# they are invalidated on changes sent with signals (see products/page_cache.py), None disables them
+PRODUCTS_PAGE_CACHE_TIMEOUT = 60 * 5
+
 # Fixtures for tests
 FIXTURE_DIRS = [BASE_DIR / 'products/tests/fixtures/']
\ No newline at end of file
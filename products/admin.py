@@ -4,7 +4,7 @@ from django.shortcuts import render
 from django.utils.translation import gettext_lazy as _, ngettext
 from mptt.admin import DraggableMPTTAdmin
 
-from . import models
+from . import inventory_index, models, price_bounds
 
 
 class ProductInline(admin.TabularInline):
@@ -56,6 +56,9 @@ class ParentProductModelAdmin(admin.ModelAdmin):
             if form.is_valid():
                 new_campaign = form.cleaned_data['campaign']
                 queryset.update(campaign=new_campaign)
+                # update() doesn't send signals, which invalidate these
+                inventory_index.invalidate_on_commit()
+                price_bounds.invalidate()
                 self.message_user(
                     request,
                     ngettext(
@@ -87,7 +90,7 @@ class ProductModelAdmin(admin.ModelAdmin):
     model = models.Product
     inlines = [StockInline]
     list_display = [
-        'parent', 'style', 'color', 'price', 'discounted_price', 'views',
+        'parent', 'style', 'color', 'price', 'discounted_price', 'views', 'trending',
     ]
     ordering = ['parent']
     search_fields = ['parent__name', 'parent__id', "style"]
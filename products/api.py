@@ -0,0 +1,237 @@
+"""
+A read-only JSON API of the catalog, f.e. for the mobile app and partners:
+
+    /api/products/?color=1,3&size=4&price_lte=100&sorting=newest&category=dresses&fields=id,slug,price
+    /api/products/<slug>/?fields=name,price,sizes
+    /api/categories/
+    /api/campaigns/
+
+Products are listed by ProductListApi (see products.views) with the filters
+and 'sorting' options of ProductList, an optional 'category' (path crumb,
+with its subcategories) or 'campaign' (slug), 'offset' and 'limit'.
+
+Rows are read with values_list() of just the columns of the selected 'fields'
+(all by default), no model instances are created, and lists are streamed:
+written to the response in chunks of CHUNK_SIZE while they are fetched,
+so even the whole catalog is served in constant memory.
+Categories and campaigns come from the taxonomy cache (see products.taxonomy).
+Images are URLs of variants (see products.images).
+"""
+from __future__ import annotations
+
+from functools import wraps
+from itertools import islice
+from typing import Callable, Iterable, Iterator, NamedTuple
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import QuerySet
+from django.http import JsonResponse
+from django.urls import reverse
+
+from products import images, taxonomy
+from products.models import Image, Product, Stock
+
+# rows fetched and encoded at once
+CHUNK_SIZE = 500
+
+_encoder = DjangoJSONEncoder(separators=(",", ":"))
+
+
+class ApiError(Exception):
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
+
+
+def json_errors(view):
+    """ ApiErrors raised by the view as {"error": message} responses. """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        try:
+            return view(*args, **kwargs)
+        except ApiError as error:
+            return JsonResponse({"error": str(error)}, status=error.status)
+
+    return wrapper
+
+
+class Field(NamedTuple):
+    # looked up with values_list()
+    lookups: tuple[str, ...]
+    # the value of the field from the looked up values, the first one by default
+    convert: Callable | None = None
+
+
+def image_url(variant: str) -> Callable:
+    def convert(image):
+        public_id = getattr(Product._meta.get_field("main_image").to_python(image), "public_id", None)
+        return images.url(public_id, variant) if public_id else None
+
+    return convert
+
+
+def product_url(slug: str) -> str:
+    return reverse("products:product_detail", args=[slug])
+
+
+def siblings(entries: dict) -> list[dict]:
+    return [{"id": int(pk), "slug": entry["slug"]} for pk, entry in entries.items()]
+
+
+FIELDS = {
+    "id": Field(("id",)),
+    "slug": Field(("slug",)),
+    "url": Field(("slug",), product_url),
+    "name": Field(("parent__name",)),
+    "style": Field(("style",)),
+    "color": Field(("color_id",)),
+    "category": Field(("parent__category_id",)),
+    "campaign": Field(("parent__campaign_id",)),
+    "price": Field(("price",)),
+    "discounted_price": Field(("discounted_price",)),
+    "effective_price": Field(("effective_price",)),
+    "stock": Field(("total_stock",)),
+    "image": Field(("main_image",), image_url("card")),
+}
+DETAIL_FIELDS = {
+    **FIELDS,
+    "image": Field(("main_image",), image_url("detail")),
+    "available": Field(("is_available",)),
+    "description": Field(("parent__description",)),
+    "fabric_info": Field(("parent__fabric_info",)),
+    "sizes_info": Field(("parent__sizes_info",)),
+    "siblings": Field(("parent__all_products_json",), siblings),
+    # fetched with a query per field, see RELATED
+    "sizes": Field(()),
+    "images": Field(()),
+}
+
+
+def load_sizes(pk: int) -> list[dict]:
+    return [
+        {"id": size, "name": name, "quantity": quantity}
+        for size, name, quantity in Stock.objects.filter(product=pk).order_by("size").values_list(
+            "size_id", "size__name", "quantity"
+        )
+    ]
+
+
+def load_images(pk: int) -> list[str]:
+    field = Image._meta.get_field("url")
+    return [
+        images.url(field.to_python(url).public_id, "detail")
+        for url in Image.objects.filter(product=pk).order_by("pk").values_list("url", flat=True)
+    ]
+
+
+RELATED = {"sizes": load_sizes, "images": load_images}
+
+
+def parse_fields(value: str | None, available: Iterable[str]) -> list[str]:
+    """ f.e. "id,slug" -> ["id", "slug"], all available fields when empty. """
+    available = list(available)
+    if not value:
+        return available
+    fields = list(dict.fromkeys(name.strip() for name in value.split(",") if name.strip()))
+    unknown = [name for name in fields if name not in available]
+    if unknown:
+        raise ApiError("Unknown fields: %s, available: %s." % (", ".join(unknown), ", ".join(available)))
+
+    return fields
+
+
+def parse_int(params, name: str) -> int | None:
+    value = params.get(name)
+    if value in (None, ""):
+        return None
+    try:
+        value = int(value)
+    except ValueError:
+        value = -1
+    if value < 0:
+        raise ApiError("'%s' has to be a non-negative integer." % name)
+
+    return value
+
+
+def rows(queryset: QuerySet, fields: dict[str, Field], names: list[str]) -> Iterator[dict]:
+    """ Dicts of the fields named 'names', with a values_list() of only the needed columns. """
+    lookups = list(dict.fromkeys(lookup for name in names for lookup in fields[name].lookups))
+    positions = [
+        (name, [lookups.index(lookup) for lookup in fields[name].lookups], fields[name].convert)
+        for name in names if fields[name].lookups
+    ]
+    for row in queryset.values_list(*lookups).iterator(chunk_size=CHUNK_SIZE):
+        yield {
+            name: convert(*(row[i] for i in indexes)) if convert else row[indexes[0]]
+            for name, indexes, convert in positions
+        }
+
+
+def paginate(queryset: QuerySet, params) -> QuerySet:
+    """ Slice of the queryset by the 'offset' and 'limit' query params. """
+    offset, limit = parse_int(params, "offset") or 0, parse_int(params, "limit")
+    if offset or limit is not None:
+        queryset = queryset[offset:None if limit is None else offset + limit]
+
+    return queryset
+
+
+def product_detail(slug: str, params) -> dict:
+    names = parse_fields(params.get("fields"), DETAIL_FIELDS)
+    # the pk is needed for related fields
+    product = next(rows(Product.objects.filter(slug=slug), DETAIL_FIELDS, ["id", *names]), None)
+    if product is None:
+        raise ApiError("No Product matches the given query.", status=404)
+    pk = product["id"] if "id" in names else product.pop("id")
+    for name in names:
+        if name in RELATED:
+            product[name] = RELATED[name](pk)
+
+    return product
+
+
+def list_categories(params) -> list[dict]:
+    names = parse_fields(params.get("fields"), ("id", "name", "parent", "path", "url"))
+    product_taxonomy = taxonomy.get_taxonomy()
+    categories = []
+    for category in product_taxonomy.categories:
+        path = "/".join(node.path_crumb for node in product_taxonomy.get_ancestors(category, include_self=True))
+        values = {
+            "id": category.pk,
+            "name": category.name,
+            "parent": category.parent_id,
+            "path": path,
+            "url": reverse("products:product_by_category_list", args=[path]),
+        }
+        categories.append({name: values[name] for name in names})
+
+    return categories
+
+
+def list_campaigns(params) -> list[dict]:
+    names = parse_fields(params.get("fields"), ("id", "name", "slug", "description", "image", "url"))
+    image = image_url("original")
+    campaigns = []
+    for campaign in taxonomy.get_taxonomy().campaigns:
+        values = {
+            "id": campaign.pk,
+            "name": campaign.name,
+            "slug": campaign.slug,
+            "description": campaign.description,
+            "image": image(campaign.image),
+            "url": reverse("products:product_list_for_campaign", args=[campaign.slug]),
+        }
+        campaigns.append({name: values[name] for name in names})
+
+    return campaigns
+
+
+def stream(results: Iterator[dict]) -> Iterator[str]:
+    """ {"results": [...]} encoded in chunks of CHUNK_SIZE. """
+    yield '{"results":['
+    separator = ""
+    while chunk := list(islice(results, CHUNK_SIZE)):
+        yield separator + _encoder.encode(chunk)[1:-1]
+        separator = ","
+    yield "]}"
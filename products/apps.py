@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class ProductsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'products'
+
+    def ready(self):
+        # connect receivers keeping denormalized data and caches in sync,
+        # also in processes which never import the views (f.e. management commands)
+        from products import signals  # noqa: F401
+        # register system checks
+        from products import checks  # noqa: F401
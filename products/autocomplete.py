@@ -0,0 +1,289 @@
+"""
+Suggestions for the search bar while typing, served from an in-process index.
+
+Suggestions are Products (with their style), Categories and words
+from search keywords of ParentProducts, ranked by views (summed up
+for Categories and keywords). All Products are suggested, as their
+detail pages are shown even when they're unavailable. Every suggestion is indexed by its
+normalized text from every word on, f.e. 'Strapless dress - sky blue'
+under 'strapless dress sky blue', 'dress sky blue', 'sky blue' and 'blue',
+in a sorted list, so the suggestions for a prefix are a slice found with bisect.
+
+Like products.search.LocalIndexBackend, the index is built on the first use
+and changes of the texts bump the "autocomplete" version in the shared cache:
+the process which made the change updates its index incrementally,
+other processes rebuild theirs. Changes of views only update the scores
+of the process where they're saved, others pick them up with the next rebuild.
+"""
+from __future__ import annotations
+
+import bisect
+import heapq
+import threading
+from collections import Counter, defaultdict
+from typing import Callable, Iterable, NamedTuple
+from urllib.parse import urlencode
+
+from django.db import transaction
+from django.urls import reverse
+
+from products import cache_versions, search
+from products.models import Category, Product
+
+VERSION = "autocomplete"
+
+MIN_QUERY_LENGTH = 2
+MAX_LIMIT = 20
+# best suggestions kept per prefix, so that prefixes matching a large part
+# of the index (f.e. 'dr') are scanned once, until the next change of texts;
+# they are re-ranked with the current views on every request
+CACHED_PREFIXES = 10_000
+CACHED_CANDIDATES = 50
+# scanning the phrases of a prefix costs ~ their number, walking all suggestions
+# in rank order until enough of them match costs ~ suggestions / matching share,
+# so the walk is used when the phrases are more than sqrt(WALK_FACTOR * suggestions)
+WALK_FACTOR = 100
+
+
+class Suggestion(NamedTuple):
+    text: str
+    kind: str
+    url: str
+
+
+class ProductEntry(NamedTuple):
+    """ Data of a Product contributing to scores of keywords and categories. """
+    suggestion: Suggestion
+    views: int
+    keywords: frozenset
+    categories: tuple
+
+
+def normalize(text: str) -> str:
+    return " ".join(search.tokenize(text))
+
+
+def phrases(text: str) -> set[str]:
+    """ f.e. 'pencil dress' -> {'pencil dress', 'dress'} """
+    words = text.split()
+    return {" ".join(words[position:]) for position in range(len(words))}
+
+
+class AutocompleteIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        self.built = False
+        self.version = None
+        self.suggestions: dict[tuple, Suggestion] = {}
+        # normalized texts with a leading space, ' ' + prefix is in the text when it matches
+        self.texts: dict[tuple, str] = {}
+        # keys of suggestions in rank order, None when it has to be sorted again
+        self.ranked: list[tuple] | None = None
+        self.scores: dict[tuple, int] = defaultdict(int)
+        # sorted (phrase, suggestion key)
+        self.phrases: list[tuple[str, tuple]] = []
+        self.products: dict[int, ProductEntry] = {}
+        self.keyword_products = Counter()
+        self.candidates: dict[str, list[tuple]] = {}
+        # category pk -> (url, pks of the category and its ancestors)
+        self.categories: dict[int, tuple[str, tuple]] = {}
+
+    def build(self):
+        version = cache_versions.get_version(VERSION)
+        with self._lock:
+            self.clear()
+            self._load_categories()
+            for pk, entry in self._product_entries(Product.objects.all()):
+                self._add_product(pk, entry)
+            self.phrases.sort()
+            self.ranked = sorted(self.suggestions, key=self._rank)
+            self.built = True
+            self.version = version
+
+        return self
+
+    def suggest(self, query: str, limit: int = 8) -> list[Suggestion]:
+        prefix = normalize(query)
+        if len(prefix) < MIN_QUERY_LENGTH:
+            return []
+        if not self.built or self.version != cache_versions.get_version(VERSION):
+            self.build()
+
+        with self._lock:
+            candidates = self.candidates.get(prefix)
+            if candidates is None:
+                start = bisect.bisect_left(self.phrases, (prefix,))
+                end = bisect.bisect_left(self.phrases, (prefix + "\uffff",))
+                if (end - start) ** 2 > WALK_FACTOR * len(self.suggestions):
+                    candidates = self._walk(prefix)
+                else:
+                    keys = {key for _, key in self.phrases[start:end]}
+                    candidates = heapq.nsmallest(CACHED_CANDIDATES, keys, key=self._rank)
+                if len(self.candidates) >= CACHED_PREFIXES:
+                    # the oldest one
+                    del self.candidates[next(iter(self.candidates))]
+                self.candidates[prefix] = candidates
+
+            return [self.suggestions[key] for key in heapq.nsmallest(limit, candidates, key=self._rank)]
+
+    def _walk(self, prefix: str) -> list[tuple]:
+        """ The best suggestions matching the prefix, in rank order as of the last change of texts. """
+        if self.ranked is None:
+            self.ranked = sorted(self.suggestions, key=self._rank)
+        needle, texts = " " + prefix, self.texts
+        candidates = []
+        for key in self.ranked:
+            if needle in texts[key]:
+                candidates.append(key)
+                if len(candidates) == CACHED_CANDIDATES:
+                    break
+
+        return candidates
+
+    def update(self, pks: Iterable[int], scores_only: bool = False):
+        """
+        Re-read the given Products from the db (missing ones are removed).
+        'scores_only' - only views have changed, other processes aren't notified.
+        """
+        pks = set(pks)
+        if not pks:
+            return
+        if scores_only:
+            with self._lock:
+                if self.built:
+                    self._reindex(pks)
+            return
+
+        version = cache_versions.bump(VERSION)
+        with self._lock:
+            if not self.built:
+                return
+            self._reindex(pks)
+            if version is not None and self.version is not None and version == self.version + 1:
+                self.version = version
+            else:
+                # another process has changed the index meanwhile
+                self.built = False
+
+    def _rank(self, key):
+        # the most viewed first, ties in alphabetical order
+        return -self.scores[key], self.suggestions[key].text
+
+    def _load_categories(self):
+        rows = {
+            pk: (parent, name, crumb)
+            for pk, parent, name, crumb in Category.objects.values_list("pk", "parent_id", "name", "path_crumb")
+        }
+        for pk, (parent, name, crumb) in rows.items():
+            ancestors, current = [], pk
+            while current is not None and len(ancestors) < len(rows):
+                ancestors.append(current)
+                current = rows[current][0]
+            path = "/".join(rows[ancestor][2] for ancestor in reversed(ancestors))
+            url = reverse("products:product_by_category_list", args=[path])
+            self.categories[pk] = (url, tuple(ancestors))
+            self._add(("category", pk), Suggestion(name, "category", url))
+
+    def _product_entries(self, products) -> Iterable[tuple[int, ProductEntry]]:
+        # reverse() is too slow to be called for every Product
+        url = reverse("products:product_detail", args=["__slug__"])
+        for pk, slug, style, views, name, keywords, category in products.order_by().values_list(
+                "pk", "slug", "style", "views", "parent__name", "parent__search_keywords", "parent__category_id",
+        ):
+            yield pk, ProductEntry(
+                Suggestion("%s - %s" % (name, style), "product", url.replace("__slug__", slug)),
+                views,
+                frozenset(word for word in search.tokenize(keywords) if len(word) > 1),
+                self.categories.get(category, (None, ()))[1],
+            )
+
+    def _reindex(self, pks: set[int]):
+        entries = dict(self._product_entries(Product.objects.filter(pk__in=pks)))
+        for pk in pks:
+            old, new = self.products.get(pk), entries.get(pk)
+            if old is not None and new is not None and old.suggestion == new.suggestion:
+                # keep the phrases
+                self._remove_product(pk, keep=True)
+                self._add_product(pk, new, keep=True)
+                continue
+            if old is not None:
+                self._remove_product(pk)
+            if new is not None:
+                self._add_product(pk, new)
+
+    def _add_product(self, pk: int, entry: ProductEntry, keep: bool = False):
+        self.products[pk] = entry
+        key = ("product", pk)
+        if not keep:
+            self._add(key, entry.suggestion)
+        self.scores[key] = entry.views
+        for word in entry.keywords:
+            if not self.keyword_products[word]:
+                url = "%s?%s" % (reverse("products:search_list"), urlencode({"q": word}))
+                self._add(("keyword", word), Suggestion(word, "keyword", url))
+            self.keyword_products[word] += 1
+            self.scores[("keyword", word)] += entry.views
+        for category in entry.categories:
+            self.scores[("category", category)] += entry.views
+
+    def _remove_product(self, pk: int, keep: bool = False):
+        entry = self.products.pop(pk)
+        key = ("product", pk)
+        if not keep:
+            self._remove(key)
+        for word in entry.keywords:
+            self.keyword_products[word] -= 1
+            self.scores[("keyword", word)] -= entry.views
+            if not self.keyword_products[word]:
+                del self.keyword_products[word]
+                self._remove(("keyword", word))
+        for category in entry.categories:
+            self.scores[("category", category)] -= entry.views
+
+    def _add(self, key: tuple, suggestion: Suggestion):
+        self.suggestions[key] = suggestion
+        text = self.texts[key] = " " + normalize(suggestion.text)
+        for phrase in phrases(text):
+            if self.built:
+                bisect.insort(self.phrases, (phrase, key))
+            else:
+                # sorted at the end of the build
+                self.phrases.append((phrase, key))
+        if self.built:
+            self.candidates.clear()
+            self.ranked = None
+
+    def _remove(self, key: tuple):
+        self.suggestions.pop(key)
+        self.scores.pop(key, None)
+        for phrase in phrases(self.texts.pop(key)):
+            del self.phrases[bisect.bisect_left(self.phrases, (phrase, key))]
+        self.candidates.clear()
+        self.ranked = None
+
+
+_index = AutocompleteIndex()
+
+
+def get_index() -> AutocompleteIndex:
+    return _index
+
+
+def suggest(query: str, limit: int = 8) -> list[Suggestion]:
+    return _index.suggest(query, min(limit, MAX_LIMIT))
+
+
+def update_on_commit(get_pks: Callable[[], Iterable[int]], scores_only: bool = False):
+    """
+    Update the index with the given Products once the current transaction
+    is committed, 'get_pks' is a callable, so the pks can be fetched lazily.
+    """
+    transaction.on_commit(lambda: _index.update(get_pks(), scores_only=scores_only))
+
+
+def invalidate_on_commit():
+    """ Every process rebuilds its index on the next use. """
+    cache_versions.bump_on_commit(VERSION)
@@ -0,0 +1,140 @@
+"""
+Helpers for the 'benchmark' management command:
+generating a synthetic catalog and measuring queries.
+"""
+from __future__ import annotations
+
+import random
+import re
+import statistics
+import time
+from decimal import Decimal
+
+from django.db import connection
+
+from products.models import (
+    Campaign, Category, Color, ParentProduct, Product, Size, SizeGroup, Stock
+)
+
+
+def seed_catalog(products: int = 100_000, variants_per_parent: int = 4, batch_size: int = 5000, seed: int = 0):
+    """
+    Creates a synthetic catalog with the given number of Products
+    (plus parents, categories, colors, sizes, campaigns and stock),
+    with bulk inserts, so no signals are sent.
+    """
+    rng = random.Random(seed)
+
+    roots = [Category.objects.create(name="Bench root %s" % i) for i in range(4)]
+    categories = roots + [
+        Category.objects.create(name="Bench %s-%s" % (root.pk, i), parent=root)
+        for root in roots for i in range(5)
+    ]
+    colors = Color.objects.bulk_create(
+        Color(name="bench-%s" % i, hex_code="#%06x" % (0xBE0000 + i)) for i in range(12)
+    )
+    group = SizeGroup.objects.create(name="bench")
+    sizes = Size.objects.bulk_create(Size(name="bench-%s" % i, group=group) for i in range(6))
+    campaigns = Campaign.objects.bulk_create(
+        Campaign(name="bench-%s" % i, slug="bench-%s" % i, image="bench", is_active=True) for i in range(3)
+    )
+
+    parents_count = -(-products // variants_per_parent)
+    parents = ParentProduct.objects.bulk_create(
+        (
+            ParentProduct(
+                name="Bench parent %s" % i,
+                category=rng.choice(categories),
+                campaign=rng.choice(campaigns + [None]),
+                search_keywords=" ".join(rng.sample(WORDS, 4)),
+            )
+            for i in range(parents_count)
+        ),
+        batch_size=batch_size,
+    )
+
+    created = 0
+    for start in range(0, products, batch_size):
+        batch = []
+        for i in range(start, min(start + batch_size, products)):
+            price = Decimal(rng.randrange(1900, 30000)) / 100
+            batch.append(Product(
+                parent=parents[i // variants_per_parent],
+                style="style %s" % (i % variants_per_parent),
+                color=rng.choice(colors),
+                price=price,
+                discounted_price=(price * Decimal("0.7")).quantize(Decimal("0.01")) if rng.random() < 0.2 else None,
+                slug="bench-product-%s" % i,
+                main_image="bench",
+                views=int(rng.paretovariate(1.2) * 10),
+                trending=round(rng.paretovariate(1.2), 3),
+            ))
+        batch = Product.objects.bulk_create(batch)
+        Stock.objects.bulk_create(
+            Stock(product=product, size=size, quantity=rng.choice((0, 0, 1, 2, 5)))
+            for product in batch for size in sizes
+        )
+        created += len(batch)
+
+    return created
+
+
+# tables which grow with the catalog
+CATALOG_TABLES = ("products_product", "products_parentproduct", "products_stock")
+
+# EXPLAIN patterns of SQLite and PostgreSQL
+FULL_SCAN_RE = re.compile(
+    r"^SCAN (%(tables)s)\b(?!.*USING)|Seq Scan on (%(tables)s)\b" % {"tables": "|".join(CATALOG_TABLES)}
+)
+SORT_RE = re.compile(r"USE TEMP B-TREE FOR (RIGHT PART OF )?ORDER BY|^\s*(->\s*)?(Incremental )?Sort\b")
+MAIN_TABLE_RE = re.compile(r'^SELECT .*? FROM "(\w+)"')
+
+
+def query_plan(sql: str) -> list[str]:
+    """ Lines of the plan of an SQL query with inlined parameters. """
+    with connection.cursor() as cursor:
+        if connection.vendor == "sqlite":
+            cursor.execute("EXPLAIN QUERY PLAN " + sql)
+            return [row[3] for row in cursor.fetchall()]
+
+        cursor.execute("EXPLAIN " + sql)
+        return [row[0] for row in cursor.fetchall()]
+
+
+def plan_problems(sql: str, allow_sort: bool = False) -> list[str]:
+    """
+    Returns lines of the query plan showing a full scan of a catalog table
+    or, for queries on a catalog table, sorting of the rows
+    instead of reading them in the order of an index.
+    """
+    main_table = MAIN_TABLE_RE.match(sql)
+    check_sort = not allow_sort and main_table and main_table.group(1) in CATALOG_TABLES
+
+    return [
+        line for line in query_plan(sql)
+        if FULL_SCAN_RE.search(line) or (check_sort and SORT_RE.search(line))
+    ]
+
+
+def explain(queryset) -> str:
+    if connection.vendor == "postgresql":
+        return queryset.explain(analyze=True)
+    return queryset.explain()
+
+
+def timed(func, repeat: int = 5) -> float:
+    """ Median time of 'repeat' calls in milliseconds. """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+
+    return statistics.median(timings)
+
+
+WORDS = [
+    "summer", "winter", "chic", "casual", "cotton", "wool", "linen", "silk", "dress",
+    "trousers", "sweater", "shirt", "skirt", "jacket", "elegant", "basic", "comfy",
+    "floral", "striped", "knitted", "oversized", "slim", "vintage", "classic",
+]
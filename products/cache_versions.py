@@ -0,0 +1,63 @@
+"""
+Version numbers of cached catalog data, kept in the shared django cache.
+
+Cached values are stored under keys containing the current version
+of their group (f.e. "prices"), so bumping the version invalidates
+all of them at once in every process, without deleting keys one by one.
+Old entries simply expire.
+"""
+import time
+from typing import Iterable
+
+from django.core.cache import cache
+from django.db import transaction
+
+KEY = "products:version:%s"
+
+
+def _initial() -> int:
+    # a counter created again after eviction must not repeat old versions,
+    # so it starts from the current time instead of 1
+    return time.time_ns() // 1000
+
+
+def get_version(name: str) -> int:
+    key = KEY % name
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _initial(), timeout=None)
+        version = cache.get(key, _initial())
+
+    return version
+
+
+def get_versions(names: Iterable[str]) -> dict[str, int]:
+    """ get_version() of all the names, with a single get_many() when they are all cached. """
+    keys = {KEY % name: name for name in names}
+    versions = cache.get_many(keys)
+
+    return {name: versions[key] if key in versions else get_version(name) for key, name in keys.items()}
+
+
+def bump(name: str) -> int | None:
+    """ Returns the new version, None if the counter was missing. """
+    key = KEY % name
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # missing counter
+        cache.add(key, _initial(), timeout=None)
+
+
+def bump_on_commit(name: str):
+    """
+    Bump the version once the current transaction is committed,
+    otherwise a concurrent request could cache the old data
+    under the new version before the changes become visible.
+    """
+    transaction.on_commit(lambda: bump(name))
+
+
+def make_key(name: str, *parts) -> str:
+    """ f.e. make_key("prices", "bounds", "all") -> "products:prices:1713..:bounds:all" """
+    return ":".join(["products", name, str(get_version(name)), *map(str, parts)])
@@ -0,0 +1,103 @@
+"""
+Cached HTML of product cards (templates/products/partials/product.html),
+rendered for every Product of list pages and of the main page.
+
+A card is cached under the pk of its Product with its render version,
+bumped (see products.signals) on changes of the Product, its stock,
+its parent or its siblings (the card shows their thumbnails), also used
+for ETags of product pages (see products.conditional), and with
+the "cards" version, bumped on changes which affect all cards (f.e. names of sizes).
+Cards of a page are read with two get_many() (versions and cards), only
+the missing ones are rendered, with stock prefetched just for them.
+Bulk changes which don't send signals (f.e. StockQueryset.bulk_update)
+are reflected once the cards expire (settings.PRODUCTS_CARD_TIMEOUT).
+
+Only the first 'eager' cards of a page load their main images right away,
+the rest (below the fold) get loading="lazy" when they're joined, so a card
+is cached once, whatever its position on a page.
+"""
+from __future__ import annotations
+
+from typing import Callable, Iterable
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
+from django.template.loader import render_to_string
+from django.utils.safestring import SafeString, mark_safe
+
+from products import cache_versions
+from products.models import Product, Stock
+
+VERSION = "cards"
+TEMPLATE = "products/partials/product.html"
+# cards above the fold of a list page, 2 rows of the widest grid
+EAGER = 8
+
+
+def get_timeout() -> int | None:
+    return getattr(settings, "PRODUCTS_CARD_TIMEOUT", 60 * 60)
+
+
+def product_version(pk: int) -> str:
+    return "card:%s" % pk
+
+
+def render(product: Product) -> str:
+    return render_to_string(TEMPLATE, {"product": product})
+
+
+def lazy(card: str) -> str:
+    """ The card with its main image (the first one) loaded lazily. """
+    return card.replace("<img ", '<img loading="lazy" ', 1)
+
+
+def render_cards(products: Iterable[Product], eager: int = EAGER) -> SafeString:
+    """
+    Cards of the Products (with their parents selected), rendered on a cache miss,
+    images of cards after the first 'eager' ones are loaded lazily.
+    """
+    products = list(products)
+    if not products:
+        return mark_safe("")
+    timeout = get_timeout()
+    if not timeout:
+        prefetch_stock(products)
+        return join(list(map(render, products)), eager)
+
+    versions = cache_versions.get_versions(product_version(product.pk) for product in products)
+    prefix = cache_versions.make_key(VERSION, "card")
+    keys = {
+        product.pk: "%s:%s:%s" % (prefix, product.pk, versions[product_version(product.pk)])
+        for product in products
+    }
+    cards = cache.get_many(keys.values())
+    missing = [product for product in products if keys[product.pk] not in cards]
+    if missing:
+        prefetch_stock(missing)
+        rendered = {keys[product.pk]: render(product) for product in missing}
+        cache.set_many(rendered, timeout)
+        cards.update(rendered)
+
+    return join([cards[keys[product.pk]] for product in products], eager)
+
+
+def join(cards: list[str], eager: int) -> SafeString:
+    return mark_safe("".join(cards[:eager] + [lazy(card) for card in cards[eager:]]))
+
+
+def prefetch_stock(products: list[Product]):
+    prefetch_related_objects(products, Prefetch("stock", queryset=Stock.objects.select_related("size")))
+
+
+def invalidate(get_pks: Callable[[], Iterable[int]]):
+    """
+    Bump render versions of the given Products once the current transaction
+    is committed, 'get_pks' is a callable, so the pks can be fetched lazily.
+    """
+    transaction.on_commit(lambda: [cache_versions.bump(product_version(pk)) for pk in get_pks()])
+
+
+def invalidate_all():
+    cache_versions.bump_on_commit(VERSION)
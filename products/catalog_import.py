@@ -0,0 +1,396 @@
+"""
+Streaming import of the catalog from CSV or JSONL (the 'import_catalog' command).
+
+A record describes a Product with its parent, stock and images, f.e. in JSONL:
+
+    {"parent": "Pencil dress", "category": "Summer dresses", "campaign": "New collection",
+     "search_keywords": "office midi", "style": "bottle green", "color": "green",
+     "price": "119.00", "discounted_price": null, "main_image": "image/upload/v1/lmuckfapvaz80u2xhftn.jpg",
+     "stock": {"S": 2, "M": 0}, "images": ["image/upload/v1/a6w625et1qlbao9hc98m.jpg"]}
+
+CSV has the same columns, with stock written as "S=2;M=0" and images separated by spaces.
+Categories, campaigns, colors and sizes are referred to by name and have to exist.
+Parents are matched by name and Products by parent and style: missing ones
+are created, existing ones updated. Fields of a parent which aren't given
+are kept, the stock of the given sizes is set and missing images are added.
+
+Records are read lazily and written in batches, each in its own transaction
+with a few bulk queries per model, so the memory is bounded by the batch size
+(plus the pks of the touched parents and the slugs of the records).
+Records whose slug is taken by another Product are reported as errors,
+and so are the records of a batch failed in the db, the other batches are kept.
+Bulk queries don't send signals, so the data which signals keep in sync
+is updated once at the end, also after a failure:
+all_products_json of the touched parents (see products.siblings), the search
+index, autocomplete, spelling, product cards and the inventory index. Stock totals
+and effective prices are kept in sync by the bulk methods of the querysets.
+"""
+from __future__ import annotations
+
+import csv
+import json
+from collections import Counter
+from decimal import Decimal, InvalidOperation
+from typing import IO, Callable, Iterable, Iterator
+
+from django.db import DatabaseError, transaction
+from django.utils.text import slugify
+
+from products import autocomplete, cards, inventory_index, page_cache, price_bounds, search, siblings, spelling
+from products.models import Campaign, Category, Color, Image, ParentProduct, Product, Size, Stock
+
+FORMATS = ("csv", "jsonl")
+# optional fields of ParentProduct, kept when not given
+PARENT_FIELDS = ("category_id", "campaign_id", "description", "fabric_info", "sizes_info", "search_keywords")
+PRODUCT_FIELDS = ("color_id", "price", "discounted_price", "main_image")
+# parents rebuilt at once at the end
+REBUILD_BATCH_SIZE = 1000
+# errors kept for the report, the rest is only counted
+MAX_ERRORS = 100
+
+
+class RecordError(ValueError):
+    pass
+
+
+def read_records(file: IO[str], format: str) -> Iterator[tuple[int, dict | str]]:
+    """ (line number, record) for every record, JSONL records are decoded by clean(). """
+    if format == "csv":
+        reader = csv.DictReader(file)
+        for record in reader:
+            yield reader.line_num, record
+    else:
+        for line_number, line in enumerate(file, 1):
+            if line.strip():
+                yield line_number, line
+
+
+def _text(data: dict, name: str, max_length: int | None = None) -> str | None:
+    value = data.get(name)
+    if value is None:
+        return None
+    if not isinstance(value, str):
+        raise RecordError("%s: a string expected" % name)
+    value = value.strip()
+    if max_length and len(value) > max_length:
+        raise RecordError("%s: longer than %s characters" % (name, max_length))
+    return value or None
+
+
+def _price(data: dict, name: str) -> Decimal | None:
+    value = data.get(name)
+    if value in (None, ""):
+        return None
+    try:
+        price = Decimal(str(value)).quantize(Decimal("0.01"))
+    except InvalidOperation:
+        raise RecordError("%s: invalid price %r" % (name, value))
+    if price <= 0:
+        raise RecordError("%s: must be positive" % name)
+    return price
+
+
+def _stock(value) -> dict[str, int]:
+    """ {size name: quantity} or, in CSV, "S=2;M=0". """
+    if value in (None, ""):
+        return {}
+    if isinstance(value, str):
+        try:
+            value = dict(item.rsplit("=", 1) for item in value.split(";") if item.strip())
+        except ValueError:
+            raise RecordError("stock: 'size=quantity' items separated by ';' expected")
+    if not isinstance(value, dict):
+        raise RecordError("stock: an object expected")
+    try:
+        stock = {str(size).strip(): int(quantity) for size, quantity in value.items()}
+    except (TypeError, ValueError):
+        raise RecordError("stock: quantities have to be integers")
+    if any(quantity < 0 for quantity in stock.values()):
+        raise RecordError("stock: quantities can't be negative")
+    return stock
+
+
+def _images(value) -> list[str]:
+    if value in (None, ""):
+        return []
+    if isinstance(value, str):
+        value = value.split()
+    if not isinstance(value, list) or not all(isinstance(image, str) for image in value):
+        raise RecordError("images: a list of strings expected")
+    return value
+
+
+def _image(value) -> str:
+    """ As stored in the db, f.e. 'abc' -> 'image/upload/abc'. """
+    field = Product._meta.get_field("main_image")
+    return field.get_prep_value(field.to_python(value))
+
+
+class CatalogImporter:
+    def __init__(self, batch_size: int = 1000):
+        self.batch_size = batch_size
+        self.categories = dict(Category.objects.values_list("name", "pk"))
+        self.campaigns = dict(Campaign.objects.values_list("name", "pk"))
+        self.colors = dict(Color.objects.values_list("name", "pk"))
+        self.sizes = dict(Size.objects.values_list("name", "pk"))
+        self.stats = Counter()
+        self.errors: list[tuple[int, str]] = []
+        # parents of the written Products
+        self.parents: set[int] = set()
+        # {slug: (parent, style)} of the cleaned records
+        self.slugs: dict[str, tuple[str, str]] = {}
+
+    def run(self, records: Iterable[tuple[int, dict | str]], on_batch: Callable | None = None) -> Counter:
+        """ Import the records, 'on_batch' is called with the stats after every batch. """
+        batch = []
+        try:
+            for line_number, data in records:
+                self.stats["records"] += 1
+                try:
+                    record = self.clean(data)
+                except RecordError as error:
+                    self.add_error(line_number, str(error))
+                    continue
+                record["line_number"] = line_number
+                batch.append(record)
+                if len(batch) >= self.batch_size:
+                    self.write_batch(batch, on_batch)
+                    batch = []
+            if batch:
+                self.write_batch(batch, on_batch)
+        finally:
+            # the batches written so far
+            self.finish()
+
+        return self.stats
+
+    def write_batch(self, records: list[dict], on_batch: Callable | None = None):
+        """ write() the records, a failure in the db is reported as errors of all of them. """
+        records = self.check_slugs(records)
+        stats = self.stats.copy()
+        try:
+            self.write(records)
+        except DatabaseError as error:
+            # rolled back, so are the stats
+            self.stats.clear()
+            self.stats.update(stats)
+            for record in records:
+                self.add_error(record["line_number"], "not written, the batch failed: %s" % error)
+        if on_batch:
+            on_batch(self.stats)
+
+    def add_error(self, line_number: int, message: str):
+        self.stats["errors"] += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append((line_number, message))
+
+    def clean(self, data: dict | str) -> dict:
+        """ The record with names resolved to pks, raises RecordError. """
+        if isinstance(data, str):
+            try:
+                data = json.loads(data)
+            except ValueError as error:
+                raise RecordError("invalid JSON: %s" % error)
+        if not isinstance(data, dict):
+            raise RecordError("an object expected")
+
+        record = {
+            "parent": _text(data, "parent", ParentProduct._meta.get_field("name").max_length),
+            "style": _text(data, "style", Product._meta.get_field("style").max_length),
+            "price": _price(data, "price"),
+            "discounted_price": _price(data, "discounted_price"),
+            "main_image": _text(data, "main_image"),
+        }
+        for name in ("parent", "style", "price", "main_image"):
+            if record[name] is None:
+                raise RecordError("%s: required" % name)
+        # f.e. "Dress A" with style "b" and "Dress" with style "a b"
+        record["slug"] = slugify("%s %s" % (record["parent"], record["style"]))
+        other = self.slugs.setdefault(record["slug"], (record["parent"], record["style"]))
+        if other != (record["parent"], record["style"]):
+            raise RecordError("slug %r: already used by parent %r with style %r" % (record["slug"], *other))
+        if record["discounted_price"] is not None and record["discounted_price"] >= record["price"]:
+            raise RecordError("discounted_price: must be lower than price")
+        record["main_image"] = _image(record["main_image"])
+
+        lookups = (("category", self.categories), ("campaign", self.campaigns), ("color", self.colors))
+        for name, lookup in lookups:
+            value = _text(data, name)
+            if value is not None and value not in lookup:
+                raise RecordError("%s: unknown %r" % (name, value))
+            record["%s_id" % name] = lookup.get(value)
+        for name in PARENT_FIELDS[2:]:
+            record[name] = _text(data, name)
+
+        stock = _stock(data.get("stock"))
+        unknown = set(stock) - set(self.sizes)
+        if unknown:
+            raise RecordError("stock: unknown sizes %s" % ", ".join(sorted(unknown)))
+        record["stock"] = {self.sizes[size]: quantity for size, quantity in stock.items()}
+        record["images"] = [_image(image) for image in _images(data.get("images"))]
+
+        return record
+
+    def check_slugs(self, records: list[dict]) -> list[dict]:
+        """ The records without those whose slug is used by another Product in the db. """
+        existing = {
+            slug: (parent, style)
+            for slug, parent, style in Product.objects.filter(slug__in={record["slug"] for record in records})
+            .values_list("slug", "parent__name", "style")
+        }
+        checked = []
+        for record in records:
+            other = existing.get(record["slug"], (record["parent"], record["style"]))
+            # an existing Product of the record keeps its slug
+            if other != (record["parent"], record["style"]) and not Product.objects.filter(
+                parent__name=record["parent"], style=record["style"]
+            ).exists():
+                self.add_error(
+                    record["line_number"],
+                    "slug %r: already used by parent %r with style %r" % (record["slug"], *other),
+                )
+            else:
+                checked.append(record)
+
+        return checked
+
+    def write(self, records: list[dict]):
+        with transaction.atomic():
+            parents = self._write_parents(records)
+            for record in records:
+                record["key"] = (parents[record["parent"]], record["style"])
+            products = self._write_products(records)
+            self._write_stock(records, products)
+            self._write_images(records, products)
+        self.parents.update(parents.values())
+
+    def _write_parents(self, records: list[dict]) -> dict[str, int]:
+        """ Returns {name: pk} of the parents of the records. """
+        values = {}
+        for record in records:
+            given = {field: record[field] for field in PARENT_FIELDS if record[field] is not None}
+            values.setdefault(record["parent"], {}).update(given)
+
+        existing = {parent.name: parent for parent in ParentProduct.objects.filter(name__in=values)}
+        changed, created = [], []
+        for name, given in values.items():
+            parent = existing.get(name)
+            if parent is None:
+                created.append(ParentProduct(name=name, **given))
+            elif any(getattr(parent, field) != value for field, value in given.items()):
+                for field, value in given.items():
+                    setattr(parent, field, value)
+                changed.append(parent)
+
+        if changed:
+            ParentProduct.objects.bulk_update(changed, PARENT_FIELDS)
+        if created:
+            ParentProduct.objects.bulk_create(created)
+        self.stats["parents_created"] += len(created)
+        self.stats["parents_updated"] += len(changed)
+
+        pks = {name: parent.pk for name, parent in existing.items()}
+        pks.update((parent.name, parent.pk) for parent in created)
+        if None in pks.values():
+            # the db doesn't return pks of inserted rows
+            pks = dict(ParentProduct.objects.filter(name__in=values).values_list("name", "pk"))
+        return pks
+
+    def _find_products(self, keys) -> Iterable[Product]:
+        return (
+            product for product in Product.objects.filter(
+                parent__in={parent for parent, _ in keys}, style__in={style for _, style in keys}
+            ).only("pk", "parent_id", "style", *PRODUCT_FIELDS)
+            if (product.parent_id, product.style) in keys
+        )
+
+    def _write_products(self, records: list[dict]) -> dict[tuple[int, str], int]:
+        """ Returns {(parent pk, style): pk} of the Products of the records. """
+        # the last record of a Product wins
+        values = {record["key"]: {field: record[field] for field in PRODUCT_FIELDS} for record in records}
+        slugs = {record["key"]: record["slug"] for record in records}
+
+        existing = {(product.parent_id, product.style): product for product in self._find_products(values)}
+        changed, created = [], []
+        for (parent, style), given in values.items():
+            product = existing.get((parent, style))
+            if product is None:
+                created.append(Product(parent_id=parent, style=style, slug=slugs[(parent, style)], **given))
+                continue
+            loaded = {field: getattr(product, field) for field in PRODUCT_FIELDS}
+            loaded["main_image"] = _image(loaded["main_image"])
+            if loaded != given:
+                for field, value in given.items():
+                    setattr(product, field, value)
+                changed.append(product)
+
+        if changed:
+            Product.objects.bulk_update(changed, PRODUCT_FIELDS)
+        if created:
+            Product.objects.bulk_create(created)
+        self.stats["products_created"] += len(created)
+        self.stats["products_updated"] += len(changed)
+
+        pks = {key: product.pk for key, product in existing.items()}
+        pks.update(((product.parent_id, product.style), product.pk) for product in created)
+        if None in pks.values():
+            pks = {(product.parent_id, product.style): product.pk for product in self._find_products(values)}
+        return pks
+
+    def _write_stock(self, records: list[dict], products: dict[tuple[int, str], int]):
+        quantities = {}
+        for record in records:
+            for size, quantity in record["stock"].items():
+                quantities[(products[record["key"]], size)] = quantity
+        if not quantities:
+            return
+
+        existing = {}
+        for stock in Stock.objects.filter(product__in={product for product, _ in quantities}):
+            existing.setdefault((stock.product_id, stock.size_id), stock)
+        changed, created = [], []
+        for (product, size), quantity in quantities.items():
+            stock = existing.get((product, size))
+            if stock is None:
+                created.append(Stock(product_id=product, size_id=size, quantity=quantity))
+            elif stock.quantity != quantity:
+                stock.quantity = quantity
+                changed.append(stock)
+
+        # totals of Products are updated by StockQueryset
+        if changed:
+            Stock.objects.bulk_update(changed, ["quantity"])
+        if created:
+            Stock.objects.bulk_create(created)
+        self.stats["stock_written"] += len(changed) + len(created)
+
+    def _write_images(self, records: list[dict], products: dict[tuple[int, str], int]):
+        urls = {(products[record["key"]], url) for record in records for url in record["images"]}
+        if not urls:
+            return
+
+        existing = {
+            (product, _image(url))
+            for product, url in Image.objects.filter(product__in={product for product, _ in urls}).values_list(
+                "product_id", "url"
+            )
+        }
+        created = Image.objects.bulk_create(
+            Image(product_id=product, url=url) for product, url in sorted(urls - existing)
+        )
+        self.stats["images_created"] += len(created)
+
+    def finish(self):
+        """ Update the data which signals would have updated. """
+        parents = sorted(self.parents)
+        for start in range(0, len(parents), REBUILD_BATCH_SIZE):
+            chunk = parents[start:start + REBUILD_BATCH_SIZE]
+            self.stats["siblings_rebuilt"] += len(siblings.rebuild(chunk))
+            search.update(lambda chunk=chunk: chunk)
+        if parents:
+            autocomplete.invalidate_on_commit()
+            cards.invalidate_all()
+            inventory_index.invalidate_on_commit()
+            page_cache.invalidate()
+            price_bounds.invalidate()
+            spelling.invalidate()
@@ -0,0 +1,35 @@
+"""
+System checks of the settings the products app relies on.
+"""
+from django.conf import settings
+from django.core.checks import Warning, register
+
+# backends keeping a separate cache in every process
+PER_PROCESS_CACHES = (
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+)
+
+
+@register()
+def check_shared_cache(app_configs, **kwargs):
+    """
+    Versions of cached data (see products.cache_versions), counters of views,
+    the time of the last update of trending scores, locks of cached pages
+    and ETags are kept in the default cache and have to be seen by every process.
+    """
+    backend = settings.CACHES.get("default", {}).get("BACKEND")
+    if backend not in PER_PROCESS_CACHES:
+        return []
+
+    return [
+        Warning(
+            "The default cache (%s) isn't shared between processes." % backend,
+            hint=(
+                "Invalidations of cached catalog data, counted views and cache locks "
+                "won't reach other processes, use it only with a single process. "
+                "Set CACHE_URL to a Redis or Memcached server."
+            ),
+            id="products.W001",
+        )
+    ]
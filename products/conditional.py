@@ -0,0 +1,60 @@
+"""
+ETags of product pages, lists and the main page, so revalidations
+(If-None-Match) of returning visitors and crawlers get a 304
+after a single cache lookup, without any db query or rendering.
+
+ETags are hashes of the versions (see products.cache_versions)
+of the data shown on a page:
+- lists and the main page: the "catalog" version (see products.page_cache)
+  and the period of PRODUCTS_PAGE_CACHE_TIMEOUT, so changes without signals
+  (f.e. starts of campaigns) are reflected like in cached pages,
+- product pages: the render version of the Product (see products.cards),
+  the taxonomy (breadcrumbs) and all cards (names of sizes), with the period
+  of PRODUCTS_CARD_TIMEOUT (f.e. for bulk updates of stock). Pages are looked
+  up by slug, so the pk of the Product is a part of its ETag, f.e. "12-3f2a..".
+
+Last-Modified isn't sent, the versions aren't timestamps.
+"""
+from __future__ import annotations
+
+import hashlib
+import re
+import time
+
+from django.http import HttpRequest
+from django.utils.cache import parse_etags
+
+from products import cache_versions, cards, page_cache, taxonomy
+
+PRODUCT_ETAG = re.compile(r"^(?:W/)?\"(\d+)-")
+
+
+def make_hash(*parts) -> str:
+    return hashlib.md5(":".join(map(str, parts)).encode()).hexdigest()
+
+
+def get_period(timeout: int | None) -> int:
+    return int(time.time() // timeout) if timeout else 0
+
+
+def catalog_etag(*parts) -> str:
+    """ Of a page showing the catalog, 'parts' tell the pages apart (f.e. the URL). """
+    return '"%s"' % make_hash(
+        cache_versions.get_version(page_cache.VERSION), get_period(page_cache.get_timeout()), *parts
+    )
+
+
+def product_etag(pk: int, slug: str) -> str:
+    names = [cards.product_version(pk), taxonomy.VERSION, cards.VERSION]
+    versions = cache_versions.get_versions(names)
+
+    digest = make_hash(slug, get_period(cards.get_timeout()), *(versions[name] for name in names))
+
+    return '"%s-%s"' % (pk, digest)
+
+
+def requested_product(request: HttpRequest) -> int | None:
+    """ The pk of the Product in If-None-Match, if it's an ETag of a product page. """
+    for etag in parse_etags(request.META.get("HTTP_IF_NONE_MATCH", "")):
+        if match := PRODUCT_ETAG.match(etag):
+            return int(match[1])
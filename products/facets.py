@@ -0,0 +1,69 @@
+from django.db.models import Count, F, QuerySet
+from django.db.models.functions import Floor
+
+from products.filter import ProductFilter
+from products.models import Stock
+
+PRICE_FILTERS = ("price_gte", "price_lte")
+
+
+class ProductFacets:
+    """
+    Counts of results for the options in the filter panel.
+
+    Every facet is computed with one grouped query over the listing scope
+    (all available products, a category, a campaign or search results)
+    with all filters applied except its own one (disjunctive faceting),
+    f.e. when color=1 is selected, other colors still show how many results
+    they would add, while sizes are counted only among red products.
+    """
+    price_bucket_size = 50
+
+    def __init__(self, queryset: QuerySet, product_filter: ProductFilter):
+        self.queryset = queryset.order_by()
+        self.product_filter = product_filter
+
+    def _filtered(self, *exclude: str):
+        return self.queryset.filter(self.product_filter.get_Q(exclude=exclude))
+
+    def get_color_counts(self) -> dict[int, int]:
+        """ {color_pk: number of products} """
+        return dict(
+            self._filtered("color").values_list("color").annotate(count=Count("pk"))
+        )
+
+    def get_size_counts(self) -> dict[int, int]:
+        """ {size_pk: number of products available in the size} """
+        products = self._filtered("size").values("pk")
+
+        return dict(
+            Stock.objects.filter(quantity__gt=0, product__in=products).order_by().values_list(
+                "size"
+            ).annotate(count=Count("product", distinct=True))
+        )
+
+    def get_price_histogram(self) -> list[dict]:
+        """
+        Number of products per price range of 'price_bucket_size',
+        f.e. [{"min": 0, "max": 50, "count": 4, "height": 100}, ...]
+        'height' is the count as a percentage of the highest one,
+        empty ranges are included.
+        """
+        counts = dict(
+            self._filtered(*PRICE_FILTERS).annotate(
+                bucket=Floor(F("effective_price") / self.price_bucket_size)
+            ).values_list("bucket").annotate(count=Count("pk"))
+        )
+        if not counts:
+            return []
+
+        highest = max(counts.values())
+        return [
+            {
+                "min": bucket * self.price_bucket_size,
+                "max": (bucket + 1) * self.price_bucket_size,
+                "count": counts.get(bucket, 0),
+                "height": round(100 * counts.get(bucket, 0) / highest),
+            }
+            for bucket in range(int(min(counts)), int(max(counts)) + 1)
+        ]
@@ -1,9 +1,20 @@
-from django.db.models import Q
+from typing import Iterable
+
+from django.db.models import Exists, OuterRef, Q
+
+from products.models import Stock
 
 
 class ProductFilter:
+    # params with a list of ids, the others take only the first one
+    list_params = ("color", "size")
+
     def __init__(self, **kwargs):
-        self._q = Q()
+        # Q objects stored per query param, so that a single filter
+        # can be left out when needed (see ProductFacets)
+        self._filters = {}
+        # validated values per query param (see InventoryIndex.resolve)
+        self._values = {}
 
         for k, v in kwargs.items():
             # in frontend, param values are represented as a string separated by commas, f.e.:
@@ -12,6 +23,7 @@ class ProductFilter:
             v = self.validate(v)
             if hasattr(self, "set_%s_filter" % k) and v:
                 getattr(self, "set_%s_filter" % k)(v)
+                self._values[k] = v
 
     @staticmethod
     def validate(param_values: list[str]):
@@ -21,29 +33,50 @@ class ProductFilter:
             return
 
     def set_price_gte_filter(self, price: list[int]):
-        self._q &= (
-                (Q(price__gte=price[0]) & Q(discounted_price__isnull=True)) |
-                Q(discounted_price__gte=price[0])
-        )
+        self._filters["price_gte"] = Q(effective_price__gte=price[0])
 
     def set_price_lte_filter(self, price: list[int]):
-        self._q &= (
-                (Q(price__lte=price[0]) & Q(discounted_price__isnull=True)) |
-                Q(discounted_price__lte=price[0])
-        )
+        self._filters["price_lte"] = Q(effective_price__lte=price[0])
 
     def set_color_filter(self, color: list[int]):
         if len(color) > 1:
-            self._q &= Q(color__in=color)
+            self._filters["color"] = Q(color__in=color)
         else:
-            self._q &= Q(color=color[0])
+            self._filters["color"] = Q(color=color[0])
 
     def set_size_filter(self, size: list[int]):
+        # a semi-join instead of joining Stock, so that no DISTINCT is needed
         if len(size) > 1:
-            q = Q(stock__size__in=size)
+            stock = Stock.objects.filter(size__in=size)
         else:
-            q = Q(stock__size=size[0])
-        self._q &= q & Q(stock__quantity__gt=0)
+            stock = Stock.objects.filter(size=size[0])
+        self._filters["size"] = Q(Exists(
+            stock.filter(product=OuterRef("pk"), quantity__gt=0)
+        ))
+
+    def get_values(self):
+        return self._values
+
+    def get_params(self) -> dict[str, str]:
+        """
+        Query params of the applied filters in a canonical form,
+        ids sorted and without duplicates, f.e. {"color": "3,5,7"}.
+        """
+        params = {}
+        for name, values in self._values.items():
+            values = sorted(set(values)) if name in self.list_params else values[:1]
+            params[name] = ",".join(map(str, values))
+
+        return params
+
+    def get_Q(self, exclude: Iterable[str] = ()):
+        """
+        Returns all filters combined,
+        except the ones named in 'exclude' (f.e. ['color']).
+        """
+        q = Q()
+        for name, filter_q in self._filters.items():
+            if name not in exclude:
+                q &= filter_q
 
-    def get_Q(self):
-        return self._q
+        return q
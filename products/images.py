@@ -0,0 +1,156 @@
+"""
+URLs and <img> tags of Cloudinary images in templates.
+
+The {% cloudinary %} tag builds the URL of an image on every render,
+parsing the options and formatting the transformation (about 0.1 ms),
+and a list page shows up to 24 main images and 120 thumbnails of siblings.
+URLs are memoized per process in a bounded LRU keyed by
+(public_id, transformation), so each one is built once, and so are the tags.
+Transformations used by templates are named VARIANTS.
+
+Every variant has a ladder of widths for srcset, with 'sizes' matching
+the layout of the templates, so browsers download the smallest sufficient
+image instead of f.e. 615x1000 for a 60x80 swatch or a phone grid.
+All URLs ask for f_auto (WebP/AVIF where supported) and q_auto.
+
+URLs are always https, so they don't depend on the request
+and can be cached in fragments (see products.cards).
+They are built by settings.PRODUCTS_IMAGE_URL_BUILDER, local_url()
+is a stand-in for development and tests without a Cloudinary account.
+"""
+from __future__ import annotations
+
+from functools import lru_cache
+from typing import NamedTuple
+
+from cloudinary import CloudinaryResource
+from django.conf import settings
+from django.forms.utils import flatatt
+from django.utils.html import format_html
+from django.utils.module_loading import import_string
+from django.utils.safestring import SafeString, mark_safe
+
+# added to every transformation
+FORMAT = (("fetch_format", "auto"), ("quality", "auto"))
+
+
+class Variant(NamedTuple):
+    # sorted tuple of options of the default src, so it can be a key of the LRU
+    transformation: tuple
+    # widths of srcset, heights follow the aspect ratio of the transformation
+    widths: tuple[int, ...]
+    sizes: str
+
+
+VARIANTS = {
+    # main images of cards, see the grids of product lists and the carousels of the main page
+    "card": Variant(
+        (("crop", "fill"), ("gravity", "auto"), ("height", 1000), ("width", 615)),
+        (240, 320, 480, 615, 820),
+        "(min-width: 1280px) 21vw, (min-width: 1024px) 25vw, (min-width: 768px) 33vw, 50vw",
+    ),
+    # images of product pages, in two columns on large screens
+    "detail": Variant(
+        (("crop", "fill"), ("gravity", "auto"), ("height", 1000), ("width", 615)),
+        (480, 615, 820, 1230),
+        "(min-width: 1280px) 33vw, (min-width: 1024px) 29vw, (min-width: 768px) 50vw, 100vw",
+    ),
+    # images of siblings
+    "thumbnail": Variant(
+        (("crop", "fill"), ("gravity", "auto"), ("height", 80), ("width", 60)),
+        (60, 120),
+        "60px",
+    ),
+    # campaigns on the main page, in two columns on large screens
+    "campaign": Variant(
+        (("crop", "fill"), ("gravity", "auto")),
+        (640, 960, 1280, 1920),
+        "(min-width: 1024px) 50vw, 100vw",
+    ),
+    # the header of a campaign
+    "original": Variant((), (640, 960, 1280, 1920), "100vw"),
+}
+# URLs kept per process, roughly 150 bytes each
+MAX_URLS = 50_000
+# options in URLs of local_url()
+SHORT_OPTIONS = {"crop": "c", "fetch_format": "f", "gravity": "g", "height": "h", "quality": "q", "width": "w"}
+
+
+def cloudinary_url(public_id: str, transformation: tuple) -> str:
+    return CloudinaryResource(public_id).build_url(secure=True, **dict(transformation))
+
+
+def local_url(public_id: str, transformation: tuple) -> str:
+    """ f.e. /media/images/c_fill,g_auto,h_80,w_60/abc """
+    options = ",".join("%s_%s" % (SHORT_OPTIONS.get(name, name), value) for name, value in transformation)
+    return "%simages/%s/%s" % (settings.MEDIA_URL, options, public_id)
+
+
+def get_builder() -> str:
+    return getattr(settings, "PRODUCTS_IMAGE_URL_BUILDER", "products.images.cloudinary_url")
+
+
+@lru_cache(maxsize=MAX_URLS)
+def build_url(public_id: str, transformation: tuple, builder: str) -> str:
+    return import_string(builder)(public_id, transformation)
+
+
+def ladder(variant: Variant) -> list[tuple[int, tuple]]:
+    """ (width, transformation) for every width of srcset. """
+    options = dict(variant.transformation)
+    steps = []
+    for width in variant.widths:
+        if "height" in options:
+            step = {**options, "width": width, "height": round(width * options["height"] / options["width"])}
+        else:
+            # never upscaled
+            step = {**options, "crop": "limit", "width": width}
+        steps.append((width, tuple(sorted({**step, **dict(FORMAT)}.items()))))
+
+    return steps
+
+
+def url(public_id: str, variant: str) -> str:
+    """ The default src of the variant. """
+    transformation = tuple(sorted({**dict(VARIANTS[variant].transformation), **dict(FORMAT)}.items()))
+    return build_url(public_id, transformation, get_builder())
+
+
+def srcset(public_id: str, variant: str) -> str:
+    builder = get_builder()
+    return ", ".join(
+        "%s %sw" % (build_url(public_id, transformation, builder), width)
+        for width, transformation in ladder(VARIANTS[variant])
+    )
+
+
+def img(public_id: str | None, variant: str, **attrs) -> SafeString:
+    """
+    <img> with src, srcset and sizes of the variant, width and height
+    of its transformation (cropped images have exactly that size)
+    and 'attrs', f.e. class or loading ("lazy" for images below the fold).
+    """
+    if not public_id:
+        return mark_safe("")
+    return _img(public_id, variant, tuple(sorted(attrs.items())), get_builder())
+
+
+@lru_cache(maxsize=MAX_URLS)
+def _img(public_id: str, variant: str, attrs: tuple, builder: str) -> SafeString:
+    transformation = dict(VARIANTS[variant].transformation)
+    attrs = {
+        **dict(attrs),
+        "height": transformation.get("height"),
+        "sizes": VARIANTS[variant].sizes,
+        "src": url(public_id, variant),
+        "srcset": srcset(public_id, variant),
+        "width": transformation.get("width"),
+    }
+
+    return format_html("<img{}/>", flatatt({name: value for name, value in sorted(attrs.items()) if value}))
+
+
+def clear():
+    """ Drop memoized URLs and tags, f.e. after the Cloudinary config has changed. """
+    build_url.cache_clear()
+    _img.cache_clear()
@@ -0,0 +1,273 @@
+"""
+An optional in-process index of Products used by list views
+to resolve filters without joining stock, parent products and categories.
+
+Every set of Products (per color, per size, per category subtree,
+per campaign, plus the set of all available Products) is stored as a bitset,
+a python int with bit n set when Product with pk=n belongs to the set,
+so filtering is just a few bitwise AND/OR operations.
+The db is used only to fetch the rows of a single page.
+
+It is enabled with settings.PRODUCTS_INVENTORY_INDEX = True.
+The index is built lazily on the first use and then kept up to date
+by the signals in products.signals. Each process keeps its own copy,
+so it's meant for deployments where catalog writes go through
+the same processes that serve the listings (or are followed by a restart).
+"""
+from __future__ import annotations
+
+import sys
+import threading
+from collections import defaultdict
+from typing import Iterable, NamedTuple
+
+from django.conf import settings
+from django.db import transaction
+
+from products.models import Category, Product, Stock
+
+# positions of set bits for every byte value, f.e. 0b101 -> (0, 2)
+_BYTE_BITS = tuple(
+    tuple(bit for bit in range(8) if byte >> bit & 1) for byte in range(256)
+)
+
+
+def iter_bits(bits: int):
+    """ Yields positions of the set bits in ascending order. """
+    data = bits.to_bytes((bits.bit_length() + 7) // 8, "little")
+    for byte_index, byte in enumerate(data):
+        if byte:
+            base = byte_index * 8
+            for bit in _BYTE_BITS[byte]:
+                yield base + bit
+
+
+def union(bitsets: Iterable[int]) -> int:
+    bits = 0
+    for bitset in bitsets:
+        bits |= bitset
+    return bits
+
+
+class IndexEntry(NamedTuple):
+    """ Data of a single Product kept in the index. """
+    color: int | None
+    sizes: frozenset
+    category: int | None
+    campaign: int | None
+    trending: float
+    effective_price: object
+
+
+class InventoryIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        # not while another thread resolves or updates the index
+        with self._lock:
+            self.built = False
+            self.available = 0
+            self.by_color = defaultdict(int)
+            self.by_size = defaultdict(int)
+            self.by_category = defaultdict(int)
+            self.by_campaign = defaultdict(int)
+            self.entries: dict[int, IndexEntry] = {}
+            # category pk -> pks of the category and all its ancestors
+            self.category_ancestors: dict[int, tuple[int, ...]] = {}
+
+    def build(self):
+        with self._lock:
+            self.clear()
+            self._load_categories()
+            self._index_products(Product.objects.all(), Stock.objects.all())
+            self.built = True
+
+        return self
+
+    def reindex(self, pks: Iterable[int]):
+        """ Re-read the given Products from the db (missing ones are removed). """
+        pks = set(pks)
+        if not pks:
+            return
+        with self._lock:
+            for pk in pks:
+                self._remove(pk)
+            self._index_products(
+                Product.objects.filter(pk__in=pks), Stock.objects.filter(product__in=pks)
+            )
+
+    def remove(self, pk: int):
+        with self._lock:
+            self._remove(pk)
+
+    def resolve(
+            self,
+            product_filter,
+            ordering: str = "-trending",
+            category: int | None = None,
+            campaign: int | None = None,
+    ) -> list[int]:
+        """
+        Returns primary keys of available Products matching the filter
+        and the scope (a category subtree or a campaign), ordered
+        the same way as in the list views: by 'ordering' with pk as a tie-breaker.
+        """
+        values = product_filter.get_values()
+        with self._lock:
+            bits = self.available
+            if "color" in values:
+                bits &= union(self.by_color.get(pk, 0) for pk in values["color"])
+            if "size" in values:
+                bits &= union(self.by_size.get(pk, 0) for pk in values["size"])
+            if category is not None:
+                bits &= self.by_category.get(category, 0)
+            if campaign is not None:
+                bits &= self.by_campaign.get(campaign, 0)
+
+            entries = self.entries
+            pks = list(iter_bits(bits))
+            if "price_gte" in values:
+                pks = [pk for pk in pks if entries[pk].effective_price >= values["price_gte"][0]]
+            if "price_lte" in values:
+                pks = [pk for pk in pks if entries[pk].effective_price <= values["price_lte"][0]]
+
+            field = ordering.lstrip("-")
+            if field not in ("pk", "id"):
+                pks.sort(key=lambda pk: (getattr(entries[pk], field), pk))
+            if ordering.startswith("-"):
+                pks.reverse()
+
+        return pks
+
+    def memory_footprint(self) -> dict:
+        """ Approximate size of the index in bytes. """
+        with self._lock:
+            bitsets = [self.available]
+            for bitsets_by_key in (self.by_color, self.by_size, self.by_category, self.by_campaign):
+                bitsets.extend(bitsets_by_key.values())
+            bitsets_size = sum(sys.getsizeof(bitset) for bitset in bitsets)
+            entries_size = sys.getsizeof(self.entries) + sum(
+                sys.getsizeof(entry) + sys.getsizeof(entry.sizes) for entry in self.entries.values()
+            )
+
+            return {
+                "products": len(self.entries),
+                "bitsets": len(bitsets),
+                "bitsets_bytes": bitsets_size,
+                "entries_bytes": entries_size,
+                "total_bytes": bitsets_size + entries_size,
+            }
+
+    def _load_categories(self):
+        parents = dict(Category.objects.values_list("pk", "parent_id"))
+        for pk in parents:
+            ancestors, current = [], pk
+            while current is not None and current not in ancestors:
+                ancestors.append(current)
+                current = parents.get(current)
+            self.category_ancestors[pk] = tuple(ancestors)
+
+    def _index_products(self, products, stock):
+        sizes = defaultdict(set)
+        for product_id, size_id in stock.filter(quantity__gt=0).values_list("product_id", "size_id"):
+            sizes[product_id].add(size_id)
+
+        for pk, color, category, campaign, trending, effective_price in products.values_list(
+                "pk", "color_id", "parent__category_id", "parent__campaign_id",
+                "trending", "effective_price",
+        ).order_by():
+            self._add(pk, IndexEntry(
+                color, frozenset(sizes[pk]), category, campaign, trending, effective_price
+            ))
+
+    def _add(self, pk: int, entry: IndexEntry):
+        bit = 1 << pk
+        self.entries[pk] = entry
+        if entry.sizes:
+            self.available |= bit
+        if entry.color is not None:
+            self.by_color[entry.color] |= bit
+        for size in entry.sizes:
+            self.by_size[size] |= bit
+        for category in self.category_ancestors.get(entry.category, ()):
+            self.by_category[category] |= bit
+        if entry.campaign is not None:
+            self.by_campaign[entry.campaign] |= bit
+
+    def _remove(self, pk: int):
+        entry = self.entries.pop(pk, None)
+        if entry is None:
+            return
+        mask = ~(1 << pk)
+        self.available &= mask
+        if entry.color is not None:
+            self.by_color[entry.color] &= mask
+        for size in entry.sizes:
+            self.by_size[size] &= mask
+        for category in self.category_ancestors.get(entry.category, ()):
+            self.by_category[category] &= mask
+        if entry.campaign is not None:
+            self.by_campaign[entry.campaign] &= mask
+
+
+_index = InventoryIndex()
+
+
+def is_enabled() -> bool:
+    return getattr(settings, "PRODUCTS_INVENTORY_INDEX", False)
+
+
+def get_index() -> InventoryIndex:
+    """ Returns the index of this process, building it on the first call. """
+    if not _index.built:
+        _index.build()
+    return _index
+
+
+def invalidate():
+    """ Drop the index, it will be rebuilt on the next use. """
+    _index.clear()
+
+
+def reindex_on_commit(get_pks):
+    """
+    Update the index with the given Products once the current transaction
+    is committed, so that rolled back changes never get into the index.
+    'get_pks' is a callable, so the pks can be fetched lazily.
+    Nothing to do if the index hasn't been built yet.
+    """
+    if is_enabled() and _index.built:
+        transaction.on_commit(lambda: _index.reindex(get_pks()))
+
+
+def invalidate_on_commit():
+    if is_enabled() and _index.built:
+        transaction.on_commit(invalidate)
+
+
+class IndexedProducts:
+    """
+    A lazy sequence of Products resolved by the index.
+    Only the sliced part (f.e. a page in django Paginator)
+    is fetched from the db, with 'queryset' used for fetching.
+    """
+    def __init__(self, pks: list[int], queryset):
+        self.pks = pks
+        self.queryset = queryset
+
+    def count(self):
+        return len(self.pks)
+
+    def __len__(self):
+        return len(self.pks)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            pks = self.pks[index]
+            # ordered by 'pks' below
+            products = self.queryset.order_by().in_bulk(pks)
+            return [products[pk] for pk in pks if pk in products]
+
+        return self.queryset.get(pk=self.pks[index])
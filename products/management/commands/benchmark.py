@@ -0,0 +1,238 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import RequestFactory
+
+from cloudinary import CloudinaryResource
+
+from products import autocomplete, benchmarks, images, search, spelling, views
+from products.facets import ProductFacets
+from products.models import Campaign, Category, ParentProduct, Product
+from products.pagination import CursorPaginator
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures query plans and timings of the product listings on a synthetic catalog. "
+        "The catalog is created in a transaction which is rolled back at the end, "
+        "so it's safe to run against any database, f.e. a PostgreSQL copy of production."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("target", choices=["listing", "autocomplete", "spelling", "images"])
+        parser.add_argument("--products", type=int, default=100_000, help="Number of Products to create.")
+        parser.add_argument("--repeat", type=int, default=5, help="Runs of each query, the median is reported.")
+        parser.add_argument("--depth", type=int, default=100, help="Page number used as a 'deep' page.")
+        parser.add_argument("--explain", action="store_true", help="Print query plans.")
+        parser.add_argument(
+            "--no-seed", action="store_true", help="Use the existing data instead of a synthetic catalog."
+        )
+
+    def handle(self, *args, **options):
+        if options["depth"] < 1:
+            raise CommandError("--depth has to be positive.")
+        self.options = options
+        try:
+            with transaction.atomic():
+                # spelling and images use synthetic data, not the catalog
+                if not options["no_seed"] and options["target"] not in ("spelling", "images"):
+                    self.stdout.write("Creating %s products..." % options["products"])
+                    benchmarks.seed_catalog(options["products"])
+                    self.analyze()
+                getattr(self, "benchmark_%s" % options["target"])()
+                raise Rollback
+        except Rollback:
+            pass
+
+    def analyze(self):
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+    def benchmark_listing(self):
+        self.stdout.write(
+            "%s, %s products\n" % (connection.vendor, Product.objects.count())
+        )
+        category = Category.objects.filter(parent__isnull=True).order_by("pk").first()
+        campaign = Campaign.objects.filter(is_active=True).order_by("pk").first()
+        scopes = [
+            ("all", views.ProductList, {}, {}),
+            ("category", views.ProductByCategoryList, {"path": category.path_crumb}, {}),
+            ("campaign", views.ProductByCampaignList, {"slug": campaign.slug}, {}),
+            ("search", views.ProductSearchList, {}, {"q": "summer dress"}),
+            ("filtered", views.ProductList, {}, {"size": Product.sizes.through.objects.values_list(
+                "size", flat=True).first(), "price_lte": 100}),
+        ]
+
+        self.stdout.write(
+            "search index (%s) built in %.1f ms" % (
+                type(search.get_backend()).__name__, benchmarks.timed(search.get_backend().rebuild, 1)
+            )
+        )
+
+        for name, view_class, kwargs, params in scopes:
+            for option, ordering in view_class.ordering_options.items():
+                view = view_class()
+                view.setup(RequestFactory().get("/", {**params, view.ordering_param_name: option}), **kwargs)
+                if ordering is None:
+                    self.measure_ranked("%s, %s" % (name, option), view)
+                else:
+                    self.measure("%s, %s" % (name, option), view, ordering)
+            self.measure_facets(name, view)
+
+    def benchmark_autocomplete(self):
+        index = autocomplete.get_index()
+        self.stdout.write(
+            "index of %s products built in %.1f ms" % (Product.objects.count(), benchmarks.timed(index.build, 1))
+        )
+        rng = random.Random(0)
+        names = list(ParentProduct.objects.values_list("name", flat=True)[:1000])
+        queries = [word[:length] for word in benchmarks.WORDS for length in range(2, len(word) + 1)]
+        queries += [name[:rng.randint(2, len(name))] for name in rng.sample(names, min(len(names), 200))]
+
+        for label in ("first requests", "repeated requests"):
+            timings = []
+            for query in queries:
+                start = time.perf_counter()
+                index.suggest(query)
+                timings.append((time.perf_counter() - start) * 1000)
+            timings.sort()
+            self.stdout.write(self.style.MIGRATE_HEADING("%s, %s queries" % (label, len(queries))))
+            self.stdout.write("  p50 %.2f ms, p99 %.2f ms, max %.2f ms" % (
+                timings[len(timings) // 2], timings[int(len(timings) * 0.99)], timings[-1]
+            ))
+
+    def benchmark_spelling(self):
+        rng = random.Random(0)
+        letters = "abcdefghijklmnopqrstuvwxyz"
+        frequencies = {
+            "".join(rng.choices(letters, k=rng.randint(4, 12))): rng.randint(1, 100) for _ in range(50_000)
+        }
+        vocabulary = None
+
+        def build():
+            nonlocal vocabulary
+            vocabulary = spelling.Vocabulary(frequencies)
+
+        self.stdout.write("vocabulary of %s words built in %.1f ms" % (len(frequencies), benchmarks.timed(build, 1)))
+
+        def misspell(word):
+            position = rng.randrange(len(word))
+            return rng.choice([
+                word[:position] + word[position + 1:],
+                word[:position] + rng.choice(letters) + word[position + 1:],
+                word[:position] + rng.choice(letters) + word[position:],
+            ])
+
+        samples = [(misspell(word), word) for word in rng.sample(sorted(frequencies), 1000) if len(word) > 4]
+        timings, correct = [], 0
+        for misspelled, word in samples:
+            start = time.perf_counter()
+            corrected = vocabulary.correct([misspelled])
+            timings.append((time.perf_counter() - start) * 1000)
+            correct += corrected == [word]
+        timings.sort()
+        self.stdout.write(self.style.MIGRATE_HEADING("%s misspelled words" % len(samples)))
+        self.stdout.write("  p50 %.2f ms, p99 %.2f ms, max %.2f ms, %.0f%% corrected" % (
+            timings[len(timings) // 2], timings[int(len(timings) * 0.99)], timings[-1], 100 * correct / len(samples)
+        ))
+
+    def benchmark_images(self):
+        """ <img> tags of a list page: 24 main images and 5 thumbnails of siblings for each. """
+        rng = random.Random(0)
+        pages = [
+            [("%020x" % rng.getrandbits(80), [("%020x" % rng.getrandbits(80)) for _ in range(5)]) for _ in range(24)]
+            for _ in range(20)
+        ]
+        card = dict(images.VARIANTS["card"].transformation)
+        thumbnail = dict(images.VARIANTS["thumbnail"].transformation)
+
+        def cloudinary_tags():
+            for page in pages:
+                for main_image, siblings in page:
+                    CloudinaryResource(main_image).image(secure=True, **card)
+                    for sibling in siblings:
+                        CloudinaryResource(sibling).image(secure=True, **thumbnail)
+
+        def memoized_tags():
+            for page in pages:
+                for main_image, siblings in page:
+                    images.img(main_image, "card")
+                    for sibling in siblings:
+                        images.img(sibling, "thumbnail")
+
+        repeat = self.options["repeat"]
+        images.clear()
+        self.stdout.write(self.style.MIGRATE_HEADING("%s pages of %s images" % (len(pages), 24 * 6)))
+        self.stdout.write("  cloudinary tag %.2f ms, memoized: first render %.2f ms, next ones %.2f ms per page" % (
+            benchmarks.timed(cloudinary_tags, repeat) / len(pages),
+            benchmarks.timed(memoized_tags, 1) / len(pages),
+            benchmarks.timed(memoized_tags, repeat) / len(pages),
+        ))
+
+    def measure(self, label, view, ordering):
+        repeat = self.options["repeat"]
+        queryset = view.get_queryset()
+        per_page = view.paginate_by
+        offset = per_page * (self.options["depth"] - 1)
+
+        paginator = CursorPaginator(queryset, per_page, ordering)
+        first_page = lambda: list(queryset[:per_page])
+        count = lambda: queryset.count()
+        deep_offset = lambda: list(queryset[offset:offset + per_page])
+
+        # the first page has no boundary, it's the same query for both
+        boundary = queryset[offset - 1:offset] if offset else None
+        cursor = paginator.encode_cursor(boundary[0], "n") if boundary else None
+        deep_cursor = lambda: list(paginator.page(cursor))
+
+        self.stdout.write(self.style.MIGRATE_HEADING(label))
+        self.stdout.write(
+            "  first page %.1f ms, count %.1f ms, page %s: offset %.1f ms, cursor %s" % (
+                benchmarks.timed(first_page, repeat),
+                benchmarks.timed(count, repeat),
+                self.options["depth"],
+                benchmarks.timed(deep_offset, repeat),
+                "%.1f ms" % benchmarks.timed(deep_cursor, repeat) if cursor else "-",
+            )
+        )
+        if self.options["explain"]:
+            self.stdout.write(self.indent(benchmarks.explain(queryset[:per_page])))
+            if cursor:
+                value, pk, _ = paginator.decode_cursor(cursor)
+                deep = queryset.filter(paginator._q(value, pk, after=True))[:per_page]
+                self.stdout.write(self.indent(benchmarks.explain(deep)))
+
+    def measure_ranked(self, label, view):
+        """ Relevance ordering of search results: the search itself and ranking of all results. """
+        repeat = self.options["repeat"]
+        query = view.get_query()
+
+        def first_page():
+            view.__dict__.pop("_search_results", None)
+            list(view.get_queryset()[:view.paginate_by])
+
+        self.stdout.write(self.style.MIGRATE_HEADING(label))
+        self.stdout.write("  search %.1f ms, %s results, first page %.1f ms" % (
+            benchmarks.timed(lambda: search.search(query), repeat),
+            len(search.search(query)),
+            benchmarks.timed(first_page, repeat),
+        ))
+
+    def measure_facets(self, label, view):
+        facets = ProductFacets(view.get_scope_queryset(), view.get_filter())
+        self.stdout.write(self.style.MIGRATE_HEADING("%s, facets" % label))
+        self.stdout.write("  colors %.1f ms, sizes %.1f ms, prices %.1f ms" % tuple(
+            benchmarks.timed(method, self.options["repeat"]) for method in (
+                facets.get_color_counts, facets.get_size_counts, facets.get_price_histogram
+            )
+        ))
+
+    @staticmethod
+    def indent(text):
+        return "\n".join("    " + line for line in text.splitlines())
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from products import view_counter
+
+
+class Command(BaseCommand):
+    help = (
+        "Writes views of Products counted in cache to the db and prints metrics of the view counter. "
+        "Views are also flushed by requests every PRODUCTS_VIEWS_FLUSH_INTERVAL seconds, "
+        "so it's only needed with a cache shared by all processes, f.e. from cron or before a deploy."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--metrics", action="store_true", help="Only print the metrics.")
+
+    def handle(self, *args, **options):
+        if not options["metrics"]:
+            self.stdout.write("Flushed %s views." % view_counter.flush())
+
+        metrics = view_counter.get_metrics()
+        self.stdout.write(
+            "recorded %(recorded)s, flushed %(flushed)s, dropped %(dropped)s views in %(flushes)s flushes, "
+            "~%(pending_products)s products pending for %(pending_age).1f s" % metrics
+        )
+        last_flush = metrics["last_flush"]
+        if last_flush:
+            self.stdout.write(
+                "last flush: %(views)s views of %(products)s products, lag %(lag).1f s, "
+                "took %(duration).3f s" % last_flush
+            )
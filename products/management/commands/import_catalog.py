@@ -0,0 +1,60 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from products.catalog_import import FORMATS, CatalogImporter, read_records
+
+
+class Command(BaseCommand):
+    help = (
+        "Imports parent products, products, stock and images from a CSV or JSONL file "
+        "(one record per product, see products/catalog_import.py), streaming it "
+        "in batches of bulk queries, each batch in its own transaction. "
+        "all_products_json and the other denormalized data are updated once at the end."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="A .csv or .jsonl file, '-' for the standard input.")
+        parser.add_argument("--format", choices=FORMATS, help="By default from the extension of the file.")
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        path, batch_size = options["path"], options["batch_size"]
+        format = options["format"] or path.rpartition(".")[2].lower()
+        if format not in FORMATS:
+            raise CommandError("Unknown format, use --format %s." % "/".join(FORMATS))
+        if batch_size < 1:
+            raise CommandError("--batch-size has to be positive.")
+
+        started = time.monotonic()
+
+        def report(stats):
+            if options["verbosity"] > 1:
+                self.stdout.write("%s records, %.0f/s" % (stats["records"], self.rate(stats, started)))
+
+        importer = CatalogImporter(batch_size=batch_size)
+        if path == "-":
+            stats = importer.run(read_records(sys.stdin, format), on_batch=report)
+        else:
+            try:
+                file = open(path, newline="", encoding="utf-8")
+            except OSError as error:
+                raise CommandError(error)
+            with file:
+                stats = importer.run(read_records(file, format), on_batch=report)
+
+        for line_number, message in importer.errors:
+            self.stderr.write("Line %s: %s" % (line_number, message))
+        self.stdout.write(
+            "Imported %s records in %.1f s (%.0f records/s): %s parents created, %s updated, "
+            "%s products created, %s updated, %s stock rows, %s images, %s errors." % (
+                stats["records"], time.monotonic() - started, self.rate(stats, started),
+                stats["parents_created"], stats["parents_updated"],
+                stats["products_created"], stats["products_updated"],
+                stats["stock_written"], stats["images_created"], stats["errors"],
+            )
+        )
+
+    def rate(self, stats, started):
+        return stats["records"] / max(time.monotonic() - started, 1e-6)
@@ -0,0 +1,50 @@
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from products.signals import VIEWED
+
+
+class Command(BaseCommand):
+    help = (
+        "Deletes expired sessions in batches of primary keys, so that the table isn't locked "
+        "by one large DELETE like with 'clearsessions'. With --viewed-only also the sessions "
+        "holding nothing but recently viewed products, which are kept in a cookie now "
+        "(see settings.PRODUCTS_VIEWED_COOKIE)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--viewed-only", action="store_true",
+            help="Also delete sessions which only keep track of recently viewed products.",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        now = timezone.now()
+        checked = deleted = 0
+        last_key = ""
+        while True:
+            sessions = Session.objects.filter(session_key__gt=last_key).order_by("session_key")
+            if not options["viewed_only"]:
+                sessions = sessions.filter(expire_date__lt=now)
+            batch = list(sessions.values_list("session_key", "session_data", "expire_date")[:batch_size])
+            if not batch:
+                break
+
+            last_key = batch[-1][0]
+            stale = [
+                key for key, data, expire_date in batch
+                if expire_date < now or set(self.decode(data)) <= {VIEWED, "_session_expiry"}
+            ]
+            Session.objects.filter(session_key__in=stale).delete()
+            checked += len(batch)
+            deleted += len(stale)
+
+        self.stdout.write("Checked %s sessions, %s deleted." % (checked, deleted))
+
+    @staticmethod
+    def decode(data):
+        # corrupted data is decoded to {}, so such sessions are deleted too
+        return Session(session_data=data).get_decoded()
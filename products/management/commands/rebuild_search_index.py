@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from products import search
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuilds the index of the search backend (settings.PRODUCTS_SEARCH_BACKEND), "
+        "f.e. after ParentProducts were changed without signals "
+        "or after switching to SQLiteFTS5Backend (it creates its table). "
+        "For the local index it makes every process rebuild its own copy on the next search."
+    )
+
+    def handle(self, *args, **options):
+        backend = search.get_backend()
+        backend.rebuild()
+        self.stdout.write("Rebuilt the index of %s." % type(backend).__name__)
@@ -0,0 +1,38 @@
+from itertools import islice
+
+from django.core.management.base import BaseCommand
+
+from products import siblings
+from products.models import ParentProduct
+
+
+class Command(BaseCommand):
+    help = (
+        "Finds ParentProducts whose all_products_json differs from their Products "
+        "(f.e. after bulk or raw SQL changes of Products, which don't send signals) and rebuilds it. "
+        "Parents are read in chunks, the Products of a chunk with a single query, "
+        "and only the differing rows are written."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--check", action="store_true", help="Only report the drift.")
+
+    def handle(self, *args, **options):
+        batch_size, check = options["batch_size"], options["check"]
+        checked = drifted = 0
+        parents = ParentProduct.objects.order_by("pk").values_list("pk", "all_products_json").iterator(
+            chunk_size=batch_size
+        )
+        while chunk := dict(islice(parents, batch_size)):
+            built = siblings.build(chunk)
+            wrong = [pk for pk, value in chunk.items() if value != built[pk]]
+            checked += len(chunk)
+            if wrong:
+                self.stdout.write("Drift in parent products: %s" % ", ".join(map(str, wrong)))
+                # checked again with the rows locked, they might have been fixed meanwhile
+                drifted += len(wrong) if check else len(siblings.rebuild(wrong))
+
+        self.stdout.write(
+            "Checked %s parent products, %s %s." % (checked, drifted, "drifted" if check else "rebuilt")
+        )
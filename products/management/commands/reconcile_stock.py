@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Sum
+
+from products.models import Product, Stock
+
+
+class Command(BaseCommand):
+    help = (
+        "Finds Products whose denormalized total_stock or is_available differ from Stock "
+        "(f.e. after Sizes were deleted or after raw SQL updates) and repairs them. "
+        "Products are checked in batches of primary keys, each batch in its own transaction."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--dry-run", action="store_true", help="Only report the drift.")
+
+    def handle(self, *args, **options):
+        batch_size, dry_run = options["batch_size"], options["dry_run"]
+        checked = drifted = 0
+        last_pk = 0
+        while True:
+            with transaction.atomic():
+                products = list(
+                    Product.objects.filter(pk__gt=last_pk).order_by("pk").values_list(
+                        "pk", "total_stock", "is_available"
+                    )[:batch_size]
+                )
+                if not products:
+                    break
+
+                first_pk, last_pk = products[0][0], products[-1][0]
+                totals = dict(
+                    Stock.objects.filter(product__gte=first_pk, product__lte=last_pk).order_by().values(
+                        "product"
+                    ).annotate(total=Sum("quantity")).values_list("product", "total")
+                )
+                available = set(
+                    Stock.objects.filter(
+                        product__gte=first_pk, product__lte=last_pk, quantity__gt=0
+                    ).values_list("product", flat=True)
+                )
+                wrong = [
+                    pk for pk, total_stock, is_available in products
+                    if total_stock != totals.get(pk, 0) or is_available != (pk in available)
+                ]
+                checked += len(products)
+                drifted += len(wrong)
+                if wrong:
+                    self.stdout.write("Drift in products: %s" % ", ".join(map(str, wrong)))
+                    if not dry_run:
+                        Product.objects.filter(pk__in=wrong).update_stock_totals()
+
+        self.stdout.write(
+            "Checked %s products, %s %s." % (checked, drifted, "drifted" if dry_run else "repaired")
+        )
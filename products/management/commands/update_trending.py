@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from products import trending
+
+
+class Command(BaseCommand):
+    help = (
+        "Recomputes trending scores of Products (used for sorting by popularity) from views "
+        "of the last days and deletes expired view buckets. Requests never do it, "
+        "the command is meant for cron, f.e. every 15 minutes."
+    )
+
+    def handle(self, *args, **options):
+        self.stdout.write("Updated trending scores of %s products." % trending.update_scores())
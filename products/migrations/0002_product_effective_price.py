@@ -0,0 +1,49 @@
+# Generated by Django 5.0.3 on 2026-10-16 10:12
+
+from django.db import migrations, models, transaction
+from django.db.models.functions import Coalesce
+
+BATCH_SIZE = 2000
+
+
+def backfill_effective_price(apps, schema_editor):
+    """
+    Fill effective_price for existing rows in chunks of BATCH_SIZE primary keys,
+    each chunk in its own transaction, so that a large table isn't locked
+    by one long-running UPDATE.
+    """
+    Product = apps.get_model("products", "Product")
+    last_pk = 0
+    while True:
+        pks = list(
+            Product.objects.filter(pk__gt=last_pk).order_by("pk").values_list("pk", flat=True)[:BATCH_SIZE]
+        )
+        if not pks:
+            break
+
+        with transaction.atomic():
+            Product.objects.filter(pk__gte=pks[0], pk__lte=pks[-1]).update(
+                effective_price=Coalesce(
+                    "discounted_price",
+                    "price",
+                    output_field=models.DecimalField(max_digits=8, decimal_places=2)
+                )
+            )
+        last_pk = pks[-1]
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('products', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='effective_price',
+            field=models.DecimalField(decimal_places=2, editable=False, max_digits=8, null=True, verbose_name='Effective price'),
+        ),
+        migrations.RunPython(backfill_effective_price, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.0.3 on 2026-10-16 11:05
+
+from django.db import migrations, models, transaction
+from django.db.models import Exists, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+BATCH_SIZE = 2000
+
+
+def backfill_stock_totals(apps, schema_editor):
+    """
+    Fill total_stock and is_available from Stock in chunks of BATCH_SIZE
+    primary keys, same as the effective_price backfill in 0002.
+    """
+    Product = apps.get_model("products", "Product")
+    Stock = apps.get_model("products", "Stock")
+    total = Stock.objects.filter(product=OuterRef("pk")).order_by().values(
+        "product"
+    ).annotate(total=Sum("quantity")).values("total")
+
+    last_pk = 0
+    while True:
+        pks = list(
+            Product.objects.filter(pk__gt=last_pk).order_by("pk").values_list("pk", flat=True)[:BATCH_SIZE]
+        )
+        if not pks:
+            break
+
+        with transaction.atomic():
+            Product.objects.filter(pk__gte=pks[0], pk__lte=pks[-1]).update(
+                total_stock=Coalesce(Subquery(total), 0),
+                is_available=Exists(Stock.objects.filter(product=OuterRef("pk"), quantity__gt=0)),
+            )
+        last_pk = pks[-1]
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('products', '0003_alter_product_effective_price_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='is_available',
+            field=models.BooleanField(db_index=True, default=False, editable=False, verbose_name='Available'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='total_stock',
+            field=models.IntegerField(default=0, editable=False, verbose_name='Total stock'),
+        ),
+        migrations.RunPython(backfill_stock_totals, migrations.RunPython.noop),
+    ]
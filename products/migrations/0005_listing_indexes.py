@@ -0,0 +1,52 @@
+# Generated by Django 5.0.3 on 2026-10-16 12:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0004_product_stock_totals'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='product',
+            options={'ordering': ('-views', '-pk')},
+        ),
+        migrations.RemoveIndex(
+            model_name='product',
+            name='product_effective_price_idx',
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='is_available',
+            field=models.BooleanField(default=False, editable=False, verbose_name='Available'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_available', True)), fields=['views', 'id'], name='product_available_views_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_available', True)), fields=['effective_price', 'id'], name='product_available_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_available', True)), fields=['id'], name='product_available_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_available', True)), fields=['color', 'views', 'id'], name='product_color_views_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stock',
+            index=models.Index(fields=['product', 'size', 'quantity'], name='stock_product_size_idx'),
+        ),
+        migrations.AlterField(
+            model_name='stock',
+            name='product',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='stock', to='products.product', verbose_name='Product'),
+        ),
+    ]
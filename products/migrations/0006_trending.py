@@ -0,0 +1,83 @@
+# Generated by Django 5.0.3 on 2026-10-17 00:13
+
+import time
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def seed_trending(apps, schema_editor):
+    """
+    All-time views count as if they were made now, so the 'popularity' ordering
+    stays the same at first and then gradually shifts to recent views.
+    """
+    Product = apps.get_model("products", "Product")
+    ViewBucket = apps.get_model("products", "ViewBucket")
+    hour = int(time.time() // 3600)
+
+    Product.objects.update(trending=models.F("views"))
+    products = Product.objects.filter(views__gt=0).order_by("pk").values_list("pk", "views")
+    batch = []
+    for pk, views in products.iterator(chunk_size=2000):
+        batch.append(ViewBucket(product_id=pk, hour=hour, views=views))
+        if len(batch) == 2000:
+            ViewBucket.objects.bulk_create(batch)
+            batch = []
+    ViewBucket.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0005_listing_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ViewBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.PositiveIntegerField(verbose_name='Hour')),
+                ('views', models.PositiveIntegerField(default=0, verbose_name='Number of views')),
+            ],
+        ),
+        migrations.AlterModelOptions(
+            name='product',
+            options={'ordering': ('-trending', '-pk')},
+        ),
+        migrations.RemoveIndex(
+            model_name='product',
+            name='product_available_views_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='product',
+            name='product_color_views_idx',
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='trending',
+            field=models.FloatField(default=0, editable=False, verbose_name='Trending score'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_available', True)), fields=['trending', 'id'], name='product_available_trending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_available', True)), fields=['color', 'trending', 'id'], name='product_color_trending_idx'),
+        ),
+        migrations.AddField(
+            model_name='viewbucket',
+            name='product',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='view_buckets', to='products.product', verbose_name='Product'),
+        ),
+        migrations.AddIndex(
+            model_name='viewbucket',
+            index=models.Index(fields=['hour'], name='view_bucket_hour_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='viewbucket',
+            constraint=models.UniqueConstraint(fields=('product', 'hour'), name='unique_product_hour'),
+        ),
+        migrations.RunPython(seed_trending, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,66 @@
+from django.conf import settings
+from django.db import migrations
+
+TABLE = "products_parentproduct_fts"
+COLUMNS = ("name", "search_keywords", "categories", "description")
+
+
+def create_fts_table(apps, schema_editor):
+    """
+    The FTS5 index of products.search.SQLiteFTS5Backend, filled with all ParentProducts,
+    only if the backend is configured. Otherwise it's created by the 'rebuild_search_index'
+    command once the backend is enabled, so SQLite builds without FTS5 can be migrated
+    and there's no table which nothing keeps up to date.
+    """
+    backend = getattr(settings, "PRODUCTS_SEARCH_BACKEND", "products.search.LocalIndexBackend")
+    if schema_editor.connection.vendor != "sqlite" or backend != "products.search.SQLiteFTS5Backend":
+        return
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS %s USING fts5(%s, tokenize = 'porter unicode61 remove_diacritics 2')"
+        % (TABLE, ", ".join(COLUMNS))
+    )
+    # the table used to be created on the first search
+    schema_editor.execute("DELETE FROM %s" % TABLE)
+
+    Category = apps.get_model("products", "Category")
+    ParentProduct = apps.get_model("products", "ParentProduct")
+    # names of the category and all its ancestors, like products.search.category_names()
+    categories = {pk: (parent, name) for pk, parent, name in Category.objects.values_list("pk", "parent_id", "name")}
+    names = {}
+    for pk in categories:
+        path, current = [], pk
+        while current is not None and len(path) < len(categories):
+            parent, name = categories[current]
+            path.append(name)
+            current = parent
+        names[pk] = " ".join(path)
+
+    rows = [
+        (pk, name, keywords, names.get(category, ""), description)
+        for pk, name, keywords, description, category in ParentProduct.objects.values_list(
+            "pk", "name", "search_keywords", "description", "category_id"
+        ).order_by("pk")
+    ]
+    if rows:
+        with schema_editor.connection.cursor() as cursor:
+            cursor.executemany(
+                "INSERT INTO %s (rowid, %s) VALUES (%s)"
+                % (TABLE, ", ".join(COLUMNS), ", ".join(["%s"] * (len(COLUMNS) + 1))),
+                rows,
+            )
+
+
+def drop_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor == "sqlite":
+        schema_editor.execute("DROP TABLE IF EXISTS %s" % TABLE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0006_trending'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts_table, drop_fts_table),
+    ]
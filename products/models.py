@@ -1,12 +1,16 @@
 from __future__ import annotations
 
 import re
+from collections import defaultdict
 from typing import Iterable
 
 from cloudinary.models import CloudinaryField
 from django.core.exceptions import ValidationError
-from django.db import models
-from django.db.models import Q, Case, When, F, DecimalField
+from django.db import models, transaction
+from django.db.models import (
+    Q, F, BooleanField, DecimalField, Exists, ExpressionWrapper, OuterRef, Subquery, Sum, Value
+)
+from django.db.models.functions import Coalesce
 from django.urls import reverse
 from django.utils.text import slugify
 from django.utils.translation import gettext_lazy as _
@@ -14,6 +18,8 @@ from mptt.fields import TreeForeignKey
 from mptt.managers import TreeManager
 from mptt.models import MPTTModel
 
+from products import price_bounds
+
 
 class ParentProduct(models.Model):
     """
@@ -33,7 +39,7 @@ class ParentProduct(models.Model):
      campaign: ForeignKey
         it's like a batch of products, f.e. 'spring collection', 'sale',
      all_products_json: JSONField
-        an automatically updated (via post_save signal) json field,
+        an automatically updated (via post_save signal, see products/siblings.py) json field,
         which stores data for all children products, so that Products can
         easily fetch the data related to its siblings.
         e.g.:
@@ -95,6 +101,23 @@ class ParentProduct(models.Model):
                     "types any of the words that you put here.")
     )
 
+    # fields deciding which listings (including search results) Products of the parent belong to
+    SCOPE_FIELDS = ("category_id", "campaign_id", "name", "search_keywords", "description")
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # used by signals to tell whether the scope fields have changed on save
+        instance._loaded_scope = instance.get_scope()
+        return instance
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self._loaded_scope = self.get_scope()
+
+    def get_scope(self):
+        return tuple(self.__dict__.get(field) for field in self.SCOPE_FIELDS)
+
     def __str__(self):
         return str(self.name)
 
@@ -107,9 +130,11 @@ class ProductQueryset(models.QuerySet):
     This queryset is used as a custom Manager for Product.
     """
     def available(self):
-        return self.filter(
-            stock__quantity__gt=0
-        ).distinct()
+        """
+        Products with at least one size in stock,
+        based on the denormalized is_available flag (see Stock).
+        """
+        return self.filter(is_available=True)
 
     def for_categories(self, categories: Iterable[Category]):
         return self.filter(
@@ -126,24 +151,91 @@ class ProductQueryset(models.QuerySet):
         for word in keywords:
             q |= Q(parent__search_keywords__icontains=word)
 
-        return self.filter(q).distinct()
+        # a Product has a single parent, so the join doesn't duplicate rows
+        return self.filter(q)
 
-    def effective_price(self):
+    def update(self, **kwargs):
         """
-        This annotation is used to provide an accurate
-        comparison when ordering Products by price.
+        Keep effective_price in sync when prices are updated in bulk,
+        f.e. Product.objects.filter(...).update(discounted_price=49).
         """
-        return self.annotate(
-            effective_price=Case(
-                When(
-                    discounted_price__isnull=False,
-                    then=F('discounted_price')
-                ),
-                default=F('price'),
-                output_field=DecimalField()
+        if ("price" in kwargs or "discounted_price" in kwargs) and "effective_price" not in kwargs:
+            kwargs["effective_price"] = effective_price_expression(
+                price=kwargs.get("price", F("price")),
+                discounted_price=kwargs.get("discounted_price", F("discounted_price")),
             )
+        if {"effective_price", "parent", "parent_id"} & set(kwargs):
+            price_bounds.invalidate()
+
+        return super().update(**kwargs)
+
+    update.alters_data = True
+
+    def bulk_update(self, objs, fields, batch_size=None):
+        if {"price", "discounted_price"} & set(fields) and "effective_price" not in fields:
+            objs = list(objs)
+            for obj in objs:
+                obj.effective_price = obj.get_effective_price()
+            fields = [*fields, "effective_price"]
+        if {"effective_price", "parent"} & set(fields):
+            price_bounds.invalidate()
+
+        return super().bulk_update(objs, fields, batch_size=batch_size)
+
+    bulk_update.alters_data = True
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        for obj in objs:
+            obj.effective_price = obj.get_effective_price()
+        price_bounds.invalidate()
+
+        return super().bulk_create(objs, *args, **kwargs)
+
+    bulk_create.alters_data = True
+
+    def add_to_total_stock(self, delta: int):
+        """
+        Atomically changes total_stock by 'delta' (which may be negative)
+        and updates is_available accordingly, without reading the rows.
+        """
+        return self.update(
+            total_stock=F("total_stock") + delta,
+            # the old value of total_stock is used in SET expressions
+            is_available=ExpressionWrapper(Q(total_stock__gt=-delta), output_field=BooleanField()),
+        )
+
+    add_to_total_stock.alters_data = True
+
+    def update_stock_totals(self):
+        """
+        Recalculates total_stock and is_available from Stock.
+        """
+        total = Stock.objects.filter(product=OuterRef("pk")).order_by().values(
+            "product"
+        ).annotate(total=Sum("quantity")).values("total")
+
+        return self.update(
+            total_stock=Coalesce(Subquery(total), 0),
+            is_available=Exists(Stock.objects.filter(product=OuterRef("pk"), quantity__gt=0)),
         )
 
+    update_stock_totals.alters_data = True
+
+
+def effective_price_expression(price=F("price"), discounted_price=F("discounted_price")):
+    """
+    The db counterpart of Product.get_effective_price(),
+    used for updating the effective_price column in bulk.
+    """
+    output_field = DecimalField(max_digits=8, decimal_places=2)
+    if not hasattr(price, "resolve_expression"):
+        price = Value(price, output_field=output_field)
+    if not hasattr(discounted_price, "resolve_expression"):
+        discounted_price = Value(discounted_price, output_field=output_field)
+
+    return Coalesce(discounted_price, price, output_field=output_field)
+
 
 class Product(models.Model):
     """
@@ -160,8 +252,14 @@ class Product(models.Model):
         since most of the time only one image per product will be used. Also, it ensures that
         no product is left without image.
     views: PositiveIntegerField
-        Number of times the product was viewed by the users. It is used in sorting
-         as a 'popularity' parameter.
+        Number of times the product was viewed by the users (all-time).
+    trending: FloatField
+        Views of the last days with the older ones counting less (see products/trending.py).
+        It is used in sorting as a 'popularity' parameter.
+    effective_price: DecimalField
+        discounted_price if set, price otherwise. It is stored (and indexed) so that
+        sorting and filtering by price don't need to compare both columns on the fly.
+        It is updated automatically in save() and in ProductQueryset bulk methods.
     """
     parent = models.ForeignKey(
         ParentProduct,
@@ -188,14 +286,38 @@ class Product(models.Model):
         blank=True,
         null=True
     )
+    effective_price = models.DecimalField(
+        _("Effective price"),
+        max_digits=8,
+        decimal_places=2,
+        editable=False
+    )
     slug = models.SlugField(max_length=192, unique=True, blank=True, editable=False)
     main_image = CloudinaryField(_("Main image"))
     views = models.PositiveIntegerField(_("Number of views"), default=0, editable=False)
+    trending = models.FloatField(_("Trending score"), default=0, editable=False)
+    # denormalized from Stock, kept in sync by Stock and StockQueryset
+    total_stock = models.IntegerField(_("Total stock"), default=0, editable=False)
+    is_available = models.BooleanField(_("Available"), default=False, editable=False)
     sizes = models.ManyToManyField("Size", verbose_name=_("Sizes"), through="Stock")
 
-    objects = models.Manager()
+    objects = ProductQueryset.as_manager()
     custom_manager = ProductQueryset.as_manager()
 
+    STOCK_FIELDS = ("total_stock", "is_available")
+    # written with atomic updates by products.view_counter and products.trending
+    COUNTER_FIELDS = ("views", "trending")
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # used by signals to tell whether the price has changed on save
+        instance._loaded_effective_price = instance.__dict__.get("effective_price")
+        # used by signals to tell whether the entry in ParentProduct.all_products_json has changed
+        if {"parent_id", "slug", "main_image"} <= instance.__dict__.keys():
+            instance._loaded_sibling_entry = (instance.parent_id, instance.get_sibling_entry())
+        return instance
+
     @property
     def name(self):
         return str(self)
@@ -207,17 +329,69 @@ class Product(models.Model):
                 fields=["parent", "style"],
             ),
         ]
-        ordering = ('-views',)
+        # matched to the queries of the list views: available Products
+        # ordered by one of ProductList.ordering_options with pk as a tie-breaker,
+        # optionally filtered by color (see products/tests/test_query_plans.py).
+        # Partial indexes, since only available Products are listed.
+        indexes = [
+            models.Index(
+                fields=["trending", "id"], condition=Q(is_available=True), name="product_available_trending_idx"
+            ),
+            models.Index(
+                fields=["effective_price", "id"], condition=Q(is_available=True), name="product_available_price_idx"
+            ),
+            models.Index(fields=["id"], condition=Q(is_available=True), name="product_available_id_idx"),
+            models.Index(
+                fields=["color", "trending", "id"], condition=Q(is_available=True), name="product_color_trending_idx"
+            ),
+        ]
+        ordering = ('-trending', '-pk')
 
     def get_absolute_url(self):
         return reverse('products:product_detail', args=[self.slug])
 
     def save(self, *args, **kwargs):
-        """ Generates slug at object creation."""
+        """
+        Generates slug at object creation.
+        Keeps effective_price in sync with prices.
+        Stock totals and counters are never written from a (possibly stale) instance,
+        they are maintained by Stock and by counters of views with atomic updates.
+        Deferred fields aren't written either, so they aren't fetched for the save.
+        """
         if not self.pk:
             self.slug = slugify("%s %s" % (self.parent.name, self.style))
 
+        self.effective_price = self.get_effective_price()
+        update_fields = kwargs.get("update_fields")
+        if update_fields is None and not self._state.adding and not kwargs.get("force_insert"):
+            excluded = {*self.STOCK_FIELDS, *self.COUNTER_FIELDS, *self.get_deferred_fields()}
+            fields = [field for field in self._meta.concrete_fields if not field.primary_key]
+            if any(field.attname in excluded for field in fields):
+                update_fields = kwargs["update_fields"] = [
+                    field.name for field in fields if field.attname not in excluded
+                ]
+        if update_fields is not None and {"price", "discounted_price"} & set(update_fields):
+            kwargs["update_fields"] = {*update_fields, "effective_price"}
+
         super().save(*args, **kwargs)
+        self._loaded_effective_price = self.effective_price
+
+    def get_sibling_entry(self) -> dict:
+        """ Data of the Product kept in all_products_json of its parent. """
+        return self.sibling_entry(self.slug, self.main_image)
+
+    @classmethod
+    def sibling_entry(cls, slug: str, main_image) -> dict:
+        main_image = cls._meta.get_field("main_image").to_python(main_image)
+        return {
+            "slug": slug,
+            "img_public_id": getattr(main_image, "public_id", None),
+        }
+
+    def get_effective_price(self):
+        if self.discounted_price is not None:
+            return self.discounted_price
+        return self.price
 
     def clean(self):
         if self.discounted_price and self.discounted_price >= self.price:
@@ -395,16 +569,114 @@ class Size(models.Model):
         return str(self.name)
 
 
+def apply_stock_deltas(deltas: dict[int, int]):
+    """
+    Adds {product_id: delta} to Product.total_stock,
+    with one UPDATE per distinct delta.
+    """
+    products_by_delta = defaultdict(list)
+    for product_id, delta in deltas.items():
+        if delta:
+            products_by_delta[delta].append(product_id)
+
+    for delta, product_ids in products_by_delta.items():
+        Product.objects.filter(pk__in=product_ids).add_to_total_stock(delta)
+
+
+class StockQueryset(models.QuerySet):
+    """
+    Keeps Product.total_stock and Product.is_available in sync
+    on bulk operations, which don't call Stock.save() or Stock.delete().
+    Quantities of rows changed by update() and delete() are not known up front,
+    so totals of the affected Products are recalculated instead.
+    """
+    def update(self, **kwargs):
+        if not {"quantity", "product", "product_id"} & set(kwargs):
+            return super().update(**kwargs)
+
+        with transaction.atomic(using=self.db):
+            product_ids = set(self.values_list("product_id", flat=True))
+            rows = super().update(**kwargs)
+            new_product = kwargs.get("product_id", kwargs.get("product"))
+            if new_product is not None:
+                product_ids.add(getattr(new_product, "pk", new_product))
+            Product.objects.filter(pk__in=product_ids).update_stock_totals()
+
+        return rows
+
+    update.alters_data = True
+
+    def delete(self):
+        with transaction.atomic(using=self.db):
+            product_ids = set(self.values_list("product_id", flat=True))
+            deleted = super().delete()
+            Product.objects.filter(pk__in=product_ids).update_stock_totals()
+
+        return deleted
+
+    delete.alters_data = True
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        with transaction.atomic(using=self.db):
+            created = super().bulk_create(objs, *args, **kwargs)
+            if kwargs.get("ignore_conflicts") or kwargs.get("update_conflicts"):
+                # existing rows might have been kept or overwritten
+                Product.objects.filter(pk__in={obj.product_id for obj in objs}).update_stock_totals()
+            else:
+                deltas = defaultdict(int)
+                for obj in created:
+                    deltas[obj.product_id] += obj.quantity
+                    obj._loaded_stock = (obj.product_id, obj.quantity)
+                apply_stock_deltas(deltas)
+
+        return created
+
+    bulk_create.alters_data = True
+
+    def bulk_update(self, objs, fields, batch_size=None):
+        if not {"quantity", "product"} & set(fields):
+            return super().bulk_update(objs, fields, batch_size=batch_size)
+
+        objs = list(objs)
+        deltas, unknown = defaultdict(int), set()
+        for obj in objs:
+            if loaded := getattr(obj, "_loaded_stock", None):
+                deltas[loaded[0]] -= loaded[1]
+                deltas[obj.product_id] += obj.quantity
+            else:
+                unknown.add(obj.product_id)
+
+        with transaction.atomic(using=self.db):
+            # a plain QuerySet, since bulk_update() calls update() internally
+            rows = models.QuerySet(self.model, using=self.db).bulk_update(objs, fields, batch_size=batch_size)
+            apply_stock_deltas(deltas)
+            if unknown:
+                Product.objects.filter(pk__in=unknown).update_stock_totals()
+        for obj in objs:
+            obj._loaded_stock = (obj.product_id, obj.quantity)
+
+        return rows
+
+    bulk_update.alters_data = True
+
+
 class Stock(models.Model):
     """
     An intermediate model with an additional attribute
     quantity.
+
+    Every change of quantity is also applied to Product.total_stock
+    (and Product.is_available) as a delta, f.e. total_stock = total_stock - 2,
+    so concurrent changes of different sizes don't overwrite each other.
     """
     product = models.ForeignKey(
         Product,
         verbose_name=_("Product"),
         on_delete=models.CASCADE,
         related_name="stock",
+        # stock_product_size_idx starts with product
+        db_index=False,
     )
     size = models.ForeignKey(
         Size,
@@ -414,7 +686,85 @@ class Stock(models.Model):
     )
     quantity = models.PositiveIntegerField(default=0)
 
+    objects = StockQueryset.as_manager()
+
+    class Meta:
+        indexes = [
+            # covers the EXISTS subqueries of the size filter and of availability,
+            # without it the planner may probe all Stock rows of a size for every Product
+            models.Index(fields=["product", "size", "quantity"], name="stock_product_size_idx"),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # values as saved in the db, used for computing deltas of total_stock
+        if "product_id" in instance.__dict__ and "quantity" in instance.__dict__:
+            instance._loaded_stock = (instance.product_id, instance.quantity)
+        return instance
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and not {"quantity", "product"} & set(update_fields):
+            return super().save(*args, **kwargs)
+
+        loaded = getattr(self, "_loaded_stock", None)
+        if self._state.adding:
+            loaded = None
+        elif loaded is None:
+            # an instance not loaded from the db, the saved values are unknown
+            with transaction.atomic():
+                super().save(*args, **kwargs)
+                Product.objects.filter(pk=self.product_id).update_stock_totals()
+            self._loaded_stock = (self.product_id, self.quantity)
+            return
+
+        deltas = defaultdict(int)
+        if loaded is not None:
+            deltas[loaded[0]] -= loaded[1]
+        deltas[self.product_id] += self.quantity
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            apply_stock_deltas(deltas)
+        self._loaded_stock = (self.product_id, self.quantity)
+
+    def delete(self, *args, **kwargs):
+        loaded = getattr(self, "_loaded_stock", None) or (self.product_id, self.quantity)
+        with transaction.atomic():
+            deleted = super().delete(*args, **kwargs)
+            apply_stock_deltas({loaded[0]: -loaded[1]})
+
+        return deleted
+
     def __str__(self):
         return "%s, quantity: %s" % (self.product, self.quantity)
 
 
+class ViewBucket(models.Model):
+    """
+    Views of a Product within an hour, written together with Product.views
+    and summed up into Product.trending (see products/trending.py).
+    Buckets older than the trending horizon are deleted.
+    """
+    product = models.ForeignKey(
+        Product,
+        verbose_name=_("Product"),
+        on_delete=models.CASCADE,
+        related_name="view_buckets",
+        # unique_product_hour starts with product
+        db_index=False,
+    )
+    # hours since the epoch
+    hour = models.PositiveIntegerField(_("Hour"))
+    views = models.PositiveIntegerField(_("Number of views"), default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(name="unique_product_hour", fields=["product", "hour"]),
+        ]
+        indexes = [
+            models.Index(fields=["hour"], name="view_bucket_hour_idx"),
+        ]
+
+    def __str__(self):
+        return "%s, hour %s: %s" % (self.product, self.hour, self.views)
@@ -0,0 +1,150 @@
+"""
+Whole pages of product lists (all Products, categories, campaigns, search)
+cached for anonymous visitors, who all get the same HTML for the same query.
+
+Pages are cached under their canonical URL: the path with only the query
+params which change the page, normalized by the view (f.e. ?size=4&color=3,1&utm_source=x
+and ?color=1,3&size=4 are the same page), and rendered with that canonical query,
+so links on a cached page don't carry params of the visitor who rendered it.
+Stored pages carry the "catalog" version (see products.cache_versions), bumped
+by signals (see products.signals) on changes of anything shown on the pages.
+Changes without signals (f.e. trending scores, bulk updates of stock) are
+reflected once a page is older than settings.PRODUCTS_PAGE_CACHE_TIMEOUT.
+
+An outdated page is re-rendered by a single request holding a lock,
+concurrent requests get the outdated page meanwhile. When there's no page
+at all, they wait for it (at most WAIT seconds, then they render it themselves),
+so a bump of the version doesn't send every worker to the db at once.
+
+Visitors with a session, and pages which used the session or a CSRF token,
+are never served from or stored in the cache.
+Outdated pages are served with 'stale' set, so they don't get
+validators of the current version (see products.conditional).
+"""
+from __future__ import annotations
+
+import hashlib
+import time
+from typing import Callable
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpRequest, HttpResponse, QueryDict
+
+from products import cache_versions
+
+VERSION = "catalog"
+KEY = "products:pages:%s"
+LOCK = "products:pages:lock:%s"
+# max time of rendering a page, after that the lock is released
+LOCK_TIMEOUT = 30
+# max time of waiting for a page rendered by another request
+WAIT = 5
+POLL_INTERVAL = 0.05
+# outdated pages are kept for STALE_TIMEOUT after PRODUCTS_PAGE_CACHE_TIMEOUT
+STALE_TIMEOUT = 60 * 60
+
+
+def get_timeout() -> int | None:
+    return getattr(settings, "PRODUCTS_PAGE_CACHE_TIMEOUT", 60 * 5)
+
+
+def is_cacheable(request: HttpRequest) -> bool:
+    return (
+        bool(get_timeout()) and request.method in ("GET", "HEAD")
+        and settings.SESSION_COOKIE_NAME not in request.COOKIES
+    )
+
+
+def canonical_query(params: dict[str, str]) -> str:
+    """ f.e. {"size": "4", "color": "1,3"} -> "color=1,3&size=4" """
+    # commas are kept unescaped like in links of the templates (see products.templatetags)
+    return urlencode(sorted(params.items()), safe=",")
+
+
+def make_key(request: HttpRequest, query: str) -> str:
+    # pages contain absolute links (see the pagination)
+    url = "%s://%s%s?%s" % (request.scheme, request.get_host(), request.path, query)
+
+    return KEY % hashlib.md5(url.encode()).hexdigest()
+
+
+def is_storable(request: HttpRequest, response: HttpResponse) -> bool:
+    """ Pages for a single visitor (which set cookies or used the session or a CSRF token) are not cached. """
+    session = getattr(request, "session", None)
+    return (
+        response.status_code == 200 and not response.cookies
+        and not request.META.get("CSRF_COOKIE_NEEDS_UPDATE")
+        and not (session is not None and session.accessed)
+    )
+
+
+def serve(request: HttpRequest, params: dict[str, str], render: Callable[[], HttpResponse]) -> HttpResponse:
+    """
+    The cached page with the canonical query 'params',
+    rendered (with 'render', a view returning a TemplateResponse) when it's missing or outdated.
+    """
+    query = canonical_query(params)
+    key = make_key(request, query)
+    version = cache_versions.get_version(VERSION)
+    page = cache.get(key)
+    if page is not None and page[0] == version and time.time() - page[1] < get_timeout():
+        return to_response(page)
+
+    lock = LOCK % key
+    if cache.add(lock, True, timeout=LOCK_TIMEOUT):
+        try:
+            return store(request, query, key, version, render)
+        finally:
+            cache.delete(lock)
+
+    # being rendered by another request
+    if page is not None:
+        return to_response(page, stale=True)
+    page = wait(key, lock, version)
+    if page is not None:
+        return to_response(page)
+
+    return store(request, query, key, version, render)
+
+
+def wait(key: str, lock: str, version: int) -> tuple | None:
+    """
+    The page rendered by another request, None if it isn't there within WAIT seconds
+    or the lock was released without storing it (f.e. a 404 page).
+    """
+    deadline = time.monotonic() + WAIT
+    while time.monotonic() < deadline:
+        time.sleep(POLL_INTERVAL)
+        values = cache.get_many([key, lock])
+        page = values.get(key)
+        if page is not None and page[0] >= version:
+            return page
+        if lock not in values:
+            return None
+
+
+def store(request: HttpRequest, query: str, key: str, version: int, render: Callable[[], HttpResponse]):
+    request.GET = QueryDict(query)
+    request.META["QUERY_STRING"] = query
+    response = render()
+    if hasattr(response, "render"):
+        response.render()
+    if is_storable(request, response):
+        page = (version, time.time(), response.content, response["Content-Type"])
+        cache.set(key, page, get_timeout() + STALE_TIMEOUT)
+
+    return response
+
+
+def to_response(page: tuple, stale: bool = False) -> HttpResponse:
+    version, created, content, content_type = page
+    response = HttpResponse(content, content_type=content_type)
+    response.stale = stale
+
+    return response
+
+
+def invalidate():
+    cache_versions.bump_on_commit(VERSION)
@@ -0,0 +1,155 @@
+from __future__ import annotations
+
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q, QuerySet
+from django.http import Http404
+from django.utils.http import urlsafe_base64_decode, urlsafe_base64_encode
+from django.utils.translation import gettext_lazy as _
+
+NEXT = "n"
+PREVIOUS = "p"
+
+
+class CursorPage:
+    """
+    A page of results returned by CursorPaginator.
+    It mimics the interface of django.core.paginator.Page that is used
+    in templates, but instead of page numbers it exposes cursors
+    pointing to the neighbouring pages.
+    """
+    def __init__(self, object_list, paginator, has_next, has_previous):
+        self.object_list = object_list
+        self.paginator = paginator
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+    @property
+    def next_cursor(self):
+        if self._has_next:
+            return self.paginator.encode_cursor(self.object_list[-1], NEXT)
+        return ""
+
+    @property
+    def previous_cursor(self):
+        if self._has_previous:
+            return self.paginator.encode_cursor(self.object_list[0], PREVIOUS)
+        return ""
+
+
+class CursorPaginator:
+    """
+    Keyset (a.k.a. cursor) pagination.
+    Instead of OFFSET, every page is fetched with a WHERE condition
+    on the sort key of the last (or first) row of the neighbouring page,
+    so the cost of fetching a page doesn't depend on its depth and no
+    COUNT query is needed.
+
+    The rows are ordered by 'ordering' (f.e. '-trending') with the primary key
+    as a tie-breaker, the cursor is an opaque token holding the ordering,
+    the sort key and the primary key of the boundary row plus the direction,
+    f.e. ["-trending", 97.5, 17, "n"], encoded with urlsafe base64.
+    """
+    def __init__(self, queryset: QuerySet, per_page: int, ordering: str):
+        self.queryset = queryset
+        self.per_page = int(per_page)
+        self.ordering = ordering
+        self.descending = ordering.startswith("-")
+        self.field = ordering.lstrip("-")
+        if self.field == "id":
+            self.field = "pk"
+
+    def page(self, cursor: str | None = None) -> CursorPage:
+        if not cursor:
+            rows = list(self.queryset.order_by(*self._order_by())[:self.per_page + 1])
+            return CursorPage(rows[:self.per_page], self, len(rows) > self.per_page, False)
+
+        value, pk, direction = self.decode_cursor(cursor)
+        if direction == NEXT:
+            queryset = self.queryset.filter(self._q(value, pk, after=True))
+            rows = list(queryset.order_by(*self._order_by())[:self.per_page + 1])
+            return CursorPage(rows[:self.per_page], self, len(rows) > self.per_page, True)
+
+        # for the previous page, walk backwards from the cursor and restore the order
+        queryset = self.queryset.filter(self._q(value, pk, after=False))
+        rows = list(queryset.order_by(*self._order_by(reverse=True))[:self.per_page + 1])
+        has_previous = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        rows.reverse()
+
+        return CursorPage(rows, self, True, has_previous)
+
+    def encode_cursor(self, obj, direction: str) -> str:
+        value = getattr(obj, self.field)
+        if not isinstance(value, (int, float)):
+            # f.e. Decimal, it is restored by the db field on filtering
+            value = str(value)
+        data = json.dumps([self.ordering, value, obj.pk, direction])
+
+        return urlsafe_base64_encode(data.encode())
+
+    def decode_cursor(self, cursor: str):
+        """
+        Returns (value, pk, direction) from the cursor token,
+        raises Http404 (same as django Paginator for an invalid page)
+        if the token is malformed or it was created for a different ordering.
+        """
+        try:
+            ordering, value, pk, direction = json.loads(urlsafe_base64_decode(cursor))
+        except (ValueError, TypeError):
+            raise Http404(_("Invalid cursor."))
+
+        if ordering != self.ordering or direction not in (NEXT, PREVIOUS) or not isinstance(pk, int):
+            raise Http404(_("Invalid cursor."))
+
+        # the sort key has to be a valid value of the field, f.e. not "abc" for trending
+        try:
+            opts = self.queryset.model._meta
+            field = opts.pk if self.field == "pk" else opts.get_field(self.field)
+            value = field.to_python(value)
+        except (ValidationError, TypeError):
+            raise Http404(_("Invalid cursor."))
+        if value is None:
+            raise Http404(_("Invalid cursor."))
+
+        return value, pk, direction
+
+    def _order_by(self, reverse: bool = False):
+        descending = self.descending != reverse
+        prefix = "-" if descending else ""
+        if self.field == "pk":
+            return ["%spk" % prefix]
+
+        return ["%s%s" % (prefix, self.field), "%spk" % prefix]
+
+    def _q(self, value, pk: int, after: bool):
+        """
+        Rows placed after (or before) the boundary row in the current ordering.
+        """
+        lookup = "lt" if self.descending == after else "gt"
+        if self.field == "pk":
+            return Q(**{"pk__%s" % lookup: pk})
+
+        return (
+                Q(**{"%s__%s" % (self.field, lookup): value}) |
+                Q(**{self.field: value, "pk__%s" % lookup: pk})
+        )
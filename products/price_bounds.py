@@ -0,0 +1,59 @@
+"""
+The lowest and the highest effective price of available Products
+per listing scope: all Products, a category subtree, a campaign
+or search results. They set the range of the price slider.
+
+Bounds are cached under the "prices" version (see products.cache_versions),
+bumped on every change of prices or of the scopes (categories, campaigns,
+search keywords), so listings don't aggregate prices on a cache hit.
+Changes of availability don't bump the version, they are reflected
+once the cached bounds expire (settings.PRODUCTS_PRICE_BOUNDS_TIMEOUT).
+"""
+from __future__ import annotations
+
+import hashlib
+from decimal import Decimal
+from typing import Iterable, NamedTuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Max, Min, QuerySet
+
+from products import cache_versions
+
+VERSION = "prices"
+
+
+class PriceBounds(NamedTuple):
+    min: Decimal | None
+    max: Decimal | None
+
+
+def get_timeout() -> int:
+    return getattr(settings, "PRODUCTS_PRICE_BOUNDS_TIMEOUT", 60 * 15)
+
+
+def get_price_bounds(scope: str, queryset: QuerySet) -> PriceBounds:
+    """
+    Returns cached bounds of the scope, 'queryset' (Products of the scope)
+    is aggregated only on a cache miss.
+    """
+    key = cache_versions.make_key(VERSION, "bounds", scope)
+    bounds = cache.get(key)
+    if bounds is None:
+        bounds = queryset.order_by().aggregate(min=Min("effective_price"), max=Max("effective_price"))
+        bounds = (bounds["min"], bounds["max"])
+        cache.set(key, bounds, get_timeout())
+
+    return PriceBounds(*bounds)
+
+
+def search_scope(keywords: Iterable[str]) -> str:
+    """ The same scope for f.e. 'Summer dress' and 'dress summer'. """
+    words = " ".join(sorted({word.lower() for word in keywords if word}))
+
+    return "search:%s" % hashlib.md5(words.encode()).hexdigest()
+
+
+def invalidate():
+    cache_versions.bump_on_commit(VERSION)
@@ -0,0 +1,471 @@
+"""
+Full-text search of ParentProducts used by the search list.
+
+A backend finds ParentProducts matching the words of a query in their
+name, search keywords, description and names of their category
+(with its ancestors) and scores them by relevance. The view then ranks
+children Products by the relevance of their parent blended with their views.
+
+Backends (settings.PRODUCTS_SEARCH_BACKEND):
+- LocalIndexBackend (default) - an inverted index kept in every process,
+  with simple stemming and prefix matching, no db queries on search,
+- SQLiteFTS5Backend - an FTS5 virtual table in the SQLite db,
+- PostgresBackend - tsvector/tsquery computed by PostgreSQL.
+
+Backends are kept up to date by the signals in products.signals.
+"""
+from __future__ import annotations
+
+import bisect
+import logging
+import math
+import re
+import threading
+import unicodedata
+from collections import Counter, defaultdict
+from typing import Callable, Iterable
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils.module_loading import import_string
+
+from products import cache_versions
+from products.models import Category, ParentProduct
+
+logger = logging.getLogger(__name__)
+
+VERSION = "search"
+
+# weight of a word found in the given field
+FIELD_WEIGHTS = {
+    "name": 3.0,
+    "search_keywords": 2.0,
+    "categories": 1.5,
+    "description": 1.0,
+}
+# a word matching only the beginning of an indexed word, f.e. 'swea' -> 'sweater'
+PREFIX_FACTOR = 0.5
+MIN_PREFIX_LENGTH = 2
+# share of views in the ranking of Products, the rest is relevance
+VIEWS_WEIGHT = 0.2
+
+STOP_WORDS = frozenset((
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "in", "is", "it",
+    "of", "on", "or", "our", "that", "the", "this", "to", "with", "you", "your",
+))
+
+WORD_RE = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> list[str]:
+    """ Lowercase words without accents, f.e. 'Café T-Shirt' -> ['cafe', 't', 'shirt'] """
+    text = text.lower()
+    if not text.isascii():
+        text = unicodedata.normalize("NFKD", text)
+        text = "".join(char for char in text if not unicodedata.combining(char))
+
+    return WORD_RE.findall(text)
+
+
+def stem(word: str) -> str:
+    """
+    A light stemmer reducing plural and verb forms to a common stem,
+    f.e. 'dresses' -> 'dress', 'accessories' -> 'accessory', 'knitted' -> 'knit'.
+    It doesn't need to produce real words, only the same stem
+    for the indexed text and for the query.
+    """
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 4 and word.endswith(("sses", "xes", "ches", "shes")):
+        return word[:-2]
+    if len(word) > 3 and word.endswith("s") and not word.endswith(("ss", "us", "is")):
+        return word[:-1]
+    for suffix in ("ing", "ed"):
+        if len(word) - len(suffix) >= 3 and word.endswith(suffix):
+            word = word[:-len(suffix)]
+            # 'knitt' -> 'knit'
+            if word[-1] == word[-2] and word[-1] not in "lsz":
+                word = word[:-1]
+            return word
+
+    return word
+
+
+def analyze(text: str) -> list[str]:
+    """ Stems of the words of the text, without stop words and single letters. """
+    return [stem(word) for word in tokenize(text) if len(word) > 1 and word not in STOP_WORDS]
+
+
+def category_names() -> dict[int, str]:
+    """ {category pk: names of the category and all its ancestors} """
+    categories = {pk: (parent, name) for pk, parent, name in Category.objects.values_list("pk", "parent_id", "name")}
+    names = {}
+    for pk in categories:
+        path, current = [], pk
+        while current is not None and len(path) < len(categories):
+            parent, name = categories[current]
+            path.append(name)
+            current = parent
+        names[pk] = " ".join(path)
+
+    return names
+
+
+def documents(queryset) -> Iterable[tuple[int, dict[str, str]]]:
+    """ Yields (pk, {field: text}) of ParentProducts for indexing. """
+    categories = category_names()
+    for pk, name, keywords, description, category in queryset.values_list(
+            "pk", "name", "search_keywords", "description", "category_id"
+    ).order_by("pk"):
+        yield pk, {
+            "name": name,
+            "search_keywords": keywords,
+            "categories": categories.get(category, ""),
+            "description": description,
+        }
+
+
+class SearchBackend:
+    # whether the index is kept in the db, so it's updated in the same transaction
+    # as ParentProducts, otherwise it's updated once the transaction is committed
+    in_database = False
+    max_results = 1000
+
+    def search(self, query: str) -> dict[int, float]:
+        """
+        Returns {ParentProduct pk: relevance} of at most 'max_results'
+        best matches for any of the words of the query.
+        """
+        raise NotImplementedError
+
+    def update(self, pks: Iterable[int]):
+        """ Re-read the given ParentProducts from the db (missing ones are removed). """
+
+    def remove(self, pks: Iterable[int]):
+        pass
+
+    def rebuild(self):
+        pass
+
+    def top(self, scores: dict[int, float]) -> dict[int, float]:
+        best = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:self.max_results]
+
+        return dict(best)
+
+
+class LocalIndexBackend(SearchBackend):
+    """
+    An in-process inverted index: {stem: {ParentProduct pk: weight}}
+    with a sorted list of the stems for prefix lookups.
+
+    Every write of ParentProducts bumps the "search" version
+    in the shared cache (see products.cache_versions). The process
+    which made the write updates its index incrementally, other processes
+    rebuild theirs on the next search when they see a newer version.
+    """
+    # limit of indexed words expanded from a single prefix
+    max_prefix_terms = 50
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        self.built = False
+        self.version = None
+        self.postings: dict[str, dict[int, float]] = {}
+        self.terms: list[str] = []
+        # pk -> {stem: weight}, to remove a ParentProduct from the postings
+        self.documents: dict[int, dict[str, float]] = {}
+
+    def build(self):
+        # the version is read first, so changes made during
+        # the build are picked up by the next one
+        version = cache_versions.get_version(VERSION)
+        with self._lock:
+            self.clear()
+            self._index(ParentProduct.objects.all())
+            self.terms = sorted(self.postings)
+            self.built = True
+            self.version = version
+
+        return self
+
+    def rebuild(self):
+        cache_versions.bump(VERSION)
+        self.build()
+
+    def search(self, query: str) -> dict[int, float]:
+        words = list(dict.fromkeys(analyze(query)))
+        if not words:
+            return {}
+        if not self.built or self.version != cache_versions.get_version(VERSION):
+            self.build()
+
+        with self._lock:
+            total = len(self.documents)
+            scores, matched = defaultdict(float), defaultdict(int)
+            for word in words:
+                word_scores = {}
+                for term, factor in self._expand(word):
+                    postings = self.postings[term]
+                    idf = math.log(1 + total / len(postings))
+                    for pk, weight in postings.items():
+                        word_scores[pk] = max(word_scores.get(pk, 0), weight * idf * factor)
+                for pk, score in word_scores.items():
+                    scores[pk] += score
+                    matched[pk] += 1
+
+        # matches of more words of the query first
+        return self.top({pk: score * matched[pk] / len(words) for pk, score in scores.items()})
+
+    def update(self, pks: Iterable[int]):
+        pks = set(pks)
+        if pks:
+            self._changed(lambda: self._reindex(pks))
+
+    def remove(self, pks: Iterable[int]):
+        pks = set(pks)
+        if pks:
+            self._changed(lambda: [self._remove(pk) for pk in pks])
+
+    def _changed(self, apply: Callable):
+        version = cache_versions.bump(VERSION)
+        with self._lock:
+            if not self.built:
+                return
+            apply()
+            if version is not None and self.version is not None and version == self.version + 1:
+                self.version = version
+            else:
+                # another process has changed the index meanwhile
+                self.built = False
+
+    def _expand(self, word: str) -> Iterable[tuple[str, float]]:
+        """ Indexed stems matching the word, with a factor of their weight. """
+        if word in self.postings:
+            yield word, 1.0
+        if len(word) < MIN_PREFIX_LENGTH:
+            return
+
+        position = bisect.bisect_right(self.terms, word)
+        for term in self.terms[position:position + self.max_prefix_terms]:
+            if not term.startswith(word):
+                break
+            yield term, PREFIX_FACTOR
+
+    def _reindex(self, pks: set[int]):
+        for pk in pks:
+            self._remove(pk)
+        self._index(ParentProduct.objects.filter(pk__in=pks))
+
+    def _index(self, queryset):
+        for pk, fields in documents(queryset):
+            weights = defaultdict(float)
+            for field, text in fields.items():
+                for term, count in Counter(analyze(text)).items():
+                    weights[term] += FIELD_WEIGHTS[field] * (1 + math.log(count))
+
+            self.documents[pk] = weights
+            for term, weight in weights.items():
+                postings = self.postings.get(term)
+                if postings is None:
+                    postings = self.postings[term] = {}
+                    if self.built:
+                        bisect.insort(self.terms, term)
+                postings[pk] = weight
+
+    def _remove(self, pk: int):
+        for term in self.documents.pop(pk, {}):
+            postings = self.postings[term]
+            postings.pop(pk, None)
+            if not postings:
+                del self.postings[term]
+                del self.terms[bisect.bisect_left(self.terms, term)]
+
+
+class SQLiteFTS5Backend(SearchBackend):
+    """
+    An FTS5 virtual table with a row per ParentProduct (rowid = pk),
+    ranked with bm25 using FIELD_WEIGHTS. The table isn't a model,
+    it's created and filled by rebuild() (the 'rebuild_search_index' command)
+    after the backend is configured, or by the migration if it already was.
+    """
+    in_database = True
+    table = "products_parentproduct_fts"
+    columns = ("name", "search_keywords", "categories", "description")
+    tokenize = "tokenize = 'porter unicode61 remove_diacritics 2'"
+
+    def __init__(self):
+        if connection.vendor != "sqlite":
+            raise ImproperlyConfigured("SQLiteFTS5Backend requires an SQLite database.")
+        self._table_exists = False
+
+    def table_exists(self) -> bool:
+        """
+        Until rebuild() creates the table, nothing is searched or updated
+        (rebuild() indexes all ParentProducts anyway).
+        """
+        if not self._table_exists:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1 FROM sqlite_master WHERE name = %s", [self.table])
+                self._table_exists = cursor.fetchone() is not None
+            if not self._table_exists:
+                logger.warning("The table of SQLiteFTS5Backend is missing, run 'rebuild_search_index'.")
+
+        return self._table_exists
+
+    def search(self, query: str) -> dict[int, float]:
+        words = [word for word in tokenize(query) if word not in STOP_WORDS]
+        if not words or not self.table_exists():
+            return {}
+
+        # any of the words, each as a prefix, f.e. "summ"* OR "dress"*
+        match = " OR ".join('"%s"*' % word for word in dict.fromkeys(words))
+        weights = ", ".join(str(FIELD_WEIGHTS[column]) for column in self.columns)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT rowid, bm25(%s, %s) FROM %s WHERE %s MATCH %%s ORDER BY 2, rowid LIMIT %%s"
+                % (self.table, weights, self.table, self.table),
+                [match, self.max_results],
+            )
+            # bm25 is negative, lower is better
+            return {pk: -score for pk, score in cursor.fetchall()}
+
+    def update(self, pks: Iterable[int]):
+        pks = list(pks)
+        if pks and self.table_exists():
+            self.remove(pks)
+            self._insert(ParentProduct.objects.filter(pk__in=pks))
+
+    def remove(self, pks: Iterable[int]):
+        pks = list(pks)
+        if pks and self.table_exists():
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "DELETE FROM %s WHERE rowid IN (%s)" % (self.table, ", ".join(["%s"] * len(pks))), pks
+                )
+
+    def rebuild(self):
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "CREATE VIRTUAL TABLE IF NOT EXISTS %s USING fts5(%s, %s)"
+                    % (self.table, ", ".join(self.columns), self.tokenize)
+                )
+                cursor.execute("DELETE FROM %s" % self.table)
+            self._insert(ParentProduct.objects.all())
+        self._table_exists = True
+
+    def _insert(self, queryset):
+        rows = [
+            [pk, *(fields[column] for column in self.columns)]
+            for pk, fields in documents(queryset)
+        ]
+        if rows:
+            with connection.cursor() as cursor:
+                cursor.executemany(
+                    "INSERT INTO %s (rowid, %s) VALUES (%s)"
+                    % (self.table, ", ".join(self.columns), ", ".join(["%s"] * (len(self.columns) + 1))),
+                    rows,
+                )
+
+
+class PostgresBackend(SearchBackend):
+    """
+    A tsvector of the searchable fields (weighted A-D like FIELD_WEIGHTS)
+    matched against a prefix tsquery, ranked with ts_rank.
+    The vector is computed by the query, so there's nothing to update,
+    only the name of the direct category is searched.
+    """
+    in_database = True
+    config = "english"
+
+    def __init__(self):
+        if connection.vendor != "postgresql":
+            raise ImproperlyConfigured("PostgresBackend requires a PostgreSQL database.")
+
+    def search(self, query: str) -> dict[int, float]:
+        from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+
+        words = [word for word in tokenize(query) if word not in STOP_WORDS]
+        if not words:
+            return {}
+
+        vector = (
+            SearchVector("name", weight="A", config=self.config)
+            + SearchVector("search_keywords", weight="B", config=self.config)
+            + SearchVector("category__name", weight="C", config=self.config)
+            + SearchVector("description", weight="D", config=self.config)
+        )
+        # words consist only of \w characters, so they are safe in a raw tsquery
+        search_query = SearchQuery(
+            " | ".join("%s:*" % word for word in dict.fromkeys(words)), search_type="raw", config=self.config
+        )
+        rows = ParentProduct.objects.annotate(document=vector).filter(document=search_query).annotate(
+            rank=SearchRank(F("document"), search_query)
+        ).order_by("-rank", "pk").values_list("pk", "rank")[:self.max_results]
+
+        return dict(rows)
+
+
+_backends = {}
+
+
+def get_backend() -> SearchBackend:
+    path = getattr(settings, "PRODUCTS_SEARCH_BACKEND", "products.search.LocalIndexBackend")
+    if path not in _backends:
+        _backends[path] = import_string(path)()
+
+    return _backends[path]
+
+
+def search(query: str) -> dict[int, float]:
+    return get_backend().search(query)
+
+
+def update(get_pks: Callable[[], Iterable[int]]):
+    """
+    Update the given ParentProducts in the index of the current backend:
+    in the current transaction if the index is in the db, otherwise
+    once the transaction is committed, so that rolled back changes
+    never get into the index. 'get_pks' is a callable, so the pks
+    can be fetched lazily.
+    """
+    backend = get_backend()
+    if backend.in_database:
+        backend.update(get_pks())
+    else:
+        transaction.on_commit(lambda: backend.update(get_pks()))
+
+
+def remove(pks: Iterable[int]):
+    backend = get_backend()
+    pks = list(pks)
+    if backend.in_database:
+        backend.remove(pks)
+    else:
+        transaction.on_commit(lambda: backend.remove(pks))
+
+
+def rank_products(products, relevance: dict[int, float]) -> list[int]:
+    """
+    Returns pks of the Products ordered by the relevance of their parents
+    blended with their views (on a log scale), both relative to the highest one.
+    """
+    rows = list(products.order_by().values_list("pk", "parent_id", "views"))
+    top_relevance = max(relevance.values(), default=0) or 1
+    top_views = math.log1p(max((views for _, _, views in rows), default=0)) or 1
+
+    def score(row):
+        pk, parent, views = row
+        return (
+            (1 - VIEWS_WEIGHT) * relevance.get(parent, 0) / top_relevance
+            + VIEWS_WEIGHT * math.log1p(views) / top_views
+        )
+
+    rows.sort(key=lambda row: (score(row), row[0]), reverse=True)
+
+    return [pk for pk, _, _ in rows]
@@ -0,0 +1,123 @@
+"""
+Updates of ParentProduct.all_products_json, the data of all children Products
+(slug and main image) used for showing the siblings of a Product.
+
+Only the keys of the changed Products are written, with a single
+UPDATE of all_products_json (the current value is read with a row lock
+within the transaction, so concurrent changes of siblings aren't lost),
+instead of saving the whole ParentProduct. Saves of Products which don't change
+their entry (f.e. of prices or views) don't touch the parent at all.
+
+During bulk operations the updates can be collected and written once per parent:
+
+    with siblings.batch():
+        for product in products:
+            product.save()
+
+or skipped altogether with siblings.suspend(), f.e. when all_products_json
+is rebuilt afterwards with rebuild() (which computes it from the Products).
+The 'rebuild_sibling_json' command finds and rebuilds parents which drifted,
+f.e. after bulk or raw SQL changes of Products, which don't send signals.
+"""
+from __future__ import annotations
+
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Iterable
+
+from django.db import transaction
+from django.dispatch import Signal
+
+from products.models import ParentProduct, Product
+
+# fields of Product stored in all_products_json (see Product.get_sibling_entry)
+FIELDS = ("slug", "main_image")
+
+_pending = threading.local()
+
+# sent with the pks of ParentProducts whose all_products_json was written
+entries_changed = Signal()
+
+
+def set_entries(parent_pk: int, entries: dict[str, dict | None]):
+    """ Set entries ({product pk: entry, None to remove it}) of the parent. """
+    if not entries or getattr(_pending, "suspended", False):
+        return
+    batched = getattr(_pending, "entries", None)
+    if batched is not None:
+        batched[parent_pk].update(entries)
+        return
+
+    with transaction.atomic():
+        current = (
+            ParentProduct.objects.select_for_update().filter(pk=parent_pk)
+            .values_list("all_products_json", flat=True).first()
+        )
+        if current is None:
+            # the parent is being deleted
+            return
+        updated = dict(current)
+        for key, entry in entries.items():
+            if entry is None:
+                updated.pop(key, None)
+            else:
+                updated[key] = entry
+        if updated != current:
+            ParentProduct.objects.filter(pk=parent_pk).update(all_products_json=updated)
+            entries_changed.send(sender=ParentProduct, pks=[parent_pk])
+
+
+@contextmanager
+def batch():
+    """ Collect updates of all_products_json and write them once per parent at the end. """
+    if getattr(_pending, "entries", None) is not None:
+        # nested, written by the outermost one
+        yield
+        return
+
+    _pending.entries = defaultdict(dict)
+    try:
+        yield
+        entries, _pending.entries = _pending.entries, None
+        for parent_pk, parent_entries in entries.items():
+            set_entries(parent_pk, parent_entries)
+    finally:
+        _pending.entries = None
+
+
+@contextmanager
+def suspend():
+    """ Skip updates of all_products_json, f.e. when it's rebuilt afterwards. """
+    suspended = getattr(_pending, "suspended", False)
+    _pending.suspended = True
+    try:
+        yield
+    finally:
+        _pending.suspended = suspended
+
+
+def build(parent_pks: Iterable[int]) -> dict[int, dict[str, dict]]:
+    """ all_products_json of the parents computed from their Products, with a single query. """
+    built = {pk: {} for pk in parent_pks}
+    products = Product.objects.filter(parent__in=built).order_by().values_list("parent_id", "pk", *FIELDS)
+    for parent_pk, pk, slug, main_image in products:
+        built[parent_pk][str(pk)] = Product.sibling_entry(slug, main_image)
+
+    return built
+
+
+def rebuild(parent_pks: Iterable[int]) -> list[int]:
+    """ Write all_products_json of the parents which differ from build(), returns their pks. """
+    with transaction.atomic():
+        built = build(parent_pks)
+        current = ParentProduct.objects.select_for_update().filter(pk__in=built).values_list(
+            "pk", "all_products_json"
+        )
+        drifted = [pk for pk, value in current if value != built[pk]]
+        for pk in drifted:
+            ParentProduct.objects.filter(pk=pk).update(all_products_json=built[pk])
+        if drifted:
+            entries_changed.send(sender=ParentProduct, pks=drifted)
+
+    return drifted
@@ -1,10 +1,13 @@
-from django.core.cache import cache
-from django.db.models.signals import post_save, post_delete
+from django.db.models.signals import post_save, post_delete, pre_delete
 from django.dispatch import Signal, receiver
-from django.utils import timezone
-from django.utils.dateparse import parse_datetime
 
-from products.models import Product
+from mptt.signals import node_moved
+
+from products import (
+    autocomplete, cards, inventory_index, page_cache, price_bounds, search, siblings, spelling, taxonomy,
+    view_counter, view_dedup
+)
+from products.models import Product, Stock, ParentProduct, Category, Campaign, Color, Image, Size, SizeGroup
 
 VIEWED = "viewed"
 
@@ -12,67 +15,299 @@ product_viewed = Signal()
 
 
 @receiver(post_save, sender=Product, dispatch_uid='add_to_json')
-def add_product_to_json_field(sender, instance, **kwargs):
+def add_product_to_json_field(sender, instance, created, update_fields, **kwargs):
+    """ Skipped when neither the parent, the slug nor the main image have changed. """
+    if update_fields is not None and not {"parent", *siblings.FIELDS} & set(update_fields):
+        return
 
-    new_data = {
-        f"{instance.id}": {
-            "slug": instance.slug,
-            "img_public_id": instance.main_image.public_id
-        }
-    }
-    parent = instance.parent
-    parent.all_products_json.update(new_data)
-    parent.save()
+    loaded_parent, loaded_entry = getattr(instance, "_loaded_sibling_entry", (None, None))
+    entry = instance.get_sibling_entry()
+    if not created and (loaded_parent, loaded_entry) == (instance.parent_id, entry):
+        return
+
+    key = str(instance.id)
+    if loaded_parent is not None and loaded_parent != instance.parent_id:
+        siblings.set_entries(loaded_parent, {key: None})
+    siblings.set_entries(instance.parent_id, {key: entry})
+    instance._loaded_sibling_entry = (instance.parent_id, entry)
+    if Product.parent.is_cached(instance):
+        instance.parent.all_products_json[key] = entry
 
 
 @receiver(post_delete, sender=Product)
 def remove_product_from_json_field(sender, instance, **kwargs):
+    siblings.set_entries(instance.parent_id, {str(instance.id): None})
+
+
+@receiver(pre_delete, sender=Size, dispatch_uid='stock_totals_size_deleting')
+def collect_products_of_size(sender, instance, **kwargs):
+    """
+    Stock of a deleted Size is deleted by a cascade, without Stock.delete(),
+    so totals of its Products are recalculated once it's gone.
+    """
+    instance._stock_product_ids = list(
+        Stock.objects.filter(size=instance).order_by().values_list("product_id", flat=True).distinct()
+    )
+
+
+@receiver(post_delete, sender=Size, dispatch_uid='stock_totals_size_deleted')
+def update_stock_totals_of_size(sender, instance, **kwargs):
+    product_ids = getattr(instance, "_stock_product_ids", None)
+    if product_ids:
+        Product.objects.filter(pk__in=product_ids).update_stock_totals()
+
+
+@receiver(post_save, sender=Product, dispatch_uid='inventory_index_product_saved')
+@receiver(post_delete, sender=Product, dispatch_uid='inventory_index_product_deleted')
+def update_inventory_index_for_product(sender, instance, **kwargs):
+    pk = instance.pk
+    inventory_index.reindex_on_commit(lambda: [pk])
+
+
+@receiver(post_save, sender=Stock, dispatch_uid='inventory_index_stock_saved')
+@receiver(post_delete, sender=Stock, dispatch_uid='inventory_index_stock_deleted')
+def update_inventory_index_for_stock(sender, instance, **kwargs):
+    product_id = instance.product_id
+    inventory_index.reindex_on_commit(lambda: [product_id])
+
+
+@receiver(post_save, sender=ParentProduct, dispatch_uid='inventory_index_parent_saved')
+def update_inventory_index_for_parent(sender, instance, **kwargs):
+    """ Category or Campaign of all children Products might have changed. """
+    pk = instance.pk
+    inventory_index.reindex_on_commit(
+        lambda: Product.objects.filter(parent=pk).values_list("pk", flat=True)
+    )
+
+
+@receiver(post_save, sender=Category, dispatch_uid='inventory_index_category_saved')
+@receiver(post_delete, sender=Category, dispatch_uid='inventory_index_category_deleted')
+@receiver(node_moved, sender=Category, dispatch_uid='inventory_index_category_moved')
+@receiver(post_delete, sender=Campaign, dispatch_uid='inventory_index_campaign_deleted')
+def invalidate_inventory_index(sender, **kwargs):
+    """ The tree of categories has changed or parents were updated in bulk. """
+    inventory_index.invalidate_on_commit()
+
+
+@receiver(post_save, sender=Product, dispatch_uid='price_bounds_product_saved')
+def invalidate_price_bounds_for_product(sender, instance, created, **kwargs):
+    if created or instance.effective_price != getattr(instance, "_loaded_effective_price", None):
+        price_bounds.invalidate()
+
+
+@receiver(post_save, sender=ParentProduct, dispatch_uid='price_bounds_parent_saved')
+def invalidate_price_bounds_for_parent(sender, instance, created, **kwargs):
+    """ Products might have moved to another category, campaign or search results. """
+    if not created and instance.get_scope() != getattr(instance, "_loaded_scope", None):
+        price_bounds.invalidate()
+
+
+@receiver(post_delete, sender=Product, dispatch_uid='price_bounds_product_deleted')
+@receiver(post_save, sender=Category, dispatch_uid='price_bounds_category_saved')
+@receiver(post_delete, sender=Category, dispatch_uid='price_bounds_category_deleted')
+@receiver(node_moved, sender=Category, dispatch_uid='price_bounds_category_moved')
+@receiver(post_delete, sender=Campaign, dispatch_uid='price_bounds_campaign_deleted')
+def invalidate_price_bounds(sender, **kwargs):
+    price_bounds.invalidate()
+
+
+@receiver(post_save, sender=Category, dispatch_uid='taxonomy_category_saved')
+@receiver(post_delete, sender=Category, dispatch_uid='taxonomy_category_deleted')
+@receiver(node_moved, sender=Category, dispatch_uid='taxonomy_category_moved')
+@receiver(post_save, sender=Color, dispatch_uid='taxonomy_color_saved')
+@receiver(post_delete, sender=Color, dispatch_uid='taxonomy_color_deleted')
+@receiver(post_save, sender=Size, dispatch_uid='taxonomy_size_saved')
+@receiver(post_delete, sender=Size, dispatch_uid='taxonomy_size_deleted')
+@receiver(post_save, sender=SizeGroup, dispatch_uid='taxonomy_size_group_saved')
+@receiver(post_delete, sender=SizeGroup, dispatch_uid='taxonomy_size_group_deleted')
+@receiver(post_save, sender=Campaign, dispatch_uid='taxonomy_campaign_saved')
+@receiver(post_delete, sender=Campaign, dispatch_uid='taxonomy_campaign_deleted')
+def invalidate_taxonomy(sender, **kwargs):
+    taxonomy.invalidate()
+
+
+@receiver(post_save, sender=ParentProduct, dispatch_uid='search_parent_saved')
+def update_search_for_parent(sender, instance, created, **kwargs):
+    """ Skipped when searched fields haven't changed, f.e. on updates of all_products_json. """
+    if created or instance.get_scope() != getattr(instance, "_loaded_scope", None):
+        pk = instance.pk
+        search.update(lambda: [pk])
+
+
+@receiver(post_delete, sender=ParentProduct, dispatch_uid='search_parent_deleted')
+def remove_from_search(sender, instance, **kwargs):
+    search.remove([instance.pk])
+
+
+@receiver(post_save, sender=Category, dispatch_uid='search_category_saved')
+@receiver(node_moved, sender=Category, dispatch_uid='search_category_moved')
+def update_search_for_category(sender, instance, **kwargs):
+    """ Names of the category and its ancestors are searched in its subtree. """
+    search.update(
+        lambda: ParentProduct.objects.filter(
+            category__in=instance.get_descendants(include_self=True)
+        ).values_list("pk", flat=True)
+    )
+
+
+@receiver(pre_delete, sender=Category, dispatch_uid='search_category_deleting')
+def collect_parents_for_search(sender, instance, **kwargs):
+    # parents are detached from the category before post_delete
+    instance._search_parents = list(ParentProduct.objects.filter(category=instance).values_list("pk", flat=True))
+
+
+@receiver(post_delete, sender=Category, dispatch_uid='search_category_deleted')
+def update_search_for_deleted_category(sender, instance, **kwargs):
+    parents = getattr(instance, "_search_parents", [])
+    if parents:
+        search.update(lambda: parents)
+
 
-    parent = instance.parent
-    parent.all_products_json.pop(str(instance.id))
-    parent.save()
+@receiver(post_save, sender=Product, dispatch_uid='autocomplete_product_saved')
+def update_autocomplete_for_product(sender, instance, update_fields, **kwargs):
+    pk = instance.pk
+    autocomplete.update_on_commit(lambda: [pk], scores_only=update_fields == {"views"})
+
+
+@receiver(post_delete, sender=Product, dispatch_uid='autocomplete_product_deleted')
+def remove_from_autocomplete(sender, instance, **kwargs):
+    pk = instance.pk
+    autocomplete.update_on_commit(lambda: [pk])
+
+
+@receiver(post_save, sender=ParentProduct, dispatch_uid='autocomplete_parent_saved')
+def update_autocomplete_for_parent(sender, instance, created, **kwargs):
+    """ Names, keywords and categories of children Products. """
+    if not created and instance.get_scope() != getattr(instance, "_loaded_scope", None):
+        pk = instance.pk
+        autocomplete.update_on_commit(lambda: Product.objects.filter(parent=pk).values_list("pk", flat=True))
+
+
+@receiver(post_save, sender=Category, dispatch_uid='autocomplete_category_saved')
+@receiver(post_delete, sender=Category, dispatch_uid='autocomplete_category_deleted')
+@receiver(node_moved, sender=Category, dispatch_uid='autocomplete_category_moved')
+def invalidate_autocomplete(sender, **kwargs):
+    autocomplete.invalidate_on_commit()
+
+
+@receiver(post_save, sender=ParentProduct, dispatch_uid='spelling_parent_saved')
+def invalidate_spelling_for_parent(sender, instance, created, **kwargs):
+    if created or instance.get_scope() != getattr(instance, "_loaded_scope", None):
+        spelling.invalidate()
+
+
+@receiver(post_delete, sender=ParentProduct, dispatch_uid='spelling_parent_deleted')
+@receiver(post_save, sender=Category, dispatch_uid='spelling_category_saved')
+@receiver(post_delete, sender=Category, dispatch_uid='spelling_category_deleted')
+def invalidate_spelling(sender, **kwargs):
+    spelling.invalidate()
+
+
+@receiver(view_counter.views_flushed, sender=Product, dispatch_uid='views_flushed')
+def update_autocomplete_for_views(sender, pks, **kwargs):
+    """ Views are written without saving Products, so post_save receivers aren't triggered. """
+    autocomplete.update_on_commit(lambda: pks, scores_only=True)
+
+
+@receiver(post_save, sender=Product, dispatch_uid='cards_product_saved')
+def invalidate_card(sender, instance, update_fields, **kwargs):
+    """ Skipped on updates of counters, which aren't shown on cards. """
+    if update_fields is None or not set(update_fields) <= set(Product.COUNTER_FIELDS):
+        pk = instance.pk
+        cards.invalidate(lambda: [pk])
+
+
+@receiver(post_save, sender=Stock, dispatch_uid='cards_stock_saved')
+@receiver(post_delete, sender=Stock, dispatch_uid='cards_stock_deleted')
+def invalidate_card_for_stock(sender, instance, **kwargs):
+    product_id = instance.product_id
+    cards.invalidate(lambda: [product_id])
+
+
+@receiver(post_save, sender=ParentProduct, dispatch_uid='cards_parent_saved')
+def invalidate_cards_for_parent(sender, instance, created, **kwargs):
+    """
+    The name is shown on cards of children Products, the other fields on their pages,
+    whose ETags have the versions of the cards (see products.conditional).
+    """
+    if not created:
+        pk = instance.pk
+        cards.invalidate(lambda: Product.objects.filter(parent=pk).values_list("pk", flat=True))
+
+
+@receiver(post_delete, sender=Product, dispatch_uid='cards_product_deleted')
+@receiver(post_save, sender=Image, dispatch_uid='cards_image_saved')
+@receiver(post_delete, sender=Image, dispatch_uid='cards_image_deleted')
+def invalidate_product_page(sender, instance, **kwargs):
+    """ Not shown on cards, but on pages of Products, see invalidate_cards_for_parent. """
+    pk = instance.pk if sender is Product else instance.product_id
+    cards.invalidate(lambda: [pk])
+
+
+@receiver(siblings.entries_changed, sender=ParentProduct, dispatch_uid='cards_siblings_changed')
+def invalidate_cards_for_siblings(sender, pks, **kwargs):
+    """ Cards show thumbnails of siblings. """
+    cards.invalidate(lambda: Product.objects.filter(parent__in=pks).values_list("pk", flat=True))
+
+
+@receiver(post_save, sender=Size, dispatch_uid='cards_size_saved')
+@receiver(post_delete, sender=Size, dispatch_uid='cards_size_deleted')
+def invalidate_cards(sender, **kwargs):
+    cards.invalidate_all()
+
+
+@receiver(post_save, sender=Product, dispatch_uid='pages_product_saved')
+def invalidate_pages_for_product(sender, instance, update_fields, **kwargs):
+    """ Skipped on updates of counters, like cards. """
+    if update_fields is None or not set(update_fields) <= set(Product.COUNTER_FIELDS):
+        page_cache.invalidate()
+
+
+@receiver(post_delete, sender=Product, dispatch_uid='pages_product_deleted')
+@receiver(post_save, sender=Stock, dispatch_uid='pages_stock_saved')
+@receiver(post_delete, sender=Stock, dispatch_uid='pages_stock_deleted')
+@receiver(post_save, sender=ParentProduct, dispatch_uid='pages_parent_saved')
+@receiver(post_delete, sender=ParentProduct, dispatch_uid='pages_parent_deleted')
+@receiver(siblings.entries_changed, sender=ParentProduct, dispatch_uid='pages_siblings_changed')
+@receiver(post_save, sender=Category, dispatch_uid='pages_category_saved')
+@receiver(post_delete, sender=Category, dispatch_uid='pages_category_deleted')
+@receiver(node_moved, sender=Category, dispatch_uid='pages_category_moved')
+@receiver(post_save, sender=Campaign, dispatch_uid='pages_campaign_saved')
+@receiver(post_delete, sender=Campaign, dispatch_uid='pages_campaign_deleted')
+@receiver(post_save, sender=Color, dispatch_uid='pages_color_saved')
+@receiver(post_delete, sender=Color, dispatch_uid='pages_color_deleted')
+@receiver(post_save, sender=Size, dispatch_uid='pages_size_saved')
+@receiver(post_delete, sender=Size, dispatch_uid='pages_size_deleted')
+@receiver(post_save, sender=SizeGroup, dispatch_uid='pages_size_group_saved')
+@receiver(post_delete, sender=SizeGroup, dispatch_uid='pages_size_group_deleted')
+def invalidate_pages(sender, **kwargs):
+    """ Cached pages of product lists show Products, their cards and the filters. """
+    page_cache.invalidate()
 
 
 def increment_product_views(product):
     """
     Increments Product.views.
-    The counter is primarily saved in cache.
-    The db is updated once per hour.
+    The view is counted in cache and written to the db
+    with others in batches (see products/view_counter.py).
     """
-    cache_view_count_key = f"{product.pk}_view_count"
-    cache_last_saved_key = f"{product.pk}_view_count_last_saved"
-
-    current_time = timezone.now().strftime('%Y-%m-%d %H:%M:%S')
-    last_saved = cache.get(cache_last_saved_key) or '1900-01-01 00:00:00'
-    view_count = cache.get(cache_view_count_key) or product.views
-    view_count += 1
-    cache.set(cache_view_count_key, view_count, 60000)
-    if parse_datetime(current_time) - parse_datetime(last_saved) > timezone.timedelta(hours=1):
-        product.views = view_count
-        product.save()
-        cache.set(cache_last_saved_key, current_time, 60000)
+    view_counter.record(product.pk)
 
 
 def add_to_viewed(sender, session, product, **kwargs):
     """
     Under key VIEWED in django session instance we keep track of primary keys
-    of all ProductVariants viewed by a particular user within the last hour.
-    This function checks whether the key for 'product' already exists
-    in the VIEWED dict and if not, it appends it as a key with a value of
-    the current time stamp.
+    of all Products viewed by a particular user within the last hour
+    (see products/view_dedup.py for the format). If 'product' isn't there yet,
+    it's added and its views counter is incremented.
     """
-    if not session.get(VIEWED):
-        session[VIEWED] = {}
-
-    # Django serializes session data using JSON, so convert
-    # the pk to str (since it will be stored as key)
-    pk = str(product.pk)
-
-    if session[VIEWED].get(pk):
+    viewed = view_dedup.ViewedProducts.from_data(session.get(VIEWED))
+    if product.pk in viewed:
+        _save_viewed(session, viewed)
         return
 
-    session[VIEWED][pk] = timezone.now().strftime('%Y-%m-%d %H:%M:%S')
-    session.modified = True
+    viewed.add(product.pk, view_dedup.now_minutes())
+    _save_viewed(session, viewed)
 
     # since it was a 'valid' view, increment the counter for product
     increment_product_views(product=product)
@@ -86,12 +321,15 @@ def delete_redundant_data(sender, session, **kwargs):
     if not session.get(VIEWED):
         return
 
-    current_time = timezone.now().strftime('%Y-%m-%d %H:%M:%S')
-    session[VIEWED] = {
-        product_id: last_viewed for product_id, last_viewed in session[VIEWED].items()
-        if parse_datetime(current_time) - parse_datetime(last_viewed) < timezone.timedelta(hours=1)
-    }
-    session.modified = True
+    viewed = view_dedup.ViewedProducts.from_data(session[VIEWED])
+    viewed.prune(view_dedup.now_minutes())
+    _save_viewed(session, viewed)
+
+
+def _save_viewed(session, viewed):
+    # the session is only written when it has changed
+    if viewed.changed:
+        session[VIEWED] = viewed.to_data()
 
 
 product_viewed.connect(delete_redundant_data)
@@ -0,0 +1,162 @@
+"""
+Correction of misspelled words of search queries, f.e. 'sweter' -> 'sweater'.
+
+The vocabulary consists of words of names and search keywords
+of ParentProducts and names of Categories. Candidates for an unknown word
+are the words sharing the most trigrams with it (like pg_trgm, a word
+is padded with two spaces in front and one at the end), they are then
+checked with the edit distance. The work per word is bounded:
+very common trigrams are skipped and only the best candidates
+by shared trigrams are compared by edit distance.
+
+The vocabulary is built in every process on the first use and rebuilt
+on the next use after the "spelling" version (see products.cache_versions)
+is bumped by the signals in products.signals.
+"""
+from __future__ import annotations
+
+import bisect
+import threading
+from collections import Counter, defaultdict
+from typing import Iterable
+
+from products import cache_versions, search
+from products.models import Category, ParentProduct
+
+VERSION = "spelling"
+
+# trigrams present in more words than that don't narrow down the candidates
+MAX_TRIGRAM_WORDS = 2000
+# candidates (with the most shared trigrams) checked by edit distance
+MAX_CANDIDATES = 50
+MIN_SIMILARITY = 0.3
+
+
+def trigrams(word: str) -> set[str]:
+    """ f.e. 'dress' -> {'  d', ' dr', 'dre', 'res', 'ess', 'ss '} """
+    padded = "  %s " % word
+    return {padded[position:position + 3] for position in range(len(padded) - 2)}
+
+
+def max_edits(word: str) -> int:
+    return 1 if len(word) <= 4 else 2
+
+
+def edit_distance(first: str, second: str, limit: int) -> int:
+    """
+    Damerau-Levenshtein distance (optimal string alignment),
+    'limit' + 1 as soon as it's known to be greater than 'limit'.
+    """
+    if abs(len(first) - len(second)) > limit:
+        return limit + 1
+
+    previous_previous, previous = None, list(range(len(second) + 1))
+    for i, first_char in enumerate(first, 1):
+        current = [i] + [0] * len(second)
+        for j, second_char in enumerate(second, 1):
+            cost = first_char != second_char
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if (
+                previous_previous is not None and i > 1 and j > 1
+                and first_char == second[j - 2] and first[i - 2] == second_char
+            ):
+                current[j] = min(current[j], previous_previous[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        previous_previous, previous = previous, current
+
+    return previous[-1] if previous[-1] <= limit else limit + 1
+
+
+class Vocabulary:
+    def __init__(self, frequencies: dict[str, int]):
+        """ 'frequencies' - {word: number of ParentProducts and Categories using it} """
+        self.frequencies = dict(frequencies)
+        self.words = sorted(self.frequencies)
+        self.stems = {search.stem(word) for word in self.words}
+        # trigram -> indexes of words in self.words
+        self.trigram_words: dict[str, list[int]] = defaultdict(list)
+        for position, word in enumerate(self.words):
+            for trigram in trigrams(word):
+                self.trigram_words[trigram].append(position)
+
+    def is_known(self, word: str) -> bool:
+        """ The word, its stem or a longer word starting with it is in the vocabulary. """
+        if word in self.frequencies or search.stem(word) in self.stems:
+            return True
+        position = bisect.bisect_left(self.words, word)
+        return position < len(self.words) and self.words[position].startswith(word)
+
+    def suggest(self, word: str, limit: int = 1) -> list[str]:
+        """ The closest words of the vocabulary, the most frequent ones first among equally close. """
+        word_trigrams = trigrams(word)
+        shared = Counter()
+        for trigram in word_trigrams:
+            positions = self.trigram_words.get(trigram, ())
+            if len(positions) <= MAX_TRIGRAM_WORDS:
+                shared.update(positions)
+
+        edits = max_edits(word)
+        scored = []
+        for position, count in shared.most_common(MAX_CANDIDATES):
+            candidate = self.words[position]
+            # Jaccard similarity of the sets of trigrams, same as pg_trgm similarity()
+            similarity = count / (len(word_trigrams) + len(trigrams(candidate)) - count)
+            if similarity < MIN_SIMILARITY:
+                continue
+            distance = edit_distance(word, candidate, edits)
+            if distance <= edits:
+                scored.append((distance, -self.frequencies[candidate], candidate))
+
+        return [candidate for _, _, candidate in sorted(scored)[:limit]]
+
+    def correct(self, words: Iterable[str]) -> list[str]:
+        """ Unknown words replaced with the closest known ones (kept if there are none). """
+        corrected = []
+        for word in words:
+            if len(word) > 2 and not word.isdigit() and word not in search.STOP_WORDS and not self.is_known(word):
+                word = next(iter(self.suggest(word)), word)
+            corrected.append(word)
+
+        return corrected
+
+
+def load_frequencies() -> Counter:
+    frequencies = Counter()
+    texts = [
+        *ParentProduct.objects.values_list("name", "search_keywords"),
+        *Category.objects.order_by().values_list("name"),
+    ]
+    for fields in texts:
+        frequencies.update({word for text in fields for word in search.tokenize(text) if len(word) > 1})
+
+    return frequencies
+
+
+_local = (None, None)
+_lock = threading.Lock()
+
+
+def get_vocabulary() -> Vocabulary:
+    global _local
+
+    version = cache_versions.get_version(VERSION)
+    local_version, vocabulary = _local
+    if local_version != version:
+        with _lock:
+            # built by another thread meanwhile
+            local_version, vocabulary = _local
+            if local_version != version:
+                vocabulary = Vocabulary(load_frequencies())
+                _local = (version, vocabulary)
+
+    return vocabulary
+
+
+def correct(query: str) -> str:
+    """ f.e. 'Sweter dres' -> 'sweater dres' ('dres' is the beginning of 'dress'). """
+    return " ".join(get_vocabulary().correct(search.tokenize(query)))
+
+
+def invalidate():
+    cache_versions.bump_on_commit(VERSION)
@@ -0,0 +1,126 @@
+"""
+A cache of reference data shown around product listings:
+categories, colors, size groups with their sizes and active campaigns.
+
+The rows are kept in two layers:
+- the shared django cache, under the "taxonomy" version
+  (see products.cache_versions), bumped by signals in products.signals
+  whenever any of these models is saved, deleted or moved in the tree,
+- a copy in this process, used as long as the version is unchanged,
+  so a cache hit costs a single lookup of the version and no db queries.
+
+Every call of get_taxonomy() creates new model instances from the rows,
+so that templates (f.e. 'recursetree' caching children on the nodes)
+never share instances between requests.
+"""
+from __future__ import annotations
+
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+from products import cache_versions
+from products.models import Campaign, Category, Color, Size, SizeGroup
+
+VERSION = "taxonomy"
+# rows of old versions are left to expire
+TIMEOUT = 60 * 60 * 24
+
+# (version, rows) loaded by this process
+_local = (None, None)
+
+
+def _rows(queryset) -> tuple[list[str], list[tuple]]:
+    field_names = [field.attname for field in queryset.model._meta.concrete_fields]
+    return field_names, list(queryset.values_list(*field_names))
+
+
+def load_rows() -> dict:
+    return {
+        "categories": _rows(Category.objects.order_by("tree_id", "lft")),
+        "colors": _rows(Color.objects.order_by("pk")),
+        "size_groups": _rows(SizeGroup.objects.all()),
+        "sizes": _rows(Size.objects.all()),
+        "campaigns": _rows(Campaign.objects.filter(is_active=True).order_by("pk")),
+    }
+
+
+def get_rows() -> dict:
+    global _local
+
+    version = cache_versions.get_version(VERSION)
+    local_version, rows = _local
+    if local_version == version:
+        return rows
+
+    key = cache_versions.make_key(VERSION, "rows")
+    rows = cache.get(key)
+    if rows is None:
+        rows = load_rows()
+        cache.set(key, rows, TIMEOUT)
+    _local = (version, rows)
+
+    return rows
+
+
+def get_taxonomy() -> Taxonomy:
+    return Taxonomy(get_rows())
+
+
+def invalidate():
+    cache_versions.bump_on_commit(VERSION)
+
+
+def _instances(model, rows):
+    field_names, values = rows
+    return [model.from_db(DEFAULT_DB_ALIAS, field_names, row) for row in values]
+
+
+class Taxonomy:
+    """
+    Model instances built from the cached rows, with lookups used by the views.
+    Categories are in tree order, same as from the default Category manager.
+    """
+    def __init__(self, rows: dict):
+        self.categories = _instances(Category, rows["categories"])
+        self.colors = _instances(Color, rows["colors"])
+        self.campaigns = _instances(Campaign, rows["campaigns"])
+
+        sizes = _instances(Size, rows["sizes"])
+        self.size_groups = _instances(SizeGroup, rows["size_groups"])
+        for group in self.size_groups:
+            # same as prefetch_related("sizes")
+            queryset = group.sizes.all()
+            queryset._result_cache = [size for size in sizes if size.group_id == group.pk]
+            queryset._prefetch_done = True
+            group._prefetched_objects_cache = {"sizes": queryset}
+
+    def root_categories(self) -> list[Category]:
+        return [category for category in self.categories if category.parent_id is None]
+
+    def get_category(self, path_crumb: str) -> Category | None:
+        return next((category for category in self.categories if category.path_crumb == path_crumb), None)
+
+    def root_and_path_categories(self, category: Category) -> list[Category]:
+        """ Same as Category.objects.root_and_path_categories(). """
+        return [
+            node for node in self.categories
+            if node.parent_id is None or node.tree_id == category.tree_id
+        ]
+
+    def get_descendants(self, category: Category, include_self: bool = False) -> list[Category]:
+        return [
+            node for node in self.categories
+            if node.tree_id == category.tree_id and category.lft <= node.lft and node.rght <= category.rght
+            and (include_self or node.pk != category.pk)
+        ]
+
+    def get_ancestors(self, category: Category, include_self: bool = False) -> list[Category]:
+        return [
+            node for node in self.categories
+            if node.tree_id == category.tree_id and node.lft <= category.lft and category.rght <= node.rght
+            and (include_self or node.pk != category.pk)
+        ]
+
+    def get_campaign(self, slug: str) -> Campaign | None:
+        """ An active campaign with the given slug. """
+        return next((campaign for campaign in self.campaigns if campaign.slug == slug), None)
@@ -1,18 +1,34 @@
-import re
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
 
 from django import template
 
+from products import cards, images
+
 register = template.Library()
 
+PAGINATION_PARAMS = ("page", "cursor")
+
 
 @register.filter
 def paginate(value, arg):
-    if re.search("(?<=page=)[\d]+", value):
-        return re.sub("(?<=page=)[\d]+", str(arg), value)
-    elif "?" not in value:
-        return f"{value}?page={arg}"
-    else:
-        return f"{value}&page={arg}"
+    """
+    Sets the pagination param of the url:
+    - an int is a page number (offset pagination),
+    - a str is a cursor token (cursor pagination),
+      an empty cursor points to the first page.
+    """
+    scheme, netloc, path, query, fragment = urlsplit(value)
+    params = [
+        (k, v) for k, v in parse_qsl(query, keep_blank_values=True)
+        if k not in PAGINATION_PARAMS
+    ]
+    if isinstance(arg, int):
+        params.append(("page", arg))
+    elif arg:
+        params.append(("cursor", arg))
+
+    # keep commas unescaped, f.e. ?color=3,5,7 (see static/js/filter.js)
+    return urlunsplit((scheme, netloc, path, urlencode(params, safe=","), fragment))
 
 
 @register.simple_tag
@@ -29,3 +45,25 @@ def multiply(value, arg):
 def to_list(*args):
     return args
 
+
+@register.simple_tag
+def product_cards(products, eager=cards.EAGER):
+    """
+    Cards of the Products (partials/product.html), served from cache, see products.cards.
+    Images of cards after the first 'eager' ones are loaded lazily.
+    """
+    return cards.render_cards(products, eager=eager)
+
+
+@register.filter
+def get_item(dictionary, key):
+    return dictionary.get(key)
+
+
+@register.simple_tag
+def image(public_id, variant, **attrs):
+    """
+    <img> of a variant of the Cloudinary image (see products.images),
+    f.e. {% image product.main_image.public_id "card" class="object-cover" loading="lazy" %}.
+    """
+    return images.img(public_id, variant, **attrs)
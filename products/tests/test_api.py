@@ -0,0 +1,100 @@
+import json
+
+from django.core.cache import cache
+from django.test import TransactionTestCase
+from django.urls import reverse
+
+from products import api, taxonomy
+from products.models import Product
+
+
+class ApiTestCase(TransactionTestCase):
+    fixtures = ["campaign.json", "category.json", "parent_product.json", "product.json",
+                "color.json", "image.json", "size.json", "size_group.json", "stock.json"]
+
+    def setUp(self):
+        cache.clear()
+        taxonomy.get_rows()
+
+    def get(self, url, status=200, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, status)
+        content = b"".join(response.streaming_content) if response.streaming else response.content
+
+        return json.loads(content)
+
+    def test_product_list(self):
+        url = reverse("products:product_list_api")
+        with self.assertNumQueries(1):
+            results = self.get(url)["results"]
+        self.assertEqual(
+            [product["id"] for product in results],
+            list(Product.objects.filter(is_available=True).order_by("-trending", "-pk").values_list("pk", flat=True)),
+        )
+        self.assertEqual(set(results[0]), set(api.FIELDS))
+
+        # filters and ordering of ProductList
+        results = self.get(url, color="2,1", sorting="price_ascending", fields="id,effective_price")["results"]
+        expected = Product.objects.filter(is_available=True, color__in=[1, 2]).order_by("effective_price", "-pk")
+        self.assertEqual(
+            results,
+            [{"id": pk, "effective_price": str(price)} for pk, price in expected.values_list("pk", "effective_price")],
+        )
+        # subcategories of dresses are 2 and 3
+        dresses = Product.objects.filter(is_available=True, parent__category__in=[1, 2, 3]).order_by(
+            "-trending", "-pk"
+        )
+        self.assertEqual(
+            self.get(url, category="dresses", fields="slug", limit=1, offset=1)["results"],
+            [{"slug": dresses[1].slug}],
+        )
+        self.assertEqual(
+            self.get(url, campaign="missing", status=404), {"error": "No Campaign matches the given query."}
+        )
+
+    def test_streamed_in_chunks(self):
+        api.CHUNK_SIZE, chunk_size = 4, api.CHUNK_SIZE
+        try:
+            response = self.client.get(reverse("products:product_list_api"), {"fields": "id"})
+            chunks = list(response.streaming_content)
+        finally:
+            api.CHUNK_SIZE = chunk_size
+        self.assertEqual(response["Content-Type"], "application/json")
+        available = Product.objects.filter(is_available=True).count()
+        # the opening, chunks of 4 Products and the closing
+        self.assertEqual(len(chunks), 2 + -(-available // 4))
+        self.assertEqual(len(json.loads(b"".join(chunks))["results"]), available)
+
+    def test_invalid_params(self):
+        url = reverse("products:product_list_api")
+        self.assertIn("Unknown fields: views", self.get(url, status=400, fields="id,views")["error"])
+        self.assertEqual(
+            self.get(url, status=400, limit="-1"), {"error": "'limit' has to be a non-negative integer."}
+        )
+
+    def test_product_detail(self):
+        url = reverse("products:product_detail_api", kwargs={"slug": "pencil-dress-bottle-green"})
+        with self.assertNumQueries(3):
+            product = self.get(url)
+        self.assertEqual(set(product), set(api.DETAIL_FIELDS))
+        self.assertEqual(product["id"], 9)
+        self.assertEqual(product["name"], "Pencil dress")
+        self.assertEqual({sibling["id"] for sibling in product["siblings"]}, {9, 10})
+        self.assertTrue(all(image.startswith("https://") for image in product["images"]))
+
+        with self.assertNumQueries(2):
+            product = self.get(url, fields="price,sizes")
+        self.assertEqual(set(product), {"price", "sizes"})
+        self.assertEqual(set(product["sizes"][0]), {"id", "name", "quantity"})
+
+        self.get(reverse("products:product_detail_api", kwargs={"slug": "missing"}), status=404)
+
+    def test_categories_and_campaigns(self):
+        with self.assertNumQueries(0):
+            categories = self.get(reverse("products:categories_api"), fields="path,url")["results"]
+            campaigns = self.get(reverse("products:campaigns_api"))["results"]
+        self.assertEqual(categories[1], {"path": "dresses/summer-dresses", "url": "/products/dresses/summer-dresses/"})
+        self.assertEqual(
+            [campaign["slug"] for campaign in campaigns],
+            [campaign.slug for campaign in taxonomy.get_taxonomy().campaigns],
+        )
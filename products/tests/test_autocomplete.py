@@ -0,0 +1,99 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TransactionTestCase
+from django.urls import reverse
+
+from products import autocomplete, cache_versions
+from products.models import Category, ParentProduct, Product
+
+
+class AutocompleteTestCase(TransactionTestCase):
+    fixtures = ["campaign.json", "category.json", "parent_product.json", "product.json",
+                "color.json", "image.json", "size.json", "size_group.json", "stock.json"]
+
+    def setUp(self):
+        cache.clear()
+        self.index = autocomplete.get_index()
+
+    def texts(self, query, limit=8, kind=None):
+        return [
+            suggestion.text for suggestion in autocomplete.suggest(query, limit)
+            if kind is None or suggestion.kind == kind
+        ]
+
+    def test_ranked_by_views(self):
+        # Products of 'Pencil dress' have 111 and 97 views
+        self.assertEqual(
+            self.texts("penc", kind="product"), ["Pencil dress - deep blue", "Pencil dress - bottle green"]
+        )
+        # Categories and keywords are ranked by views of their Products
+        self.assertEqual(self.texts("dresses")[0], "Dresses")
+        self.assertEqual(self.texts("woo", limit=2), ["wool", "woolen"])
+
+    def test_any_word_and_phrases(self):
+        self.assertIn("Strapless dress - sky blue", self.texts("sky"))
+        self.assertEqual(self.texts("dress sky"), ["Strapless dress - sky blue"])
+        self.assertEqual(self.texts("T-sh")[:2], ["T-Shirts", "Skin-tight T-shirt - deep red"])
+
+    def test_dense_prefixes_walk_ranked_suggestions(self):
+        expected = self.texts("dr"), self.texts("sk")
+        self.index.candidates.clear()
+        with mock.patch.object(autocomplete, "WALK_FACTOR", 0):
+            self.assertEqual((self.texts("dr"), self.texts("sk")), expected)
+
+    def test_short_query(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(self.texts("d"), [])
+
+    def test_no_queries_once_built(self):
+        self.texts("dr")
+        with self.assertNumQueries(0):
+            self.texts("sw")
+            self.texts("dr")
+
+    def test_updated_incrementally(self):
+        self.texts("dr")
+        parent = ParentProduct.objects.get(pk=2)
+        parent.name = "Midi dress"
+        parent.save()
+        self.assertTrue(self.index.built)
+        self.assertEqual(self.texts("penc", kind="product"), [])
+        self.assertEqual(self.texts("midi"), ["Midi dress - deep blue", "Midi dress - bottle green"])
+
+        Product.objects.get(slug="pencil-dress-deep-blue").delete()
+        self.assertEqual(self.texts("midi"), ["Midi dress - bottle green"])
+        self.assertEqual(self.index.phrases, sorted(self.index.phrases))
+
+    def test_views_update_only_scores(self):
+        self.texts("penc")
+        version = cache_versions.get_version(autocomplete.VERSION)
+        product = Product.objects.get(slug="pencil-dress-bottle-green")
+        product.views = 1000
+        product.save(update_fields=["views"])
+        self.assertEqual(cache_versions.get_version(autocomplete.VERSION), version)
+        self.assertEqual(
+            self.texts("penc", kind="product"), ["Pencil dress - bottle green", "Pencil dress - deep blue"]
+        )
+        self.assertEqual(self.texts("dr", kind="product")[0], "Pencil dress - bottle green")
+
+    def test_rebuilt_after_category_changes(self):
+        self.texts("dr")
+        category = Category.objects.get(path_crumb="shorts")
+        category.name = "Bermudas"
+        category.save()
+        self.assertEqual(self.texts("berm"), ["Bermudas"])
+
+    def test_endpoint(self):
+        self.texts("penc")
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse("products:autocomplete"), {"q": "pencil dr", "limit": 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"suggestions": [{
+            "text": "Pencil dress - deep blue",
+            "kind": "product",
+            "url": reverse("products:product_detail", args=["pencil-dress-deep-blue"]),
+        }]})
+
+        response = self.client.get(reverse("products:autocomplete"), {"q": "shor", "limit": "x"})
+        self.assertEqual(response.json()["suggestions"][0]["url"], "/products/trousers/shorts/")
@@ -0,0 +1,11 @@
+from django.test import SimpleTestCase, override_settings
+
+from products import checks
+
+
+class ChecksTestCase(SimpleTestCase):
+    def test_shared_cache(self):
+        with override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}):
+            self.assertEqual([warning.id for warning in checks.check_shared_cache(None)], ["products.W001"])
+        with override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.redis.RedisCache"}}):
+            self.assertEqual(checks.check_shared_cache(None), [])
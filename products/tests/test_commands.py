@@ -0,0 +1,233 @@
+import json
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+
+from django.contrib.sessions.backends.db import SessionStore
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import IntegrityError
+from django.test import TestCase
+from django.utils import timezone
+
+from products import search, view_counter
+from products.catalog_import import CatalogImporter
+from products.models import ParentProduct, Product, Stock
+
+
+class ReconcileStockTestCase(TestCase):
+    fixtures = ["campaign.json", "category.json", "parent_product.json", "product.json",
+                "color.json", "image.json", "size.json", "size_group.json", "stock.json"]
+
+    def call(self, *args):
+        out = StringIO()
+        call_command("reconcile_stock", *args, "--batch-size", "3", stdout=out)
+        return out.getvalue()
+
+    def test_no_drift(self):
+        self.assertIn("Checked 11 products, 0 repaired.", self.call())
+
+    def test_drift_repaired(self):
+        # bypass ProductQueryset.update_stock_totals / Stock.save
+        Product.objects.filter(pk=8).update(total_stock=100)
+        Product.objects.filter(pk=7).update(is_available=True)
+
+        output = self.call("--dry-run")
+        self.assertIn("2 drifted", output)
+        self.assertEqual(Product.objects.get(pk=8).total_stock, 100)
+
+        output = self.call()
+        self.assertIn("Checked 11 products, 2 repaired.", output)
+        self.assertEqual(Product.objects.get(pk=8).total_stock, 4)
+        self.assertFalse(Product.objects.get(pk=7).is_available)
+
+
+class RebuildSearchIndexTestCase(TestCase):
+    fixtures = ["campaign.json", "category.json", "parent_product.json", "product.json",
+                "color.json", "image.json", "size.json", "size_group.json", "stock.json"]
+
+    def test_rebuild(self):
+        backend = search.get_backend()
+        backend.search("dress")
+        ParentProduct.objects.filter(pk=4).update(search_keywords="basic tee")
+
+        out = StringIO()
+        call_command("rebuild_search_index", stdout=out)
+        self.assertIn("Rebuilt the index", out.getvalue())
+        self.assertEqual(set(backend.search("tee")), {4})
+
+
+class RebuildSiblingJsonTestCase(TestCase):
+    fixtures = ["campaign.json", "category.json", "parent_product.json", "product.json",
+                "color.json", "image.json", "size.json", "size_group.json", "stock.json"]
+
+    def call(self, *args):
+        out = StringIO()
+        call_command("rebuild_sibling_json", *args, "--batch-size", "4", stdout=out)
+        return out.getvalue()
+
+    def test_no_drift(self):
+        self.assertIn("Checked 6 parent products, 0 rebuilt.", self.call())
+
+    def test_drift_rebuilt(self):
+        expected = ParentProduct.objects.get(pk=2).all_products_json
+        # bypass the signals
+        ParentProduct.objects.filter(pk=2).update(all_products_json={})
+        Product.objects.filter(pk=16).update(slug="chic-trousers-renamed")
+
+        output = self.call("--check")
+        self.assertIn("Drift in parent products: 2", output)
+        self.assertIn("Drift in parent products: 5", output)
+        self.assertIn("2 drifted", output)
+        self.assertEqual(ParentProduct.objects.get(pk=2).all_products_json, {})
+
+        self.assertIn("Checked 6 parent products, 2 rebuilt.", self.call())
+        self.assertEqual(ParentProduct.objects.get(pk=2).all_products_json, expected)
+        self.assertEqual(ParentProduct.objects.get(pk=5).all_products_json["16"]["slug"], "chic-trousers-renamed")
+
+
+class FlushProductViewsTestCase(TestCase):
+    fixtures = ["campaign.json", "category.json", "parent_product.json", "product.json",
+                "color.json", "image.json", "size.json", "size_group.json", "stock.json"]
+
+    def test_flush(self):
+        cache.clear()
+        cache.add(view_counter.DUE, True)
+        view_counter.record(8)
+        out = StringIO()
+        call_command("flush_product_views", stdout=out)
+        self.assertIn("Flushed 1 views.", out.getvalue())
+        self.assertIn("recorded 1, flushed 1, dropped 0 views in 1 flushes", out.getvalue())
+        self.assertEqual(Product.objects.get(pk=8).views, 56)
+
+
+class PurgeSessionsTestCase(TestCase):
+    def create(self, data, expire_date):
+        store = SessionStore()
+        store.update(data)
+        store.set_expiry(expire_date)
+        store.save()
+        return store.session_key
+
+    def call(self, *args):
+        out = StringIO()
+        call_command("purge_sessions", *args, "--batch-size", "2", stdout=out)
+        return out.getvalue()
+
+    def test_purge(self):
+        now = timezone.now()
+        expired = [self.create({"cart": {}}, now - timedelta(days=1)) for _ in range(3)]
+        viewed = self.create({"viewed": [[1, 7]]}, now + timedelta(days=1))
+        kept = self.create({"cart": {}, "viewed": [[1, 7]]}, now + timedelta(days=1))
+
+        self.assertIn("Checked 3 sessions, 3 deleted.", self.call())
+        self.assertFalse(Session.objects.filter(session_key__in=expired).exists())
+
+        self.assertIn("Checked 2 sessions, 1 deleted.", self.call("--viewed-only"))
+        self.assertEqual(list(Session.objects.values_list("session_key", flat=True)), [kept])
+        self.assertNotEqual(viewed, kept)
+
+
+class ImportCatalogTestCase(TestCase):
+    fixtures = ["campaign.json", "category.json", "parent_product.json", "product.json",
+                "color.json", "image.json", "size.json", "size_group.json", "stock.json"]
+
+    def call(self, content, suffix):
+        with tempfile.NamedTemporaryFile("w", suffix=suffix) as file:
+            file.write(content)
+            file.flush()
+            out, err = StringIO(), StringIO()
+            call_command("import_catalog", file.name, "--batch-size", "2", stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_jsonl(self):
+        records = [
+            {"parent": "Linen shirt", "category": "T-Shirts", "search_keywords": "summer linen",
+             "style": "white", "color": "white", "price": "59", "main_image": "image/upload/v1/shirt-white.jpg",
+             "stock": {"S": 3, "M": 0}, "images": ["image/upload/v1/shirt-white-back.jpg"]},
+            {"parent": "Linen shirt", "style": "navy", "color": "navy blue", "price": "59",
+             "discounted_price": "49", "main_image": "image/upload/v1/shirt-navy.jpg"},
+            # an existing Product, the image is already there
+            {"parent": "Strapless dress", "style": "deep red", "color": "red", "price": "99", "discounted_price": "69",
+             "main_image": "image/upload/v1712864197/pdmtuoeapvsz0on1x8th.jpg", "stock": {"32": 5},
+             "images": ["image/upload/v1712864213/jl4lvbbmgfpzwrgcptod.jpg"]},
+            {"parent": "Linen shirt", "style": "red", "color": "crimson", "price": "59", "main_image": "x"},
+        ]
+        out, err = self.call("\n".join(map(json.dumps, records)) + "\nnot json\n", ".jsonl")
+
+        self.assertIn("Imported 5 records", out)
+        self.assertIn("1 parents created, 0 updated, 2 products created, 1 updated, 3 stock rows, 1 images, 2 errors.",
+                      out)
+        self.assertIn("Line 4: color: unknown 'crimson'", err)
+        self.assertIn("Line 5: invalid JSON", err)
+
+        parent = ParentProduct.objects.get(name="Linen shirt")
+        self.assertEqual((parent.category.name, parent.search_keywords), ("T-Shirts", "summer linen"))
+        white, navy = parent.product_set.order_by("style").reverse()
+        self.assertEqual(parent.all_products_json, {
+            str(white.pk): {"slug": "linen-shirt-white", "img_public_id": "shirt-white"},
+            str(navy.pk): {"slug": "linen-shirt-navy", "img_public_id": "shirt-navy"},
+        })
+        self.assertEqual((white.total_stock, white.is_available, white.images.count()), (3, True, 1))
+        self.assertEqual((navy.effective_price, navy.is_available), (Decimal("49"), False))
+
+        product = Product.objects.get(pk=8)
+        self.assertEqual((product.effective_price, product.total_stock), (Decimal("69"), 7))
+        self.assertEqual(product.images.count(), 1)
+        self.assertEqual(Stock.objects.filter(product=8).count(), 4)
+
+        # importing the same file again changes nothing
+        out, _ = self.call("\n".join(map(json.dumps, records)), ".jsonl")
+        self.assertIn("0 parents created, 0 updated, 0 products created, 0 updated, 0 stock rows, 0 images", out)
+
+    def test_csv(self):
+        content = (
+            "parent,category,search_keywords,style,color,price,discounted_price,main_image,stock,images\n"
+            "Pencil dress,,office,bottle green,green,119.00,,image/upload/v1/new-green.jpg,34=2;36=0,\n"
+        )
+        out, err = self.call(content, ".csv")
+
+        self.assertEqual(err, "")
+        self.assertIn("0 parents created, 1 updated, 0 products created, 1 updated, 2 stock rows", out)
+        parent = ParentProduct.objects.get(pk=2)
+        # not given fields are kept
+        self.assertEqual((parent.search_keywords, parent.category_id), ("office", 2))
+        self.assertEqual(parent.all_products_json["9"]["img_public_id"], "new-green")
+        self.assertEqual(Product.objects.get(pk=9).total_stock, 4)
+
+    def test_slug_collisions(self):
+        records = [
+            {"parent": "Dress A", "style": "b", "price": "59", "main_image": "x"},
+            {"parent": "Dress", "style": "a b", "price": "59", "main_image": "x"},
+            # "pencil-dress-bottle-green" exists
+            {"parent": "Pencil dress bottle", "style": "green", "price": "59", "main_image": "x"},
+        ]
+        out, err = self.call("\n".join(map(json.dumps, records)), ".jsonl")
+
+        self.assertIn("1 products created", out)
+        self.assertIn("Line 2: slug 'dress-a-b': already used by parent 'Dress A' with style 'b'", err)
+        self.assertIn("Line 3: slug 'pencil-dress-bottle-green': already used by parent 'Pencil dress'", err)
+
+    def test_failed_batch(self):
+        records = [
+            {"parent": "Linen shirt", "style": "white", "price": "59", "main_image": "x"},
+            {"parent": "Linen shirt", "style": "navy", "price": "59", "main_image": "x"},
+            {"parent": "Silk shirt", "style": "white", "price": "59", "main_image": "x"},
+        ]
+        write = CatalogImporter.write
+
+        def fail_second(importer, batch):
+            if batch[0]["parent"] == "Silk shirt":
+                raise IntegrityError("UNIQUE constraint failed")
+            write(importer, batch)
+
+        with mock.patch.object(CatalogImporter, "write", fail_second):
+            out, err = self.call("\n".join(map(json.dumps, records)), ".jsonl")
+
+        self.assertIn("1 parents created, 0 updated, 2 products created", out)
+        self.assertIn("Line 3: not written, the batch failed: UNIQUE constraint failed", err)
+        # the written batches are rebuilt
+        self.assertEqual(len(ParentProduct.objects.get(name="Linen shirt").all_products_json), 2)
@@ -0,0 +1,81 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TransactionTestCase
+from django.urls import reverse
+
+from products import conditional, taxonomy
+from products.models import Campaign, Image, Product, Stock
+
+
+class ConditionalTestCase(TransactionTestCase):
+    fixtures = ["campaign.json", "category.json", "parent_product.json", "product.json",
+                "color.json", "image.json", "size.json", "size_group.json", "stock.json"]
+
+    def setUp(self):
+        cache.clear()
+        taxonomy.get_rows()
+
+    def revalidate(self, url, etag):
+        return self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+    def test_product_detail(self):
+        url = reverse("products:product_detail", kwargs={"slug": "pencil-dress-bottle-green"})
+        etag = self.client.get(url)["ETag"]
+        self.assertTrue(etag.startswith('"9-'))
+
+        with mock.patch("products.signals.increment_product_views") as increment:
+            with self.assertNumQueries(0):
+                response = self.revalidate(url, etag)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response["ETag"], etag)
+            # counted once per visitor, like views of rendered pages
+            increment.assert_not_called()
+            self.client.cookies.clear()
+            self.revalidate(url, etag)
+            increment.assert_called_once()
+
+        # the pk in the ETag doesn't make another Product's page match
+        other = reverse("products:product_detail", kwargs={"slug": "x"})
+        self.assertEqual(self.revalidate(other, etag).status_code, 404)
+
+        # changes of stock, images and of the parent
+        for change in (
+            lambda: Stock.objects.filter(product=9).first().save(),
+            lambda: Image.objects.create(product_id=9, url="image/upload/v1/new.jpg"),
+            lambda: Product.objects.get(pk=9).parent.save(),
+        ):
+            change()
+            response = self.revalidate(url, etag)
+            self.assertEqual(response.status_code, 200)
+            etag = response["ETag"]
+
+        # other Products don't change it
+        Stock.objects.filter(product=12).first().save()
+        self.assertEqual(self.revalidate(url, etag).status_code, 304)
+
+    def test_product_list(self):
+        url = reverse("products:product_list")
+        etag = self.client.get(url + "?color=2,1")["ETag"]
+        with self.assertNumQueries(0):
+            self.assertEqual(self.revalidate(url + "?color=1,2&utm_source=x", etag).status_code, 304)
+        self.assertEqual(self.revalidate(url + "?color=1", etag).status_code, 200)
+        self.assertEqual(self.revalidate(url + "?color=1,2", '"%s"' % "x").status_code, 200)
+
+        Stock.objects.filter(product=12).first().save()
+        self.assertEqual(self.revalidate(url + "?color=1,2", etag).status_code, 200)
+
+    def test_main_page(self):
+        url = reverse("products:main_page")
+        etag = self.client.get(url)["ETag"]
+        with self.assertNumQueries(0):
+            self.assertEqual(self.revalidate(url, etag).status_code, 304)
+
+        Campaign.objects.first().save()
+        self.assertEqual(self.revalidate(url, etag).status_code, 200)
+
+    def test_requested_product(self):
+        request = mock.Mock(META={"HTTP_IF_NONE_MATCH": 'W/"12-abc", "13-def"'})
+        self.assertEqual(conditional.requested_product(request), 12)
+        request.META["HTTP_IF_NONE_MATCH"] = '"abc"'
+        self.assertIsNone(conditional.requested_product(request))
@@ -0,0 +1,56 @@
+from unittest import mock
+
+from cloudinary import CloudinaryResource
+from django.template import Context, Template
+from django.test import SimpleTestCase, override_settings
+
+from products import images
+
+
+class ImagesTestCase(SimpleTestCase):
+    def setUp(self):
+        images.clear()
+
+    def test_cloudinary_urls(self):
+        resource = CloudinaryResource("lmuckfapvaz80u2xhftn")
+        self.assertEqual(
+            images.url("lmuckfapvaz80u2xhftn", "card"),
+            resource.build_url(
+                crop="fill", gravity="auto", height=1000, width=615, fetch_format="auto", quality="auto", secure=True
+            ),
+        )
+        self.assertEqual(
+            images.srcset("lmuckfapvaz80u2xhftn", "thumbnail"),
+            "%s 60w, %s 120w" % (
+                resource.build_url(
+                    crop="fill", gravity="auto", height=80, width=60, fetch_format="auto", quality="auto", secure=True
+                ),
+                resource.build_url(
+                    crop="fill", gravity="auto", height=160, width=120, fetch_format="auto", quality="auto", secure=True
+                ),
+            ),
+        )
+        self.assertIn("/c_limit,f_auto,q_auto,w_640/", images.srcset("lmuckfapvaz80u2xhftn", "original"))
+        self.assertEqual(images.img(None, "thumbnail"), "")
+
+    @override_settings(PRODUCTS_IMAGE_URL_BUILDER="products.images.local_url")
+    def test_img(self):
+        self.assertHTMLEqual(
+            images.img("abc", "thumbnail", **{"class": "p-1", "loading": "lazy"}),
+            '<img class="p-1" height="80" loading="lazy" sizes="60px" width="60"'
+            ' src="/media/images/c_fill,f_auto,g_auto,h_80,q_auto,w_60/abc"'
+            ' srcset="/media/images/c_fill,f_auto,g_auto,h_80,q_auto,w_60/abc 60w,'
+            ' /media/images/c_fill,f_auto,g_auto,h_160,q_auto,w_120/abc 120w">',
+        )
+        # falsy attrs are dropped, f.e. loading of eager images
+        self.assertNotIn("loading", images.img("abc", "card", loading=None))
+        self.assertNotIn("height", images.img("abc", "campaign"))
+
+    def test_memoized(self):
+        template = Template('{% load product_tags %}{% image public_id "thumbnail" %}')
+        with mock.patch.object(CloudinaryResource, "build_url", autospec=True, return_value="url") as build_url:
+            for _ in range(3):
+                template.render(Context({"public_id": "lmuckfapvaz80u2xhftn"}))
+            template.render(Context({"public_id": "tho4pqom8nux9r6ycb93"}))
+        # 60w of srcset is the src
+        self.assertEqual(build_url.call_count, 2 * 2)
@@ -0,0 +1,109 @@
+from django.test import TransactionTestCase, override_settings
+from django.urls import reverse
+
+from products import inventory_index
+from products.filter import ProductFilter
+from products.models import Product, Stock, Category
+
+
+class InventoryIndexTestCase(TransactionTestCase):
+    fixtures = ["campaign.json", "category.json", "parent_product.json", "product.json",
+                "color.json", "image.json", "size.json", "size_group.json", "stock.json"]
+
+    def setUp(self):
+        self.index = inventory_index.InventoryIndex().build()
+
+    def resolve(self, query_string="", **scope):
+        params = dict(param.split("=") for param in query_string.split("&") if param)
+        product_filter = ProductFilter(**{k: [v] for k, v in params.items()})
+
+        return self.index.resolve(product_filter, **scope)
+
+    def expected(self, queryset):
+        return list(queryset.order_by("-trending", "-pk").values_list("pk", flat=True))
+
+    def test_available(self):
+        # products with pk=7 & 11 are unavailable
+        self.assertEqual(self.resolve(), self.expected(Product.objects.exclude(pk__in=[7, 11])))
+
+    def test_filters(self):
+        available = Product.custom_manager.available()
+        self.assertEqual(self.resolve("color=1,2"), self.expected(available.filter(color__in=[1, 2])))
+        self.assertEqual(
+            self.resolve("size=2&price_lte=100"),
+            self.expected(available.filter(stock__size=2, stock__quantity__gt=0, effective_price__lte=100))
+        )
+        self.assertEqual(self.resolve("color=4"), [])
+
+    def test_scopes(self):
+        # category 'dresses' with its subcategories
+        self.assertEqual(
+            self.resolve(category=1),
+            self.expected(Product.custom_manager.available().filter(parent__in=[1, 2, 6]))
+        )
+        self.assertEqual(
+            self.resolve("color=9", campaign=1),
+            self.expected(Product.custom_manager.available().filter(parent__campaign=1, color=9))
+        )
+
+    def test_ordering(self):
+        self.assertEqual(
+            self.index.resolve(ProductFilter(), ordering="effective_price"),
+            list(
+                Product.custom_manager.available().order_by(
+                    "effective_price", "pk"
+                ).values_list("pk", flat=True)
+            )
+        )
+
+    def test_incremental_update(self):
+        # make product with pk=7 available in size 1
+        stock = Stock.objects.get(product=7, size=1)
+        stock.quantity = 3
+        stock.save()
+        self.index.reindex([7])
+        self.assertIn(7, self.resolve("size=1"))
+
+        self.index.remove(7)
+        self.assertNotIn(7, self.resolve())
+
+    def test_memory_footprint(self):
+        footprint = self.index.memory_footprint()
+        self.assertEqual(footprint["products"], Product.objects.count())
+        self.assertEqual(
+            footprint["total_bytes"],
+            footprint["bitsets_bytes"] + footprint["entries_bytes"]
+        )
+
+
+@override_settings(PRODUCTS_INVENTORY_INDEX=True)
+class InventoryIndexViewTestCase(TransactionTestCase):
+    fixtures = ["campaign.json", "category.json", "parent_product.json", "product.json",
+                "color.json", "image.json", "size.json", "size_group.json", "stock.json"]
+
+    def setUp(self):
+        inventory_index.invalidate()
+
+    def tearDown(self):
+        inventory_index.invalidate()
+
+    def test_product_list(self):
+        response = self.client.get(reverse("products:product_by_category_list", kwargs={"path": "dresses"}))
+        self.assertEqual(
+            list(response.context.get('products')),
+            list(Product.objects.filter(pk__in=[8, 9, 10, 17]).order_by("-trending", "-pk"))
+        )
+
+    def test_index_updated_by_signals(self):
+        url = reverse("products:product_list") + "?color=2"
+        self.assertNotIn(Product.objects.get(pk=7), self.client.get(url).context.get('products'))
+
+        stock = Stock.objects.get(product=7, size=1)
+        stock.quantity = 1
+        stock.save()
+        self.assertIn(Product.objects.get(pk=7), self.client.get(url).context.get('products'))
+
+        # moving a category invalidates the index
+        Category.objects.get(pk=3).move_to(Category.objects.get(pk=4))
+        response = self.client.get(reverse("products:product_by_category_list", kwargs={"path": "trousers"}))
+        self.assertIn(Product.objects.get(pk=7), response.context.get('products'))
@@ -1,11 +1,12 @@
 from django.core.exceptions import ValidationError
 from django.db import IntegrityError
-from django.db.models import signals, Q
+from django.db.models import signals, Q, F
 from django.shortcuts import get_object_or_404
 from django.test import TestCase, TransactionTestCase
 
 from products import models
-from products.models import Product, Campaign, Category, Size, SizeGroup, ParentProduct
+from products.filter import ProductFilter
+from products.models import Product, Campaign, Category, Size, SizeGroup, ParentProduct, Stock
 
 
 class ProductQuerysetTestCase(TestCase):
@@ -21,6 +22,26 @@ class ProductQuerysetTestCase(TestCase):
         self.assertEqual(queryset.count(), Product.objects.count() - 2)
         self.assertEqual(list(queryset), list(Product.objects.exclude(pk__in=[7, 11])))
 
+    def test_available_without_join(self):
+        """
+        Availability is checked with the denormalized is_available column,
+        so neither a join with Stock nor DISTINCT is needed.
+        """
+        sql = str(Product.custom_manager.available().query)
+        self.assertIn("is_available", sql)
+        self.assertNotIn("DISTINCT", sql)
+        self.assertNotIn("JOIN", sql)
+
+    def test_size_filter_without_distinct(self):
+        q = ProductFilter(size=["1,2"]).get_Q()
+        queryset = Product.custom_manager.available().filter(q)
+        self.assertNotIn("DISTINCT", str(queryset.query))
+        # product with pk=7 is sold out
+        self.assertEqual(
+            list(queryset),
+            list(Product.objects.filter(pk__in=[8, 9, 10, 16]))
+        )
+
     def test_for_category(self):
         category = get_object_or_404(Category, path_crumb='summer-dresses')
         categories = category.get_descendants(include_self=True)
@@ -49,18 +70,127 @@ class ProductQuerysetTestCase(TestCase):
         self.assertEqual(list(Product.objects.all()), list(queryset))
 
     def test_effective_price(self):
-        queryset = Product.custom_manager.effective_price()
-
         # product with pk=12 has price=29.00 and discounted_price = 19.00
         # effective price should be 19.00
-        product = queryset.get(pk=12)
+        product = Product.objects.get(pk=12)
         self.assertEqual(product.effective_price, 19.00)
 
         # product with pk=7 has price=99.00 and discounted_price = None
         # effective price should be 99.00
-        product = queryset.get(pk=7)
+        product = Product.objects.get(pk=7)
         self.assertEqual(product.effective_price, 99.00)
 
+    def test_effective_price_after_save(self):
+        product = Product.objects.get(pk=7)
+        product.discounted_price = 59
+        product.save(update_fields=["discounted_price"])
+        product.refresh_from_db()
+        self.assertEqual(product.effective_price, 59)
+
+        product.discounted_price = None
+        product.save()
+        product.refresh_from_db()
+        self.assertEqual(product.effective_price, 99)
+
+    def test_effective_price_after_update(self):
+        Product.objects.filter(pk__in=[7, 12]).update(discounted_price=9)
+        self.assertEqual(
+            list(Product.objects.filter(pk__in=[7, 12]).values_list("effective_price", flat=True)),
+            [9, 9]
+        )
+
+        Product.objects.filter(pk__in=[7, 12]).update(discounted_price=None, price=F("price") + 1)
+        self.assertEqual(Product.objects.get(pk=7).effective_price, 100)
+        self.assertEqual(Product.objects.get(pk=12).effective_price, 30)
+
+    def test_effective_price_after_bulk_update(self):
+        products = list(Product.objects.filter(pk__in=[7, 12]))
+        for product in products:
+            product.price = 10
+            product.discounted_price = None
+        Product.objects.bulk_update(products, ["price", "discounted_price"])
+
+        self.assertEqual(
+            list(Product.objects.filter(pk__in=[7, 12]).values_list("effective_price", flat=True)),
+            [10, 10]
+        )
+
+
+class StockTotalsTestCase(TestCase):
+    fixtures = ["campaign.json", "category.json", "parent_product.json", "product.json",
+                "color.json", "image.json", "size.json", "size_group.json", "stock.json"]
+
+    def assertTotals(self, pk, total_stock, is_available):
+        product = Product.objects.get(pk=pk)
+        self.assertEqual((product.total_stock, product.is_available), (total_stock, is_available))
+
+    def test_stock_save(self):
+        # product with pk=7 is sold out
+        stock = Stock.objects.get(product=7, size=1)
+        stock.quantity = 3
+        stock.save()
+        self.assertTotals(7, 3, True)
+
+        stock.quantity = 1
+        stock.save()
+        self.assertTotals(7, 1, True)
+
+        Stock.objects.create(product_id=7, size_id=4, quantity=2)
+        self.assertTotals(7, 3, True)
+
+    def test_stock_moved_to_another_product(self):
+        stock = Stock.objects.filter(product=8, quantity__gt=0).first()
+        quantity = stock.quantity
+        stock.product_id = 7
+        stock.save()
+        self.assertTotals(7, quantity, True)
+        self.assertTotals(8, 4 - quantity, 4 - quantity > 0)
+
+    def test_stock_delete(self):
+        for stock in Stock.objects.filter(product=8):
+            stock.delete()
+        self.assertTotals(8, 0, False)
+
+    def test_bulk_operations(self):
+        Stock.objects.filter(product=8).update(quantity=0)
+        self.assertTotals(8, 0, False)
+
+        stock = list(Stock.objects.filter(product=8))
+        for obj in stock:
+            obj.quantity = 2
+        Stock.objects.bulk_update(stock, ["quantity"])
+        self.assertTotals(8, 2 * len(stock), True)
+
+        Stock.objects.filter(product=8).delete()
+        self.assertTotals(8, 0, False)
+
+        Stock.objects.bulk_create([Stock(product_id=8, size_id=1, quantity=5)])
+        self.assertTotals(8, 5, True)
+
+    def test_size_delete(self):
+        """ Stock deleted by the cascade of a Size is subtracted from the totals. """
+        affected = set(Stock.objects.filter(size=1).values_list("product_id", flat=True))
+        Size.objects.get(pk=1).delete()
+        for product in Product.objects.filter(pk__in=affected):
+            quantities = list(Stock.objects.filter(product=product).values_list("quantity", flat=True))
+            self.assertTotals(product.pk, sum(quantities), any(quantities))
+
+    def test_product_save_keeps_stock_totals(self):
+        """ A stale Product instance doesn't overwrite totals updated meanwhile. """
+        product = Product.objects.get(pk=7)
+        Stock.objects.filter(product=7, size=1).update(quantity=3)
+        product.views += 1
+        product.save()
+        self.assertTotals(7, 3, True)
+
+    def test_product_save_skips_deferred_fields(self):
+        product = Product.objects.only("pk", "style", "price", "discounted_price").get(pk=7)
+        product.style = "renamed"
+        # no query fetching the deferred fields
+        with self.assertNumQueries(1):
+            product.save()
+        self.assertEqual(Product.objects.get(pk=7).style, "renamed")
+
 
 class TransactionsTestCase(TransactionTestCase):
     fixtures = ["campaign.json", "category.json", "parent_product.json", "product.json",
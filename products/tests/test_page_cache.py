@@ -0,0 +1,132 @@
+import time
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.sessions.backends.cache import SessionStore
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.test import RequestFactory, TransactionTestCase, override_settings
+from django.urls import reverse
+
+from products import cache_versions, page_cache, taxonomy
+from products.models import Category, Product
+from products.views import ProductSearchList
+
+
+class PageCacheTestCase(TransactionTestCase):
+    fixtures = ["campaign.json", "category.json", "parent_product.json", "product.json",
+                "color.json", "image.json", "size.json", "size_group.json", "stock.json"]
+
+    def setUp(self):
+        cache.clear()
+        taxonomy.get_rows()
+
+    def page_key(self, url):
+        return page_cache.make_key(RequestFactory().get(url), "")
+
+    def test_cached(self):
+        url = reverse("products:product_list")
+        response = self.client.get(url + "?color=2,1&size=4&utm_source=newsletter")
+        self.assertContains(response, "Pencil dress")
+
+        # the same filters in another order, unknown params are left out
+        with self.assertNumQueries(0):
+            cached = self.client.get(url + "?size=4&color=1,2,1")
+        self.assertEqual(cached.content, response.content)
+        self.assertNotContains(cached, "utm_source")
+        self.assertEqual(cached["Content-Type"], response["Content-Type"])
+
+        self.client.get(reverse("products:search_list") + "?q=dress")
+        with self.assertNumQueries(0):
+            self.client.get(reverse("products:search_list") + "?q=dress+&sorting=unknown")
+
+    def test_canonical_params(self):
+        view = ProductSearchList()
+        view.setup(RequestFactory().get(
+            "/", {"q": " summer", "color": "3,1,x", "size": "5,4,4", "price_lte": "50,10", "sorting": "newest", "page": 2}
+        ))
+        self.assertEqual(
+            page_cache.canonical_query(view.get_page_params()),
+            "page=2&price_lte=50&q=summer&size=4,5&sorting=newest",
+        )
+
+    def test_not_cached_with_session(self):
+        url = reverse("products:product_by_category_list", kwargs={"path": "dresses"})
+        self.client.get(url)
+        self.client.cookies[settings.SESSION_COOKIE_NAME] = "abc"
+        with mock.patch("products.page_cache.serve") as serve:
+            response = self.client.get(url)
+        serve.assert_not_called()
+        self.assertContains(response, "Pencil dress")
+
+    def test_not_stored(self):
+        url = reverse("products:product_list_for_campaign", kwargs={"slug": "missing"})
+        self.assertEqual(self.client.get(url).status_code, 404)
+        key = self.page_key(url)
+        self.assertIsNone(cache.get(key))
+        self.assertIsNone(cache.get(page_cache.LOCK % key))
+
+        # pages for a single visitor
+        request = RequestFactory().get("/")
+        self.assertTrue(page_cache.is_storable(request, HttpResponse()))
+        self.assertFalse(page_cache.is_storable(request, HttpResponse(status=302)))
+        response = HttpResponse()
+        response.set_cookie("viewed", "1")
+        self.assertFalse(page_cache.is_storable(request, response))
+        request.session = SessionStore()
+        request.session.get("viewed")
+        self.assertFalse(page_cache.is_storable(request, HttpResponse()))
+        request = RequestFactory().get("/")
+        request.META["CSRF_COOKIE_NEEDS_UPDATE"] = True
+        self.assertFalse(page_cache.is_storable(request, HttpResponse()))
+
+    def test_invalidated(self):
+        url = reverse("products:product_list")
+        self.client.get(url)
+        product = Product.objects.get(pk=9)
+        product.views += 1
+        product.save(update_fields=["views"])
+        with self.assertNumQueries(0):
+            self.client.get(url)
+
+        Category.objects.filter(pk=1).first().save()
+        # rendered again
+        self.assertIsNotNone(self.client.get(url).context)
+        with self.assertNumQueries(0):
+            self.client.get(url)
+
+    def test_stale_while_rendered(self):
+        url = reverse("products:product_list")
+        fresh = self.client.get(url).content
+        key = self.page_key(url)
+        page = cache.get(key)
+        self.assertEqual(page[2], fresh)
+
+        cache_versions.bump(page_cache.VERSION)
+        cache.add(page_cache.LOCK % key, True)
+        with self.assertNumQueries(0):
+            # another request is rendering the new version
+            self.assertEqual(self.client.get(url).content, fresh)
+
+        cache.delete(page_cache.LOCK % key)
+        self.client.get(url)
+        self.assertEqual(cache.get(key)[0], cache_versions.get_version(page_cache.VERSION))
+
+    def test_waits_for_page(self):
+        url = reverse("products:product_list")
+        key = self.page_key(url)
+        cache.add(page_cache.LOCK % key, True)
+        page = (cache_versions.get_version(page_cache.VERSION), time.time(), b"rendered", "text/html")
+
+        def sleep(seconds):
+            # rendered by another request meanwhile
+            cache.set(key, page)
+
+        with mock.patch("products.page_cache.time.sleep", side_effect=sleep), self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url).content, b"rendered")
+
+    @override_settings(PRODUCTS_PAGE_CACHE_TIMEOUT=None)
+    def test_disabled(self):
+        url = reverse("products:product_list")
+        self.client.get(url)
+        self.assertIsNotNone(self.client.get(url).context)
@@ -0,0 +1,63 @@
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.test import TransactionTestCase
+from django.urls import reverse
+
+from products import cache_versions, price_bounds
+from products.models import Product, ParentProduct
+
+
+class PriceBoundsTestCase(TransactionTestCase):
+    fixtures = ["campaign.json", "category.json", "parent_product.json", "product.json",
+                "color.json", "image.json", "size.json", "size_group.json", "stock.json"]
+
+    def setUp(self):
+        cache.clear()
+
+    def bounds(self, scope="all"):
+        return price_bounds.get_price_bounds(scope, Product.custom_manager.available())
+
+    def test_bounds(self):
+        # effective prices of available products range from 19 to 149
+        self.assertEqual(self.bounds(), (Decimal("19"), Decimal("149")))
+
+        response = self.client.get(reverse("products:product_by_category_list", kwargs={"path": "dresses"}))
+        self.assertEqual((response.context["min_price"], response.context["max_price"]), (79, 119))
+
+    def test_price_filter_doesnt_change_bounds(self):
+        response = self.client.get(reverse("products:product_list") + "?price_lte=50")
+        self.assertEqual((response.context["min_price"], response.context["max_price"]), (19, 149))
+
+    def test_cached(self):
+        self.bounds()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.bounds(), (Decimal("19"), Decimal("149")))
+
+    def test_search_scope(self):
+        self.assertEqual(price_bounds.search_scope(["Summer", "dress"]), price_bounds.search_scope(["dress", "summer"]))
+        self.assertNotEqual(price_bounds.search_scope(["dress"]), price_bounds.search_scope(["skirt"]))
+
+    def test_invalidated_by_price_change(self):
+        self.bounds()
+        product = Product.objects.get(pk=16)
+        product.discounted_price = 139
+        product.save()
+        self.assertEqual(self.bounds(), (Decimal("19"), Decimal("139")))
+
+        Product.objects.filter(pk=12).update(discounted_price=None)
+        self.assertEqual(self.bounds(), (Decimal("29"), Decimal("139")))
+
+    def test_not_invalidated_without_price_change(self):
+        version = cache_versions.get_version(price_bounds.VERSION)
+        product = Product.objects.get(pk=16)
+        product.views += 1
+        product.save()
+        parent = ParentProduct.objects.get(pk=1)
+        parent.fabric_info = "new fabric info"
+        parent.save()
+        self.assertEqual(cache_versions.get_version(price_bounds.VERSION), version)
+
+        parent.campaign = None
+        parent.save()
+        self.assertNotEqual(cache_versions.get_version(price_bounds.VERSION), version)
@@ -0,0 +1,88 @@
+from unittest import skipUnless
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from products import benchmarks, search, spelling
+from products.models import Campaign, Category, Color, Product, Size
+
+
+@skipUnless(
+    connection.vendor == "sqlite",
+    "PostgreSQL plans depend on table statistics, use 'manage.py benchmark listing --explain' instead."
+)
+class QueryPlansTestCase(TestCase):
+    """
+    Every query executed by the views is checked with EXPLAIN:
+    none of them may scan a whole catalog table (Products, ParentProducts, Stock)
+    and queries for Products must read rows in the order of an index
+    instead of sorting them, so that a page costs the same
+    regardless of the size of the catalog.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        benchmarks.seed_catalog(products=200)
+        cls.root = Category.objects.filter(parent__isnull=True).order_by("pk").first()
+        cls.subcategory = cls.root.get_children().first()
+        cls.campaign = Campaign.objects.order_by("pk").first()
+        cls.color = Color.objects.order_by("pk").first()
+        cls.size = Size.objects.order_by("pk").first()
+
+    def assertPlans(self, url, allow_sort=False):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+        for query in context.captured_queries:
+            with self.subTest(url=url, sql=query["sql"]):
+                self.assertEqual(benchmarks.plan_problems(query["sql"], allow_sort=allow_sort), [])
+
+        return response
+
+    def test_main_page(self):
+        self.assertPlans(reverse("products:main_page"))
+
+    def test_product_list(self):
+        url = reverse("products:product_list")
+        for option in ("popularity", "price_ascending", "price_descending", "newest"):
+            response = self.assertPlans("%s?sorting=%s" % (url, option))
+            # next page with a cursor
+            page = response.context["page_obj"]
+            self.assertPlans("%s?sorting=%s&cursor=%s" % (url, option, page.next_cursor))
+
+        self.assertPlans("%s?page=2" % url)
+
+    def test_product_list_filters(self):
+        url = reverse("products:product_list")
+        self.assertPlans("%s?color=%s" % (url, self.color.pk))
+        self.assertPlans("%s?size=%s&price_lte=100" % (url, self.size.pk))
+        self.assertPlans("%s?price_gte=50&sorting=price_ascending" % url)
+
+    def test_product_list_scopes(self):
+        # a category or a campaign is a (much) smaller subset of the catalog
+        # found with indexes of ParentProduct, it's sorted after fetching
+        self.assertPlans(
+            reverse("products:product_by_category_list", kwargs={"path": self.root.path_crumb}),
+            allow_sort=True,
+        )
+        self.assertPlans(
+            reverse(
+                "products:product_by_category_list",
+                kwargs={"path": "%s/%s" % (self.root.path_crumb, self.subcategory.path_crumb)}
+            ) + "?sorting=price_ascending",
+            allow_sort=True,
+        )
+        self.assertPlans(
+            reverse("products:product_list_for_campaign", kwargs={"slug": self.campaign.slug}),
+            allow_sort=True,
+        )
+        # the search index and the vocabulary read all ParentProducts once, when they're built
+        search.get_backend().rebuild()
+        spelling.invalidate()
+        spelling.get_vocabulary()
+        self.assertPlans(reverse("products:search_list") + "?q=summer")
+
+    def test_product_detail(self):
+        self.assertPlans(Product.objects.order_by("pk").first().get_absolute_url())
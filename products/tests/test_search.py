@@ -0,0 +1,131 @@
+from unittest import skipUnless
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+
+from products import search
+from products.models import Category, ParentProduct
+
+
+class AnalyzeTestCase(SimpleTestCase):
+    def test_tokenize(self):
+        self.assertEqual(search.tokenize("Café T-Shirt, 2 pcs"), ["cafe", "t", "shirt", "2", "pcs"])
+
+    def test_stem(self):
+        for word, stem in [
+            ("dresses", "dress"), ("dress", "dress"), ("accessories", "accessory"),
+            ("sweaters", "sweater"), ("knitted", "knit"), ("knitting", "knit"), ("red", "red"),
+        ]:
+            with self.subTest(word=word):
+                self.assertEqual(search.stem(word), stem)
+
+    def test_analyze(self):
+        self.assertEqual(search.analyze("The summer dresses for you"), ["summer", "dress"])
+
+
+class LocalIndexTestCase(TransactionTestCase):
+    fixtures = ["campaign.json", "category.json", "parent_product.json", "product.json",
+                "color.json", "image.json", "size.json", "size_group.json", "stock.json"]
+
+    def setUp(self):
+        cache.clear()
+        self.backend = search.get_backend()
+
+    def test_fields(self):
+        # name, keywords, description and names of categories with ancestors
+        self.assertEqual(set(self.backend.search("merino")), {3})
+        self.assertEqual(set(self.backend.search("comfy")), {4})
+        self.assertEqual(set(self.backend.search("nautical")), {6})
+        self.assertEqual(set(self.backend.search("knitwear")), {3})
+
+    def test_stemming_and_prefixes(self):
+        self.assertEqual(set(self.backend.search("Trousers")), set(self.backend.search("trouser")))
+        self.assertEqual(set(self.backend.search("swea")), {3})
+
+    def test_any_word_and_more_words_first(self):
+        results = self.backend.search("sleeveless dress")
+        self.assertEqual(list(results)[0], 1)
+        self.assertEqual(set(results), {1, 2, 6})
+
+    def test_empty_query(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(self.backend.search(" the "), {})
+
+    def test_no_queries_once_built(self):
+        self.backend.search("dress")
+        with self.assertNumQueries(0):
+            self.backend.search("wool")
+
+    def test_updated_incrementally(self):
+        self.backend.search("dress")
+        parent = ParentProduct.objects.get(pk=4)
+        parent.search_keywords = "basic tee"
+        parent.save()
+        self.assertTrue(self.backend.built)
+        self.assertEqual(set(self.backend.search("tee")), {4})
+        self.assertEqual(set(self.backend.search("homewear")), set())
+
+        category = Category.objects.get(path_crumb="t-shirts")
+        category.name = "Tops"
+        category.save()
+        self.assertEqual(set(self.backend.search("tops")), {4})
+
+        parent.delete()
+        self.assertEqual(set(self.backend.search("tee")), set())
+        self.assertEqual(self.backend.terms, sorted(self.backend.postings))
+
+    def test_not_updated_without_changes_of_searched_fields(self):
+        self.backend.search("dress")
+        version = self.backend.version
+        parent = ParentProduct.objects.get(pk=4)
+        parent.all_products_json = {}
+        parent.save()
+        self.assertEqual(self.backend.version, version)
+
+    def test_rebuilt_after_changes_by_other_processes(self):
+        self.backend.search("dress")
+        # as if another process updated the index
+        search.cache_versions.bump(search.VERSION)
+        ParentProduct.objects.filter(pk=4).update(search_keywords="basic tee")
+        self.assertEqual(set(self.backend.search("tee")), {4})
+
+
+@skipUnless(connection.vendor == "sqlite", "Requires SQLite.")
+@override_settings(PRODUCTS_SEARCH_BACKEND="products.search.SQLiteFTS5Backend")
+class SQLiteFTS5TestCase(TransactionTestCase):
+    fixtures = ["campaign.json", "category.json", "parent_product.json", "product.json",
+                "color.json", "image.json", "size.json", "size_group.json", "stock.json"]
+
+    def setUp(self):
+        self.backend = search.get_backend()
+        # the table isn't flushed between tests, it's created by rebuild()
+        self.backend.rebuild()
+
+    def test_table_created_by_rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute("DROP TABLE %s" % self.backend.table)
+        self.backend._table_exists = False
+        with self.assertLogs("products.search", "WARNING"):
+            self.assertEqual(self.backend.search("merino"), {})
+        # not indexed until rebuilt
+        ParentProduct.objects.get(pk=3).save()
+
+        self.backend.rebuild()
+        self.assertEqual(set(self.backend.search("merino")), {3})
+
+    def test_search(self):
+        self.assertEqual(set(self.backend.search("merino")), {3})
+        self.assertEqual(set(self.backend.search("swea")), {3})
+        self.assertEqual(set(self.backend.search("Trousers")), set(self.backend.search("trouser")))
+        self.assertEqual(list(self.backend.search("sleeveless dress"))[0], 1)
+        self.assertEqual(self.backend.search(""), {})
+
+    def test_updated_in_transaction(self):
+        parent = ParentProduct.objects.get(pk=4)
+        parent.search_keywords = "basic tee"
+        parent.save()
+        self.assertEqual(set(self.backend.search("tee")), {4})
+
+        parent.delete()
+        self.assertEqual(set(self.backend.search("tee")), set())
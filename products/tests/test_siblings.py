@@ -0,0 +1,83 @@
+from django.db import connection
+from django.db.models.signals import post_save
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from products import signals, siblings
+from products.models import ParentProduct, Product
+
+
+class SiblingsTestCase(TestCase):
+    fixtures = ["campaign.json", "category.json", "parent_product.json", "product.json",
+                "color.json", "image.json", "size.json", "size_group.json", "stock.json"]
+
+    def setUp(self):
+        # disconnected by other test cases
+        post_save.connect(signals.add_product_to_json_field, sender=Product, dispatch_uid='add_to_json')
+
+    def json(self, pk):
+        return ParentProduct.objects.get(pk=pk).all_products_json
+
+    def parent_writes(self, fn):
+        with CaptureQueriesContext(connection) as context:
+            fn()
+        return [query["sql"] for query in context.captured_queries if query["sql"].startswith(
+            'UPDATE "products_parentproduct"'
+        )]
+
+    def test_unchanged_entries_skipped(self):
+        product = Product.objects.select_related("parent").get(pk=8)
+        product.price = 90
+        with self.assertNumQueries(1):
+            product.save()
+        with self.assertNumQueries(1):
+            product.save(update_fields=["views"])
+
+    def test_changed_entry(self):
+        product = Product.objects.select_related("parent").get(pk=8)
+        # a sibling changed meanwhile, the stale parent instance doesn't overwrite it
+        ParentProduct.objects.filter(pk=1).update(all_products_json={"7": {"slug": "new"}})
+        product.main_image = "image/upload/v1/new-image.jpg"
+        writes = self.parent_writes(product.save)
+
+        self.assertEqual(len(writes), 1)
+        self.assertIn('SET "all_products_json"', writes[0])
+        self.assertNotIn('"name"', writes[0])
+        self.assertEqual(self.json(1), {
+            "7": {"slug": "new"},
+            "8": {"slug": "strapless-dress-deep-red", "img_public_id": "new-image"},
+        })
+        self.assertEqual(product.parent.all_products_json["8"]["img_public_id"], "new-image")
+
+    def test_moved_and_deleted(self):
+        product = Product.objects.get(pk=8)
+        product.parent_id = 2
+        product.save()
+        self.assertEqual(set(self.json(1)), {"7"})
+        self.assertEqual(set(self.json(2)), {"8", "9", "10"})
+
+        product.delete()
+        self.assertEqual(set(self.json(2)), {"9", "10"})
+
+    def test_batch(self):
+        products = list(Product.objects.filter(parent=4))
+        for product in products:
+            product.main_image = "image/upload/v1/batch-%s.jpg" % product.pk
+
+        def save():
+            with siblings.batch():
+                for product in products:
+                    product.save()
+
+        self.assertEqual(len(self.parent_writes(save)), 1)
+        self.assertEqual(
+            {entry["img_public_id"] for entry in self.json(4).values()},
+            {"batch-%s" % product.pk for product in products},
+        )
+
+    def test_suspend(self):
+        product = Product.objects.get(pk=8)
+        product.main_image = "image/upload/v1/new-image.jpg"
+        with siblings.suspend():
+            self.assertEqual(self.parent_writes(product.save), [])
+        self.assertEqual(self.json(1)["8"]["img_public_id"], "pdmtuoeapvsz0on1x8th")
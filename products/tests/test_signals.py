@@ -1,18 +1,20 @@
-import datetime
+from unittest import mock
 
+from django.contrib.sessions.backends.db import SessionStore
 from django.core.cache import cache
 from django.db.models import signals
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.urls import reverse
-from django.utils import timezone
-from django.utils.dateparse import parse_datetime
 from freezegun import freeze_time
 
+from products import view_counter, view_dedup
 from products.models import Product, ParentProduct, Color, Category
+from products.view_dedup import ViewedProducts
 
 VIEWED = "viewed"
 
 
+@override_settings(PRODUCTS_VIEWED_COOKIE=False)
 class SignalTestCase(TestCase):
     def setUp(self):
         signals.post_save.disconnect(sender=Product, dispatch_uid='add_to_json')
@@ -41,72 +43,54 @@ class SignalTestCase(TestCase):
 
         cache.clear()
 
+    def viewed(self):
+        return ViewedProducts.from_data(self.client.session.get(VIEWED))
+
     def test_add_to_viewed_VIEWED_is_empty(self):
         """
         Test that when the user views a Product for the first time,
-         the timestamp is saved in session.
+        it's saved in session in the bucket of the current time.
         """
-        key = str(self.product_1.pk)
-
         self.assertEqual(self.client.session.get(VIEWED), None)
-        self.client.get(self.product_1_url)
-        self.assertIn(key, self.client.session.get(VIEWED))
-
-        current_time = parse_datetime(
-            timezone.now().strftime('%Y-%m-%d %H:%M:%S')
-        )
-        viewed_at = parse_datetime(
-            self.client.session.get(VIEWED).get(key)
-        )
-        self.assertLess(current_time - viewed_at, timezone.timedelta(minutes=1))
+        with freeze_time("2023-12-31 12:03:00"):
+            self.client.get(self.product_1_url)
+            self.assertIn(self.product_1.pk, self.viewed())
+            self.assertEqual(self.client.session.get(VIEWED), [[view_dedup.now_minutes() - 3, self.product_1.pk]])
 
     @freeze_time("2023-12-31 12:00:00")
     def test_add_to_viewed_product_revisited_shortly(self):
         """
-        Test that when the user views the same Product again  in less than
-        an hour, the timestamp in session does not change.
+        Test that when the user views the same Product again in less than
+        an hour, it's not counted and the session is not saved again.
         """
-        key = str(self.product_1.pk)
-
-        # visit the url
         self.client.get(self.product_1_url)
-        viewed_at = self.client.session.get(VIEWED).get(key)
+        viewed = self.client.session.get(VIEWED)
 
         # revisit in 5 minutes
-        with freeze_time("2023-12-31 12:05:00"):
+        with freeze_time("2023-12-31 12:05:00"), \
+                mock.patch.object(SessionStore, "save") as save:
             self.client.get(self.product_1_url)
-
-        # timestamp should stay the same
-        self.assertEqual(
-            self.client.session.get(VIEWED).get(key),
-            viewed_at
-        )
+        save.assert_not_called()
+        self.assertEqual(self.client.session.get(VIEWED), viewed)
+        self.assertEqual(view_counter.get_pending(self.product_1.pk), 0)
 
     @freeze_time("2023-12-31 12:00:00")
     def test_add_to_viewed_product_revisited_in_more_than_1_hr(self):
         """
         Test that when the user views the same Product again
-        in more than an hour, the timestamp in session will change
+        in more than an hour, it's saved in the new bucket
         """
-        key = str(self.product_1.pk)
-
-        # visit the url
         self.client.get(self.product_1_url)
-        viewed_at = self.client.session.get(VIEWED).get(key)
 
         # revisit in 1 hour 1 minute
         with freeze_time("2023-12-31 13:01:00"):
             self.client.get(self.product_1_url)
+            minutes = view_dedup.now_minutes()
 
-        # timestamp should be updated
-        self.assertNotEqual(
-            viewed_at,
-            self.client.session.get(VIEWED).get(key)
-        )
-        self.assertAlmostEqual(
-            self.client.session.get(VIEWED).get(key),
-            datetime.datetime(2023, 12, 31, 13, 1).strftime('%Y-%m-%d %H:%M:%S')
-        )
+        self.assertEqual(self.client.session.get(VIEWED), [[minutes - 1, self.product_1.pk]])
+        # counted twice
+        self.product_1.refresh_from_db()
+        self.assertEqual(self.product_1.views + view_counter.get_pending(self.product_1.pk), 2)
 
     @freeze_time("2023-12-31 12:00:00")
     def test_delete_redundant_data(self):
@@ -114,56 +98,62 @@ class SignalTestCase(TestCase):
         Make sure that data for Product viewed more than 1 hour ago
         is no longer available in session.
         """
-        key = str(self.product_1.pk)
-
-        # visit the url
         self.client.get(self.product_1_url)
 
-        viewed_at = self.client.session.get(VIEWED).get(key)
-
         # check in 59 minutes - record should still be in session
         with freeze_time("2023-12-31 12:59:00"):
             self.client.get(self.product_2_url)
-        self.assertEqual(
-            self.client.session.get(VIEWED).get(key),
-            viewed_at
-        )
+        self.assertIn(self.product_1.pk, self.viewed())
 
         # check in 1h 5 s - record should be gone
         with freeze_time("2023-12-31 13:00:05"):
             self.client.get(self.product_2_url)
-        self.assertEqual(
-            self.client.session.get(VIEWED).get(key),
-            None
-        )
+        self.assertNotIn(self.product_1.pk, self.viewed())
+        self.assertIn(self.product_2.pk, self.viewed())
+
+    @freeze_time("2023-12-31 12:30:00")
+    def test_old_session_format_migrated(self):
+        session = self.client.session
+        session[VIEWED] = {
+            str(self.product_1.pk): "2023-12-31 12:10:00",
+            str(self.product_2.pk): "2023-12-31 11:10:00",
+        }
+        session.save()
+
+        self.client.get(self.product_1_url)
+        self.assertEqual(self.client.session.get(VIEWED), [[view_dedup.now_minutes() - 20, self.product_1.pk]])
+        self.assertEqual(view_counter.get_pending(self.product_1.pk), 0)
 
     def test_increment_product_views_cache(self):
         """
         Test that visiting the url updates its counter in cache
         """
-        self.cache_key = f"{self.product_1.pk}_view_count"
-        # visit the url
+        # the first view also flushes, as no flush has been done yet
+        self.client.get(self.product_1_url)
+        # a new session
+        self.client.cookies.clear()
         self.client.get(self.product_1_url)
-        self.assertEqual(cache.get(self.cache_key), 1)
+        # counted twice
+        self.product_1.refresh_from_db()
+        self.assertEqual(self.product_1.views + view_counter.get_pending(self.product_1.pk), 2)
 
     @freeze_time("2023-12-31 12:00:00")
     def test_increment_product_views_db(self):
         """
         Test that the counter number in db gets updated
-        every one hour
+        once per flush interval
         """
-
         self.product_1.refresh_from_db()
         self.assertEqual(self.product_1.views, 0)
 
-        self.cache_key = f"{self.product_1.pk}_view_count"
-        self.cache_last_saved_key = f"{self.product_1.pk}_view_count_last_saved"
-
-        # set the counter in cache manually to 299 views
-        cache.set(self.cache_key, 299, 6000)
-        cache.set(self.cache_last_saved_key, "2023-12-31 12:00:00", 6000)
+        self.client.get(self.product_1_url)
+        self.client.cookies.clear()
+        self.client.get(self.product_1_url)
+        self.product_1.refresh_from_db()
+        self.assertEqual(self.product_1.views, 1)
 
-        with freeze_time("2023-12-31 13:00:05"):
+        with freeze_time("2023-12-31 12:01:05"):
+            self.client.cookies.clear()
             self.client.get(self.product_1_url)
         self.product_1.refresh_from_db()
-        self.assertEqual(self.product_1.views, 300)
+        self.assertEqual(self.product_1.views, 3)
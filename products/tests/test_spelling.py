@@ -0,0 +1,83 @@
+import threading
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import SimpleTestCase, TransactionTestCase
+from django.urls import reverse
+
+from products import cache_versions, spelling
+from products.models import ParentProduct
+
+
+class EditDistanceTestCase(SimpleTestCase):
+    def test_edit_distance(self):
+        self.assertEqual(spelling.edit_distance("sweater", "sweater", 2), 0)
+        self.assertEqual(spelling.edit_distance("sweter", "sweater", 2), 1)
+        # a transposition is a single edit
+        self.assertEqual(spelling.edit_distance("sewater", "sweater", 2), 1)
+        self.assertEqual(spelling.edit_distance("swtr", "sweater", 2), 3)
+        self.assertEqual(spelling.edit_distance("abc", "xyz", 1), 2)
+
+    def test_trigrams(self):
+        self.assertEqual(spelling.trigrams("dress"), {"  d", " dr", "dre", "res", "ess", "ss "})
+
+    def test_suggest(self):
+        vocabulary = spelling.Vocabulary({"sweater": 3, "sweatshirt": 1, "dress": 5, "dresses": 2})
+        self.assertEqual(vocabulary.suggest("sweter"), ["sweater"])
+        # equally close, the more frequent one first
+        self.assertEqual(vocabulary.suggest("dresss", limit=2), ["dress", "dresses"])
+        self.assertEqual(vocabulary.suggest("skirt"), [])
+
+    def test_correct(self):
+        vocabulary = spelling.Vocabulary({"sweater": 3, "dress": 5, "summer": 1})
+        self.assertEqual(
+            vocabulary.correct(["sweter", "dre", "sweaters", "for", "xl", "2024", "qwerty"]),
+            ["sweater", "dre", "sweaters", "for", "xl", "2024", "qwerty"],
+        )
+
+
+class SpellingTestCase(TransactionTestCase):
+    fixtures = ["campaign.json", "category.json", "parent_product.json", "product.json",
+                "color.json", "image.json", "size.json", "size_group.json", "stock.json"]
+
+    def setUp(self):
+        cache.clear()
+
+    def test_vocabulary(self):
+        vocabulary = spelling.get_vocabulary()
+        # names, keywords and categories, but not descriptions
+        for word in ("merino", "homewear", "knitwear"):
+            self.assertIn(word, vocabulary.frequencies)
+        self.assertNotIn("nautical", vocabulary.frequencies)
+        self.assertEqual(spelling.correct("Merinno sweter"), "merino sweater")
+
+        with self.assertNumQueries(0):
+            spelling.get_vocabulary()
+
+    def test_built_once_by_concurrent_threads(self):
+        vocabulary = spelling.Vocabulary({"dress": 1})
+        results = []
+        with mock.patch.object(spelling, "load_frequencies") as load_frequencies:
+            with spelling._lock:
+                thread = threading.Thread(target=lambda: results.append(spelling.get_vocabulary()))
+                thread.start()
+                # the vocabulary built by another thread holding the lock
+                spelling._local = (cache_versions.get_version(spelling.VERSION), vocabulary)
+            thread.join()
+        load_frequencies.assert_not_called()
+        self.assertIs(results[0], vocabulary)
+
+    def test_rebuilt_after_changes(self):
+        spelling.get_vocabulary()
+        parent = ParentProduct.objects.get(pk=4)
+        parent.search_keywords = "basic cardigan"
+        parent.save()
+        self.assertEqual(spelling.correct("cardigna"), "cardigan")
+
+    def test_search_list(self):
+        response = self.client.get(reverse("products:search_list") + "?q=Trosers")
+        self.assertEqual(response.context["corrected_query"], "trousers")
+        self.assertEqual({product.parent_id for product in response.context["products"]}, {5})
+
+        response = self.client.get(reverse("products:search_list") + "?q=Trousers")
+        self.assertNotIn("corrected_query", response.context)
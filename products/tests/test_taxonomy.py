@@ -0,0 +1,79 @@
+from django.core.cache import cache
+from django.test import TransactionTestCase
+from django.urls import reverse
+
+from products import cache_versions, taxonomy
+from products.models import Campaign, Category, Color, Size
+
+
+class TaxonomyTestCase(TransactionTestCase):
+    fixtures = ["campaign.json", "category.json", "parent_product.json", "product.json",
+                "color.json", "image.json", "size.json", "size_group.json", "stock.json"]
+
+    def setUp(self):
+        cache.clear()
+
+    def test_loaded_once(self):
+        # categories, colors, size groups, sizes and campaigns
+        with self.assertNumQueries(5):
+            taxonomy.get_taxonomy()
+        with self.assertNumQueries(0):
+            data = taxonomy.get_taxonomy()
+
+        self.assertEqual(data.categories, list(Category.objects.all()))
+        self.assertEqual(data.colors, list(Color.objects.order_by("pk")))
+        self.assertEqual(data.campaigns, list(Campaign.objects.filter(is_active=True).order_by("pk")))
+        for group in data.size_groups:
+            with self.assertNumQueries(0):
+                sizes = list(group.sizes.all())
+            self.assertEqual(sizes, list(Size.objects.filter(group=group)))
+
+    def test_shared_cache_used_by_other_processes(self):
+        taxonomy.get_rows()
+        # as in a process which hasn't loaded the rows yet
+        taxonomy._local = (None, None)
+        with self.assertNumQueries(0):
+            taxonomy.get_rows()
+
+    def test_new_instances_every_time(self):
+        self.assertIsNot(taxonomy.get_taxonomy().categories[0], taxonomy.get_taxonomy().categories[0])
+
+    def test_tree_lookups(self):
+        data = taxonomy.get_taxonomy()
+        dresses = data.get_category("dresses")
+        self.assertEqual(data.get_descendants(dresses), list(dresses.get_descendants()))
+        self.assertEqual(data.get_descendants(dresses, include_self=True), list(dresses.get_descendants(include_self=True)))
+        child = data.get_descendants(dresses)[0]
+        self.assertEqual(data.get_ancestors(child, include_self=True), list(child.get_ancestors(include_self=True)))
+        self.assertEqual(data.root_categories(), list(Category.objects.filter(parent__isnull=True)))
+        self.assertEqual(data.root_and_path_categories(dresses), list(Category.objects.root_and_path_categories("dresses")))
+        self.assertIsNone(data.get_category("non-existent"))
+
+    def test_invalidated_by_changes(self):
+        version = cache_versions.get_version(taxonomy.VERSION)
+        color = Color.objects.get(pk=1)
+        color.name = "new name"
+        color.save()
+        self.assertNotEqual(cache_versions.get_version(taxonomy.VERSION), version)
+        self.assertEqual(taxonomy.get_taxonomy().colors[0].name, "new name")
+
+        Campaign.objects.filter(is_active=True).first().delete()
+        self.assertEqual(len(taxonomy.get_taxonomy().campaigns), Campaign.objects.filter(is_active=True).count())
+
+    def test_invalidated_by_moving_category(self):
+        taxonomy.get_taxonomy()
+        dresses = Category.objects.get(path_crumb="dresses")
+        child = dresses.get_children().first()
+        target = Category.objects.filter(parent__isnull=True).exclude(pk=dresses.pk).first()
+        child.move_to(target, "last-child")
+
+        target.refresh_from_db()
+        data = taxonomy.get_taxonomy()
+        self.assertEqual(data.get_descendants(data.get_category(target.path_crumb)), list(target.get_descendants()))
+
+    def test_inactive_campaign_not_found(self):
+        campaign = Campaign.objects.filter(is_active=True).first()
+        campaign.is_active = False
+        campaign.save()
+        response = self.client.get(reverse("products:product_list_for_campaign", kwargs={"slug": campaign.slug}))
+        self.assertEqual(response.status_code, 404)
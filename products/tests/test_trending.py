@@ -0,0 +1,87 @@
+from io import StringIO
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+
+from products import trending
+from products.models import Product, ViewBucket
+
+# a reference hour
+HOUR = trending.REBASE_HOURS * 700
+
+
+class TrendingTestCase(TestCase):
+    fixtures = ["campaign.json", "category.json", "parent_product.json", "product.json",
+                "color.json", "image.json", "size.json", "size_group.json", "stock.json"]
+
+    def setUp(self):
+        cache.clear()
+
+    def update_scores(self, hour):
+        # the hour of the last update is saved on commit
+        with self.captureOnCommitCallbacks(execute=True):
+            return trending.update_scores(hour)
+
+    def buckets(self):
+        return set(ViewBucket.objects.values_list("product_id", "hour", "views"))
+
+    def test_add_views(self):
+        trending.add_views({8: 2, 9: 1}, HOUR)
+        trending.add_views({8: 1, 10: 4, 1000: 1}, HOUR)
+        trending.add_views({8: 1}, HOUR + 1)
+        # views of missing Products are skipped
+        self.assertEqual(self.buckets(), {(8, HOUR, 3), (9, HOUR, 1), (10, HOUR, 4), (8, HOUR + 1, 1)})
+
+    def test_update_scores(self):
+        trending.add_views({8: 10, 9: 1}, HOUR)
+        trending.add_views({8: 8, 10: 4}, HOUR - trending.HALF_LIFE_HOURS)
+        trending.add_views({9: 100}, HOUR - trending.HORIZON_HOURS)
+
+        # the first update is a full one
+        self.assertEqual(self.update_scores(HOUR), Product.objects.count())
+        self.assertEqual(
+            dict(Product.objects.filter(trending__gt=0).values_list("pk", "trending")),
+            {8: 14.0, 9: 1.0, 10: 2.0},
+        )
+        # expired buckets are deleted
+        self.assertNotIn((9, HOUR - trending.HORIZON_HOURS, 100), self.buckets())
+
+        # only Products with views since the hour of the last update (or expired ones)
+        # are updated, scores are relative to the reference hour,
+        # so older views weigh less and the others don't change
+        trending.add_views({9: 5}, HOUR + trending.HALF_LIFE_HOURS)
+        self.assertEqual(self.update_scores(HOUR + trending.HALF_LIFE_HOURS), 2)
+        self.assertEqual(
+            dict(Product.objects.filter(trending__gt=0).values_list("pk", "trending")),
+            {8: 14.0, 9: 11.0, 10: 2.0},
+        )
+        # no full scans
+        with self.assertNumQueries(5):
+            self.assertEqual(self.update_scores(HOUR + trending.HORIZON_HOURS - trending.HALF_LIFE_HOURS + 1), 3)
+        self.assertEqual(dict(Product.objects.filter(trending__gt=0).values_list("pk", "trending")), {8: 10.0, 9: 11.0})
+
+        # all expired
+        trending.add_views({12: 1}, HOUR + trending.REBASE_HOURS - 1)
+        self.assertEqual(self.update_scores(HOUR + trending.REBASE_HOURS - 1), 3)
+        self.assertGreater(Product.objects.get(pk=12).trending, 1000)
+        self.assertEqual(Product.objects.filter(trending__gt=0).count(), 1)
+        # with a new reference hour all scores are recomputed
+        self.assertEqual(self.update_scores(HOUR + trending.REBASE_HOURS), Product.objects.count())
+        self.assertEqual(Product.objects.get(pk=12).trending, round(0.5 ** (1 / trending.HALF_LIFE_HOURS), 3))
+
+    def test_popularity_ordering(self):
+        trending.add_views({12: 1, 16: 3}, trending.current_hour())
+        trending.update_scores()
+        response = self.client.get(reverse("products:product_list") + "?sorting=popularity")
+        self.assertEqual([product.pk for product in response.context["products"]][:2], [16, 12])
+
+        response = self.client.get(reverse("products:main_page"))
+        self.assertEqual([product.pk for product in response.context["most_popular"]][:2], [16, 12])
+
+    def test_command(self):
+        out = StringIO()
+        call_command("update_trending", stdout=out)
+        self.assertIn("Updated trending scores of 11 products.", out.getvalue())
+        self.assertFalse(Product.objects.filter(trending__gt=0).exists())
@@ -0,0 +1,108 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.db import DatabaseError
+from django.test import TestCase, override_settings
+from freezegun import freeze_time
+
+from products import view_counter
+from products.models import ParentProduct, Product
+
+
+@override_settings(PRODUCTS_VIEWS_FLUSH_INTERVAL=60)
+class ViewCounterTestCase(TestCase):
+    fixtures = ["campaign.json", "category.json", "parent_product.json", "product.json",
+                "color.json", "image.json", "size.json", "size_group.json", "stock.json"]
+
+    def setUp(self):
+        cache.clear()
+        # as if a flush has just been done
+        cache.add(view_counter.DUE, True, timeout=60)
+
+    def views(self, pk):
+        return Product.objects.get(pk=pk).views
+
+    def test_flush_batched(self):
+        for pk in (8, 8, 8, 9, 10):
+            view_counter.record(pk)
+        self.assertEqual(self.views(8), 55)
+        self.assertEqual(view_counter.get_pending(8), 3)
+
+        # one UPDATE per distinct count, no saves, + adding to trending buckets
+        with mock.patch.object(ParentProduct, "save") as save, self.assertNumQueries(7):
+            self.assertEqual(view_counter.flush(), 5)
+        save.assert_not_called()
+        self.assertEqual([self.views(pk) for pk in (8, 9, 10)], [58, 98, 112])
+        self.assertEqual(view_counter.get_pending(8), 0)
+
+        # only Products viewed since the last flush
+        view_counter.record(9)
+        with self.assertNumQueries(5):
+            self.assertEqual(view_counter.flush(), 1)
+        self.assertEqual(self.views(9), 99)
+
+    def test_flushed_by_views_once_per_interval(self):
+        scores = dict(Product.objects.values_list("pk", "trending"))
+        with freeze_time("2024-01-01 12:00:00"):
+            cache.clear()
+            view_counter.record(8)
+            self.assertEqual(self.views(8), 56)
+            view_counter.record(8)
+            self.assertEqual(self.views(8), 56)
+        with freeze_time("2024-01-01 12:01:01"):
+            view_counter.record(9)
+        self.assertEqual((self.views(8), self.views(9)), (57, 98))
+        # trending scores are only updated by the 'update_trending' command
+        self.assertEqual(dict(Product.objects.values_list("pk", "trending")), scores)
+
+    def test_views_during_flush(self):
+        view_counter.record(8)
+        write = view_counter._write
+
+        def write_and_view(counts):
+            write(counts)
+            view_counter.record(8)
+
+        with mock.patch.object(view_counter, "_write", write_and_view):
+            view_counter.flush()
+        self.assertEqual(self.views(8), 56)
+        self.assertEqual(view_counter.get_pending(8), 1)
+        self.assertIsNotNone(cache.get(view_counter.OLDEST))
+        view_counter.flush()
+        self.assertEqual(self.views(8), 57)
+        self.assertIsNone(cache.get(view_counter.OLDEST))
+
+    def test_failed_flush_keeps_views(self):
+        view_counter.record(8)
+        cache.delete(view_counter.DUE)
+        with mock.patch.object(view_counter, "_write", side_effect=DatabaseError), \
+                self.assertLogs("products.view_counter", "ERROR"):
+            view_counter.record(8)
+        self.assertEqual(view_counter.get_pending(8), 2)
+        self.assertIsNone(cache.get(view_counter.LOCK))
+        # the lag of the next flush includes the failed one
+        self.assertIsNotNone(cache.get(view_counter.OLDEST))
+        view_counter.flush()
+        self.assertEqual(self.views(8), 57)
+
+    def test_metrics(self):
+        with freeze_time("2024-01-01 12:00:00"):
+            view_counter.record(8)
+            view_counter.record(9)
+        # the counter (with the pending view) evicted between cache.add and cache.incr
+        add = cache.add
+        with mock.patch.object(cache, "add", lambda key, *args, **kwargs: (
+            cache.delete(key) and False if key == view_counter.PENDING % 8 else add(key, *args, **kwargs)
+        )):
+            view_counter.record(8)
+        self.assertEqual(view_counter.get_metrics()["pending_products"], 2)
+
+        with freeze_time("2024-01-01 12:00:30"):
+            view_counter.flush()
+        metrics = view_counter.get_metrics()
+        self.assertEqual(
+            {name: metrics[name] for name in ("recorded", "flushed", "dropped", "flushes", "pending_products")},
+            {"recorded": 2, "flushed": 1, "dropped": 1, "flushes": 1, "pending_products": 0},
+        )
+        self.assertEqual(metrics["last_flush"]["lag"], 30)
+        self.assertEqual(metrics["last_flush"]["products"], 1)
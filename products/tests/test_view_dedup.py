@@ -0,0 +1,54 @@
+from unittest import mock
+
+from django.test import SimpleTestCase
+from django.utils import timezone
+
+from products import view_dedup
+from products.view_dedup import ViewedProducts
+
+
+class ViewedProductsTestCase(SimpleTestCase):
+    def test_buckets(self):
+        viewed = ViewedProducts()
+        viewed.add(7, 1000)
+        viewed.add(8, 1004)
+        viewed.add(9, 1005)
+        self.assertEqual(viewed.to_data(), [[1000, 7, 8], [1005, 9]])
+        self.assertIn(8, viewed)
+        self.assertNotIn(10, viewed)
+        self.assertEqual(len(viewed), 3)
+
+    def test_prune(self):
+        viewed = ViewedProducts([[1000, 7, 8], [1005, 9]])
+        viewed.prune(1059)
+        self.assertFalse(viewed.changed)
+        viewed.prune(1060)
+        self.assertTrue(viewed.changed)
+        self.assertEqual(viewed.to_data(), [[1005, 9]])
+        viewed.prune(2000)
+        self.assertEqual(viewed.to_data(), [])
+
+    @mock.patch.object(view_dedup, "MAX_PRODUCTS", 3)
+    def test_bounded(self):
+        viewed = ViewedProducts([[1000, 7, 8], [1005, 9]])
+        viewed.add(10, 1006)
+        self.assertEqual(viewed.to_data(), [[1000, 8], [1005, 9, 10]])
+        viewed.add(11, 1010)
+        viewed.add(12, 1010)
+        self.assertEqual(viewed.to_data(), [[1005, 10], [1010, 11, 12]])
+
+    def test_from_data(self):
+        viewed = ViewedProducts.from_data({"7": "2024-01-01 12:03:00", "8": "2024-01-01 12:01:00", "9": "x"})
+        self.assertTrue(viewed.changed)
+        self.assertEqual(len(viewed.to_data()), 1)
+        self.assertEqual(viewed.to_data()[0][1:], [8, 7])
+
+        # naive timestamps of old sessions are UTC, whatever TIME_ZONE of the process is
+        now = timezone.now()
+        viewed = ViewedProducts.from_data({"7": now.replace(tzinfo=None).strftime("%Y-%m-%d %H:%M:%S")})
+        viewed.prune(view_dedup.now_minutes())
+        self.assertIn(7, viewed)
+        self.assertEqual(viewed.to_data()[0][0], view_dedup.now_minutes() // 5 * 5)
+
+        self.assertEqual(ViewedProducts.from_data(None).to_data(), [])
+        self.assertFalse(ViewedProducts.from_data([[1000, 7]]).changed)
@@ -1,33 +1,77 @@
+import json
+from unittest import mock
+
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
 from django.test import TransactionTestCase
 from django.urls import reverse
+from django.utils.http import urlsafe_base64_encode
 
-from products.models import Product, Category, Campaign
+from products import cards, search, signals, spelling, taxonomy, view_counter, view_dedup
+from products.models import Product, Category, Campaign, ParentProduct, Stock
+from products.templatetags.product_tags import paginate
+from products.views import ProductList
 
 
 class BaseTestCase(TransactionTestCase):
     fixtures = ["campaign.json", "category.json", "parent_product.json", "product.json",
                 "color.json", "image.json", "size.json", "size_group.json", "stock.json"]
 
+    def setUp(self):
+        cache.clear()
+        # categories, colors, sizes and campaigns are normally served from cache,
+        # the cost of loading them is tested in test_taxonomy
+        taxonomy.get_rows()
+
 
 class ProductDetailTestCase(BaseTestCase):
     def test_queries_count(self):
         """
-        Test that there are exactly 8 db queries:
-        4 for the view:
+        Test that there are exactly 3 db queries:
         - 'products_product',
         - 'products_stock',
-        - 'products_category',
         - 'products_images',
 
-        + 4 own Django for session management.
+        a visitor without a session doesn't get one, recently viewed products
+        are kept in a signed cookie.
+        Views were flushed to the db recently, so the view is only counted in cache.
         """
-        with self.assertNumQueries(8):
+        cache.set(view_counter.DUE, True)
+        with self.assertNumQueries(3):
             self.client.get(
                 reverse(
                     "products:product_detail",
                     kwargs={'slug': 'strapless-dress-sky-blue'}
                 )
             )
+        self.assertFalse(Session.objects.exists())
+
+    def test_queries_count_with_session(self):
+        """ + 4 own Django for session management (reading, checking and saving it). """
+        cache.set(view_counter.DUE, True)
+        session = self.client.session
+        session["cart"] = {}
+        session.save()
+        with self.assertNumQueries(7):
+            self.client.get(reverse("products:product_detail", kwargs={'slug': 'strapless-dress-sky-blue'}))
+        self.assertIn(signals.VIEWED, self.client.session)
+
+    def test_viewed_cookie(self):
+        cache.set(view_counter.DUE, True)
+        url = reverse("products:product_detail", kwargs={'slug': 'strapless-dress-sky-blue'})
+        response = self.client.get(url)
+        self.assertIn(view_dedup.COOKIE_NAME, response.cookies)
+        self.assertEqual(view_counter.get_pending(7), 1)
+
+        # already viewed, the cookie isn't set again
+        response = self.client.get(url)
+        self.assertNotIn(view_dedup.COOKIE_NAME, response.cookies)
+        self.assertEqual(view_counter.get_pending(7), 1)
+
+        # tampered cookies are ignored
+        self.client.cookies[view_dedup.COOKIE_NAME] = "[[1,7]]"
+        self.client.get(url)
+        self.assertEqual(view_counter.get_pending(7), 2)
 
     def test_product_obj(self):
         product_from_db = Product.objects.get(slug='strapless-dress-deep-red')
@@ -86,28 +130,62 @@ class ProductDetailTestCase(BaseTestCase):
 class ProductListTestCase(BaseTestCase):
     def test_queries_count(self):
         """
-        Test that there are exactly 8 db queries:
+        Test that there are exactly 6 db queries:
         - 'products_product',
         - 'products_stock',
-        - 'products_category',
-        - 'products_images',
-        - 'products_size',
-        - 'products_sizegroup'
-        and two subqueries
+        price bounds (cached afterwards) and three for facets
+        (colors, sizes, price histogram).
+        Categories, colors and sizes come from the taxonomy cache.
+        Cursor pagination doesn't need a COUNT query.
         """
-        with self.assertNumQueries(8):
+        with self.assertNumQueries(6):
             self.client.get(
                 reverse(
                     "products:product_list",
                 )
             )
 
+    def test_queries_count_with_cached_price_bounds(self):
+        """ Cards of the Products are cached by the first request too, so no 'products_stock'. """
+        self.client.get(reverse("products:product_list"))
+        with self.assertNumQueries(4):
+            self.client.get(reverse("products:product_list") + "?price_lte=50")
+
+    def test_cards_cached(self):
+        url = reverse("products:product_list")
+        self.client.get(url)
+        with mock.patch("products.cards.render") as render:
+            response = self.client.get(url)
+        render.assert_not_called()
+        self.assertContains(response, "Strapless dress")
+
+        # changes of Products, their stock, parents and siblings render the cards again
+        product = Product.objects.get(pk=9)
+        product.discounted_price = 99
+        product.save()
+        Stock.objects.filter(product=10).first().save()
+        parent = ParentProduct.objects.get(pk=5)
+        parent.name = "Elegant trousers"
+        parent.save()
+        with mock.patch("products.cards.render", side_effect=cards.render) as render:
+            response = self.client.get(url)
+        self.assertEqual({call.args[0].pk for call in render.call_args_list}, {9, 10, 16})
+        self.assertContains(response, "Elegant trousers")
+
+    def test_cards_below_the_fold_lazy(self):
+        """ Main images of cards after the first cards.EAGER ones, thumbnails of siblings always. """
+        response = self.client.get(reverse("products:product_list"))
+        products = len(response.context["products"])
+        self.assertGreater(products, cards.EAGER)
+        self.assertContains(response, '<img loading="lazy"', count=products - cards.EAGER)
+        self.assertContains(response, 'loading="lazy" sizes="60px"')
+
     def test_queries_count_with_query_string(self):
         """
         Same as above but with query params.
         Same number of queries expected.
         """
-        with self.assertNumQueries(8):
+        with self.assertNumQueries(6):
             self.client.get(
                 reverse(
                     "products:product_list",
@@ -119,7 +197,7 @@ class ProductListTestCase(BaseTestCase):
         Only available products should be listed, so products with pk=7, 11
         shouldn't be in the queryset
         """
-        products_from_db = Product.objects.exclude(pk__in=[7, 11])
+        products_from_db = Product.objects.exclude(pk__in=[7, 11]).order_by('-trending', '-pk')
         response = self.client.get(
             reverse(
                 "products:product_list",
@@ -129,14 +207,155 @@ class ProductListTestCase(BaseTestCase):
         self.assertEqual(list(response.context.get('products')), list(products_from_db))
 
 
+@mock.patch.object(ProductList, "paginate_by", 3)
+class CursorPaginationTestCase(BaseTestCase):
+    def walk(self, url, cursor=None, cursor_name="next_cursor"):
+        """
+        Follow the cursors in the given direction,
+        return primary keys of products from all visited pages
+        and the last response.
+        """
+        pages = []
+        while True:
+            response = self.client.get(url + ("&cursor=%s" % cursor if cursor else ""))
+            self.assertEqual(response.status_code, 200)
+            pages.append([product.pk for product in response.context.get('products')])
+            cursor = getattr(response.context.get('page_obj'), cursor_name)
+            if not cursor:
+                return pages, response
+
+    def test_all_ordering_options(self):
+        """
+        Walking through all pages should return the same products,
+        in the same order as a single query, in both directions.
+        """
+        for option, ordering in ProductList.ordering_options.items():
+            with self.subTest(ordering=option):
+                url = reverse("products:product_list") + "?sorting=%s" % option
+                pages, last_response = self.walk(url)
+                expected = Product.custom_manager.available()
+                if ordering.lstrip("-") == "pk":
+                    expected = expected.order_by(ordering)
+                else:
+                    expected = expected.order_by(ordering, ordering.replace(ordering.lstrip("-"), "pk"))
+
+                self.assertEqual(len(pages), 3)
+                self.assertEqual(sum(pages, []), list(expected.values_list("pk", flat=True)))
+
+                # and back to the first page
+                previous_cursor = last_response.context.get('page_obj').previous_cursor
+                previous_pages, _ = self.walk(url, previous_cursor, "previous_cursor")
+                self.assertEqual(previous_pages, pages[-2::-1])
+
+    def test_queries_count_is_the_same_for_deep_pages(self):
+        url = reverse("products:product_list")
+        response = self.client.get(url)
+        # price bounds are cached by the first request
+        with self.assertNumQueries(5):
+            self.client.get(url, {"cursor": response.context.get('page_obj').next_cursor})
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse("products:product_list") + "?cursor=invalid")
+        self.assertEqual(response.status_code, 404)
+
+        # cursor created for a different ordering
+        response = self.client.get(reverse("products:product_list"))
+        cursor = response.context.get('page_obj').next_cursor
+        response = self.client.get(
+            reverse("products:product_list") + "?sorting=newest&cursor=%s" % cursor
+        )
+        self.assertEqual(response.status_code, 404)
+
+        # forged sort keys
+        for sorting, data in (
+            ("", ["-trending", "abc", 5, "n"]),
+            ("", ["-trending", {"a": 1}, 5, "n"]),
+            ("", ["-trending", None, 5, "n"]),
+            ("price_ascending", ["effective_price", "xx", 5, "n"]),
+        ):
+            cursor = urlsafe_base64_encode(json.dumps(data).encode())
+            response = self.client.get(reverse("products:product_list"), {"sorting": sorting, "cursor": cursor})
+            self.assertEqual(response.status_code, 404)
+
+    def test_page_number_falls_back_to_offset_pagination(self):
+        response = self.client.get(reverse("products:product_list") + "?page=2")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context.get('pagination_mode'), "offset")
+        self.assertEqual(response.context.get('page_obj').number, 2)
+
+    def test_paginate_filter(self):
+        url = "http://testserver/products/?color=1,2&page=3"
+        self.assertEqual(paginate(url, 4), "http://testserver/products/?color=1,2&page=4")
+        self.assertEqual(paginate(url, "abc"), "http://testserver/products/?color=1,2&cursor=abc")
+        self.assertEqual(
+            paginate("http://testserver/products/?cursor=abc&q=chic+dress", ""),
+            "http://testserver/products/?q=chic+dress"
+        )
+
+
+class ProductFacetsTestCase(BaseTestCase):
+    def test_color_counts(self):
+        response = self.client.get(reverse("products:product_list"))
+        # available products: 2 red (pk=8, 15, 16 - 3), blue (pk=10), green (pk=9),
+        # grey (pk=12), olive (pk=14), navy blue (pk=13, 17)
+        self.assertEqual(
+            response.context.get('color_counts'),
+            {1: 3, 2: 1, 3: 1, 7: 1, 8: 1, 9: 2}
+        )
+
+    def test_color_counts_exclude_color_filter(self):
+        """
+        Selecting a color shouldn't change the counts of colors,
+        but it should narrow down the counts of sizes.
+        """
+        response = self.client.get(reverse("products:product_list") + "?color=2")
+        self.assertEqual(response.context.get('color_counts')[1], 3)
+        self.assertEqual(list(response.context.get('products')), [Product.objects.get(pk=10)])
+        self.assertEqual(response.context.get('size_counts'), {1: 1, 2: 1, 3: 1, 4: 1})
+
+    def test_size_counts(self):
+        # products available in size 1 ('32'): pk=8, 9, 10
+        response = self.client.get(
+            reverse("products:product_by_category_list", kwargs={"path": "dresses"})
+        )
+        self.assertEqual(response.context.get('size_counts')[1], 3)
+        # size 2 ('34') is sold out for pk=8
+        self.assertEqual(response.context.get('size_counts')[2], 2)
+
+        # products filtered by size don't change the counts of sizes
+        response = self.client.get(
+            reverse("products:product_by_category_list", kwargs={"path": "dresses"}) + "?size=2"
+        )
+        self.assertEqual(response.context.get('size_counts')[1], 3)
+        self.assertEqual(response.context.get('color_counts'), {2: 1, 3: 1})
+
+    def test_selected_options_without_results(self):
+        # the only red dress (pk=8) is sold out in size 2 ('34')
+        response = self.client.get(
+            reverse("products:product_by_category_list", kwargs={"path": "dresses"}) + "?size=2&color=1"
+        )
+        self.assertNotIn(1, response.context.get('color_counts'))
+        self.assertContains(response, "toggleFilter(color, '1')")
+        self.assertNotContains(response, "toggleFilter(color, '7')")
+
+    def test_price_histogram(self):
+        response = self.client.get(reverse("products:product_list") + "?price_lte=50")
+        histogram = response.context.get('price_histogram')
+
+        # effective prices: 19, 29, 29, 29 | 79, 89 | 119, 119 | 149
+        self.assertEqual([bucket["count"] for bucket in histogram], [4, 2, 3])
+        self.assertEqual([bucket["min"] for bucket in histogram], [0, 50, 100])
+        self.assertEqual(histogram[0]["height"], 100)
+
+
 class CampaignProductListTestCase(BaseTestCase):
     def test_queries_count(self):
         """
-        Test that there are exactly 9 db queries:
-        same as in ProductListTestCase plus
-        one additional for 'products_campaign'.
+        Test that there are exactly 6 db queries:
+        same as in ProductListTestCase, the Campaign
+        is found among the cached active campaigns.
         """
-        with self.assertNumQueries(9):
+        with self.assertNumQueries(6):
             self.client.get(
                 reverse(
                     "products:product_list_for_campaign",
@@ -146,10 +365,10 @@ class CampaignProductListTestCase(BaseTestCase):
 
     def test_queries_count_non_existent_campaign(self):
         """
-        Test that only one query is executed when Campaign with
-        a given slug does not exist.
+        Test that no queries are executed when an active Campaign
+        with a given slug does not exist.
         """
-        with self.assertNumQueries(1):
+        with self.assertNumQueries(0):
             self.client.get(
                 reverse(
                     "products:product_list_for_campaign",
@@ -159,7 +378,7 @@ class CampaignProductListTestCase(BaseTestCase):
 
     def test_get_queryset_campaign_view(self):
         # Campaign 'New Collection' so products with parent_pk=1, 2, 4, 5, 6 but only available so excluding pk=7,11
-        products_from_db = Product.objects.exclude(pk__in=[7, 11]).filter(parent__in=[1, 2, 4, 5, 6])
+        products_from_db = Product.objects.exclude(pk__in=[7, 11]).filter(parent__in=[1, 2, 4, 5, 6]).order_by('-trending', '-pk')
         response = self.client.get(
             reverse(
                 "products:product_list_for_campaign",
@@ -184,19 +403,19 @@ class CampaignProductListTestCase(BaseTestCase):
 class CategoryProductListTestCase(BaseTestCase):
     def test_queries_count(self):
         """
-        Test that there are exactly 10 db queries:
-        same as in ProductListTestCase plus two additional
-        for 'products_category' (for filtering products
-        by category and for providing category queryset).
+        Test that there are exactly 6 db queries:
+        same as in ProductListTestCase, the Category, its subtree
+        (for filtering products) and the sidebar categories
+        come from the taxonomy cache.
         """
-        with self.assertNumQueries(10):
+        with self.assertNumQueries(6):
             self.client.get(
                 reverse(
                     "products:product_by_category_list",
                     kwargs={"path": "dresses/summer-dresses"}
                 )
             )
-        with self.assertNumQueries(10):
+        with self.assertNumQueries(6):
             self.client.get(
                 reverse(
                     "products:product_by_category_list",
@@ -206,7 +425,7 @@ class CategoryProductListTestCase(BaseTestCase):
 
     def test_get_queryset(self):
         # Category 'dresses' so products with parent_pk=1, 2, 6 but only available so excluding pk=7,11
-        products_from_db = Product.objects.exclude(pk__in=[7, 11]).filter(parent__in=[1, 2, 6])
+        products_from_db = Product.objects.exclude(pk__in=[7, 11]).filter(parent__in=[1, 2, 6]).order_by('-trending', '-pk')
         response = self.client.get(
             reverse(
                 "products:product_by_category_list",
@@ -229,11 +448,17 @@ class CategoryProductListTestCase(BaseTestCase):
 
 
 class SearchProductListTestCase(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        # the search index and the vocabulary of words are built on the first search
+        search.search("dress")
+        spelling.get_vocabulary()
+
     def test_queries_count(self):
         """
         Test that there are exactly 7 db queries:
-        same as in ProductListTestCase minus one for
-        'products_category' (it's not used here)
+        same as in ProductListTestCase plus one for ranking
+        the results ('products_product'), search itself is done in memory.
         """
         with self.assertNumQueries(7):
             self.client.get(
@@ -256,20 +481,44 @@ class SearchProductListTestCase(BaseTestCase):
             ) + "?q=wool"
         )
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(list(response.context.get('products')), list(products_from_db))
+        self.assertEqual(set(response.context.get('products')), set(products_from_db))
+
+    def test_ranked_by_relevance(self):
+        # 'chic' is in the name of parent 5, only in keywords and descriptions of parents 1 and 2
+        response = self.client.get(reverse("products:search_list") + "?q=chic")
+        products = response.context.get('products')
+        self.assertEqual(products[0].parent_id, 5)
+        self.assertEqual({product.parent_id for product in products[1:]}, {1, 2})
+
+    def test_ordering_option(self):
+        response = self.client.get(reverse("products:search_list") + "?q=dress&sorting=price_ascending")
+        prices = [product.effective_price for product in response.context.get('products')]
+        self.assertEqual(prices, sorted(prices))
+
+    def test_no_results(self):
+        response = self.client.get(reverse("products:search_list") + "?q=xyz")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context.get('products')), [])
+
+    def test_empty_query_has_no_results(self):
+        for query in ("", "   "):
+            # the same page, but not from the page cache
+            cache.clear()
+            response = self.client.get(reverse("products:search_list"), {"q": query})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(list(response.context.get('products')), [])
 
 
 class MainPageTestCase(BaseTestCase):
     def test_queries_count(self):
         """
-        Test that there are exactly 6 db queries:
-        4 for the view:
+        Test that there are exactly 3 db queries:
         - 2 x 'products_product',
-        - 2 x 'products_stock',
-        - 'products_category',
-        - 'products_campaign',
+        - 'products_stock' for the trending products, cards of the new arrivals
+          are the same ones, already cached,
+        categories and campaigns come from the taxonomy cache.
         """
-        with self.assertNumQueries(6):
+        with self.assertNumQueries(3):
             self.client.get(
                 reverse(
                     "products:main_page",
@@ -0,0 +1,117 @@
+"""
+Trending score of Products: their views of the last HORIZON_HOURS,
+each hour weighted by 0.5 ** (its age / HALF_LIFE_HOURS).
+
+Views flushed by products.view_counter are also added to hourly
+ViewBuckets. The scores are computed from the buckets on a schedule,
+by the 'update_trending' command (f.e. from cron every 15 minutes),
+never in requests, and stored in the indexed Product.trending,
+so listings ordered by popularity read a presorted index
+instead of computing anything per request.
+
+Decaying all scores by the same factor doesn't change their order, so
+the stored scores are relative to a reference hour which changes once
+per REBASE_HOURS: weights grow by 2 ** (1 / HALF_LIFE_HOURS) per hour instead
+of old views losing weight. That way an update only recomputes Products
+with new or expired buckets, all of them only after the reference hour changes.
+"""
+from __future__ import annotations
+
+import time
+from collections import defaultdict
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, FloatField, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Power, Round
+
+from products import inventory_index, page_cache
+from products.models import Product, ViewBucket
+
+HALF_LIFE_HOURS = 24
+HORIZON_HOURS = 24 * 7
+# weights reach 2 ** (REBASE_HOURS / HALF_LIFE_HOURS) before all scores are recomputed
+REBASE_HOURS = 24 * 30
+# Products written at once
+BATCH_SIZE = 1000
+# (reference hour, hour) of the last update
+LAST_UPDATE = "products:trending:last-update"
+
+
+def current_hour() -> int:
+    return int(time.time() // 3600)
+
+
+def add_views(counts: dict[int, int], hour: int | None = None):
+    """
+    Add views ({product pk: views}) to the buckets of the hour,
+    in the transaction which adds them to Product.views.
+    """
+    if not counts:
+        return
+    hour = current_hour() if hour is None else hour
+    existing = set(
+        ViewBucket.objects.filter(hour=hour, product__in=counts).values_list("product_id", flat=True)
+    )
+    by_count = defaultdict(list)
+    for pk in existing:
+        by_count[counts[pk]].append(pk)
+    for count, pks in by_count.items():
+        ViewBucket.objects.filter(hour=hour, product__in=pks).update(views=F("views") + count)
+
+    missing = [pk for pk in counts if pk not in existing]
+    if missing:
+        # skip Products deleted meanwhile
+        ViewBucket.objects.bulk_create(
+            ViewBucket(product_id=pk, hour=hour, views=counts[pk])
+            for pk in Product.objects.filter(pk__in=missing).order_by().values_list("pk", flat=True)
+        )
+
+
+def reference_hour(hour: int) -> int:
+    return hour - hour % REBASE_HOURS
+
+
+def score(hour: int):
+    """ An expression of Product.trending relative to the reference hour of 'hour'. """
+    age = (F("hour") - Value(float(reference_hour(hour)))) / Value(float(HALF_LIFE_HOURS))
+    views = ViewBucket.objects.filter(product=OuterRef("pk"), hour__gt=hour - HORIZON_HOURS).order_by().values(
+        "product"
+    ).annotate(score=Sum(F("views") * Power(Value(2.0), age), output_field=FloatField())).values("score")
+
+    return Round(Coalesce(Subquery(views), Value(0.0)), 3)
+
+
+def update_scores(hour: int | None = None, full: bool = False) -> int:
+    """
+    Recompute Product.trending from the buckets (of Products which have changed
+    since the last update, unless 'full'), delete expired buckets.
+    Returns the number of updated Products.
+    """
+    hour = current_hour() if hour is None else hour
+    reference = reference_hour(hour)
+    last_update = cache.get(LAST_UPDATE)
+    full = full or last_update is None or last_update[0] != reference or last_update[1] > hour
+    expired = ViewBucket.objects.filter(hour__lte=hour - HORIZON_HOURS)
+    with transaction.atomic():
+        if full:
+            expired.delete()
+            updated = Product.objects.update(trending=score(hour))
+        else:
+            # views are added to the bucket of the last update after it
+            pks = list(
+                ViewBucket.objects.filter(Q(hour__gte=last_update[1]) | Q(hour__lte=hour - HORIZON_HOURS))
+                .order_by().values_list("product_id", flat=True).distinct()
+            )
+            expired.delete()
+            updated = 0
+            for start in range(0, len(pks), BATCH_SIZE):
+                updated += Product.objects.filter(pk__in=pks[start:start + BATCH_SIZE]).update(trending=score(hour))
+        if updated:
+            # popular Products come first on pages of product lists
+            inventory_index.invalidate_on_commit()
+            page_cache.invalidate()
+        transaction.on_commit(lambda: cache.set(LAST_UPDATE, (reference, hour), timeout=None))
+
+    return updated
+
@@ -13,6 +13,7 @@ urlpatterns = [
             [
                 path('', views.ProductList.as_view(), name='product_list'),
                 path('search/', views.ProductSearchList.as_view(), name='search_list'),
+                path('autocomplete/', views.autocomplete_suggestions, name='autocomplete'),
                 re_path(
                     r'^(?P<path>[\w/-]+)/$',
                     views.ProductByCategoryList.as_view(),
@@ -22,4 +23,15 @@ urlpatterns = [
         )
     ),
     path('campaign/<slug>/', views.ProductByCampaignList.as_view(), name='product_list_for_campaign'),
+    path(
+        'api/',
+        include(
+            [
+                path('products/', views.ProductListApi.as_view(), name='product_list_api'),
+                re_path(r'^products/(?P<slug>[-\w]+)/$', views.product_detail_api, name='product_detail_api'),
+                path('categories/', views.categories_api, name='categories_api'),
+                path('campaigns/', views.campaigns_api, name='campaigns_api'),
+            ]
+        )
+    ),
 ]
@@ -0,0 +1,190 @@
+"""
+Write-behind counter of Product views.
+
+A view only increments a counter of its Product in the shared cache
+(cache.incr is atomic, so concurrent workers don't lose increments).
+The first increment after a flush also appends the pk to a journal,
+so a flush reads only the Products viewed since the previous one.
+A flush writes the pending counts in batches, each in a transaction with
+UPDATE ... SET views = views + delta, one statement per distinct delta,
+without saving Products, so no post_save signals are triggered
+(caches depending on views are updated by receivers of views_flushed).
+The views are also added to hourly buckets of trending scores
+(see products/trending.py), which are recomputed by the 'update_trending' command.
+
+A flush runs on the first view recorded after PRODUCTS_VIEWS_FLUSH_INTERVAL
+since the previous one (once per interval in all processes sharing the cache)
+and can be run with the 'flush_product_views' command, f.e. from cron
+or before a deploy. Only one flush runs at a time.
+
+Metrics are kept in the shared cache too (see get_metrics()):
+recorded and flushed views, views dropped because their counter
+was evicted from the cache, and the lag of the last flush,
+i.e. the age of the oldest view it has written.
+"""
+from __future__ import annotations
+
+import logging
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, transaction
+from django.db.models import F
+from django.dispatch import Signal
+
+from products import trending
+from products.models import Product
+
+logger = logging.getLogger(__name__)
+
+KEY = "products:views:%s"
+# pks of Products with a pending count, "journal:<n>" for n in (flushed, end]
+JOURNAL = KEY % "journal:%s"
+JOURNAL_END = KEY % "journal-end"
+JOURNAL_FLUSHED = KEY % "journal-flushed"
+PENDING = KEY % "pending:%s"
+OLDEST = KEY % "oldest"
+DUE = KEY % "flush-due"
+LOCK = KEY % "flush-lock"
+# max duration of a flush, the lock expires after it if the process dies
+LOCK_TIMEOUT = 300
+LAST_FLUSH = KEY % "last-flush"
+COUNTERS = ("recorded", "flushed", "dropped", "flushes")
+# pks read from the cache at once
+BATCH_SIZE = 1000
+
+# sent after every batch of a flush with the pks of Products whose views were updated
+views_flushed = Signal()
+
+
+def get_flush_interval() -> int:
+    return getattr(settings, "PRODUCTS_VIEWS_FLUSH_INTERVAL", 60)
+
+
+def _incr(key: str, delta: int = 1) -> int | None:
+    """ cache.incr creating the key, None if it was evicted meanwhile. """
+    if cache.add(key, delta, timeout=None):
+        return delta
+    try:
+        return cache.incr(key, delta)
+    except ValueError:
+        return None
+
+
+def _journal(pk: int):
+    position = _incr(JOURNAL_END)
+    if position is not None:
+        cache.set(JOURNAL % position, pk, timeout=None)
+
+
+def record(pk: int):
+    """ Count a view of the Product, flushing pending views if it's time to. """
+    count = _incr(PENDING % pk)
+    if count is None:
+        _incr(KEY % "dropped")
+    else:
+        if count == 1:
+            # the first view since the last flush
+            _journal(pk)
+            cache.add(OLDEST, time.time(), timeout=None)
+        _incr(KEY % "recorded")
+
+    if cache.add(DUE, True, timeout=get_flush_interval()):
+        try:
+            flush()
+        except DatabaseError:
+            # the views stay pending until the next flush
+            logger.exception("Flushing product views failed")
+
+
+def flush() -> int:
+    """
+    Write pending views to the db, returns the number of written views,
+    0 if another flush is running.
+    """
+    if not cache.add(LOCK, True, timeout=LOCK_TIMEOUT):
+        return 0
+    try:
+        return _flush()
+    finally:
+        cache.delete(LOCK)
+
+
+def _flush() -> int:
+    started = time.time()
+    oldest = cache.get(OLDEST)
+    flushed_position = cache.get(JOURNAL_FLUSHED, 0)
+    end = cache.get(JOURNAL_END, 0)
+    written = products = 0
+    for start in range(flushed_position, end, BATCH_SIZE):
+        positions = range(start + 1, min(start + BATCH_SIZE, end) + 1)
+        journal = cache.get_many([JOURNAL % position for position in positions])
+        pks = set(journal.values())
+        pending = cache.get_many([PENDING % pk for pk in pks])
+        counts = {pk: pending[PENDING % pk] for pk in pks if pending.get(PENDING % pk, 0) > 0}
+        _write(counts)
+        for pk, count in counts.items():
+            try:
+                remaining = cache.decr(PENDING % pk, count)
+            except ValueError:
+                # evicted, the views are written anyway
+                continue
+            if remaining > 0:
+                # viewed again during the flush, the first of these views
+                # didn't journal the pk, as the count wasn't 0
+                _journal(pk)
+        cache.delete_many(journal)
+        cache.set(JOURNAL_FLUSHED, positions[-1], timeout=None)
+        views_flushed.send(sender=Product, pks=list(counts))
+        written += sum(counts.values())
+        products += len(counts)
+
+    # only once the views are written, a failed flush keeps the age of the pending ones;
+    # views recorded during the flush are at most as old as the flush
+    cache.delete(OLDEST)
+    if cache.get(JOURNAL_END, 0) > end:
+        cache.add(OLDEST, started, timeout=None)
+
+    _incr(KEY % "flushes")
+    if written:
+        _incr(KEY % "flushed", written)
+    last_flush = {
+        "at": started,
+        "lag": started - oldest if oldest is not None else 0.0,
+        "products": products,
+        "views": written,
+        "duration": time.time() - started,
+    }
+    cache.set(LAST_FLUSH, last_flush, timeout=None)
+    logger.info("Flushed %s views of %s products, lag %.1f s", written, products, last_flush["lag"])
+
+    return written
+
+
+def _write(counts: dict[int, int]):
+    by_count = defaultdict(list)
+    for pk, count in counts.items():
+        by_count[count].append(pk)
+    with transaction.atomic():
+        for count, pks in by_count.items():
+            Product.objects.filter(pk__in=pks).update(views=F("views") + count)
+        trending.add_views(counts)
+
+
+def get_pending(pk: int) -> int:
+    """ Views of the Product which aren't written to the db yet. """
+    return cache.get(PENDING % pk, 0)
+
+
+def get_metrics() -> dict:
+    counters = cache.get_many([KEY % name for name in COUNTERS])
+    metrics = {name: counters.get(KEY % name, 0) for name in COUNTERS}
+    # approximate, a Product can be in the journal more than once
+    metrics["pending_products"] = max(cache.get(JOURNAL_END, 0) - cache.get(JOURNAL_FLUSHED, 0), 0)
+    oldest = cache.get(OLDEST)
+    metrics["pending_age"] = time.time() - oldest if oldest is not None else 0.0
+    metrics["last_flush"] = cache.get(LAST_FLUSH)
+
+    return metrics
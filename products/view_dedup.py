@@ -0,0 +1,146 @@
+"""
+Products recently viewed by a visitor, so that repeated views
+of a Product within an hour are counted only once.
+
+Views are kept in time buckets of BUCKET_MINUTES, oldest first,
+each a list of its start (in minutes since the epoch) followed by pks,
+f.e. [[28400120, 7, 12], [28400125, 9]]. It's JSON serializable and
+compact, and pruning only drops whole buckets from the front.
+A pk is remembered until its bucket starts more than WINDOW_MINUTES ago,
+i.e. for WINDOW_MINUTES - BUCKET_MINUTES to WINDOW_MINUTES,
+and at most MAX_PRODUCTS pks are kept (the oldest ones are dropped).
+
+Visitors without a session (PRODUCTS_VIEWED_COOKIE) keep them in a signed
+cookie instead, so their product views don't read or write db sessions.
+"""
+from __future__ import annotations
+
+import datetime
+import json
+
+from django.conf import settings
+from django.core import signing
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+WINDOW_MINUTES = 60
+BUCKET_MINUTES = 5
+MAX_PRODUCTS = 300
+
+COOKIE_NAME = "viewed"
+COOKIE_SALT = "products.view_dedup"
+
+
+def now_minutes() -> int:
+    return int(timezone.now().timestamp() // 60)
+
+
+class ViewedProducts:
+    def __init__(self, buckets: list[list[int]] | None = None):
+        self.buckets = buckets if buckets is not None else []
+        # the buckets have changed and have to be saved
+        self.changed = False
+
+    @classmethod
+    def from_data(cls, data) -> ViewedProducts:
+        """
+        Data stored by to_data() or by older versions:
+        {"<pk>": "YYYY-mm-dd HH:MM:SS"} in UTC (converted and marked as changed).
+        """
+        if isinstance(data, dict):
+            viewed = cls()
+            for pk, viewed_at in sorted(data.items(), key=lambda item: item[1]):
+                try:
+                    viewed_at = parse_datetime(viewed_at)
+                    if timezone.is_naive(viewed_at):
+                        # not the local time of the process (TIME_ZONE)
+                        viewed_at = timezone.make_aware(viewed_at, datetime.timezone.utc)
+                    minutes = int(viewed_at.timestamp() // 60)
+                except (TypeError, ValueError, AttributeError):
+                    continue
+                viewed.add(int(pk), minutes)
+            viewed.changed = True
+            return viewed
+
+        return cls(data if isinstance(data, list) else None)
+
+    def to_data(self) -> list[list[int]]:
+        return self.buckets
+
+    def __contains__(self, pk: int) -> bool:
+        return any(pk in bucket[1:] for bucket in self.buckets)
+
+    def __len__(self):
+        return sum(len(bucket) - 1 for bucket in self.buckets)
+
+    def add(self, pk: int, minutes: int):
+        start = minutes - minutes % BUCKET_MINUTES
+        if self.buckets and self.buckets[-1][0] == start:
+            self.buckets[-1].append(pk)
+        else:
+            self.buckets.append([start, pk])
+        self.changed = True
+
+        excess = len(self) - MAX_PRODUCTS
+        while excess > 0:
+            oldest = self.buckets[0]
+            if len(oldest) - 1 <= excess:
+                excess -= len(oldest) - 1
+                del self.buckets[0]
+            else:
+                del oldest[1:excess + 1]
+                excess = 0
+
+    def prune(self, minutes: int):
+        """ Forget the buckets which started WINDOW_MINUTES ago or earlier. """
+        expired = 0
+        while expired < len(self.buckets) and self.buckets[expired][0] <= minutes - WINDOW_MINUTES:
+            expired += 1
+        if expired:
+            del self.buckets[:expired]
+            self.changed = True
+
+
+def uses_cookie(request) -> bool:
+    """ Visitors who don't have a session yet (f.e. crawlers) don't get one. """
+    return (
+        getattr(settings, "PRODUCTS_VIEWED_COOKIE", True)
+        and settings.SESSION_COOKIE_NAME not in request.COOKIES
+    )
+
+
+class CookieStore(dict):
+    """
+    A stand-in for the session in receivers of products.signals.product_viewed,
+    with the viewed products of the signed cookie under 'key'.
+    """
+    def __init__(self, key: str, request):
+        super().__init__()
+        self.key = key
+        self.modified = False
+        try:
+            data = json.loads(request.get_signed_cookie(COOKIE_NAME, salt=COOKIE_SALT))
+        except (KeyError, signing.BadSignature, ValueError):
+            data = None
+        if data:
+            super().__setitem__(key, data)
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.modified = True
+
+    def save(self, response):
+        if not self.modified:
+            return
+        if self.get(self.key):
+            response.set_signed_cookie(
+                COOKIE_NAME,
+                json.dumps(self[self.key], separators=(",", ":")),
+                salt=COOKIE_SALT,
+                max_age=WINDOW_MINUTES * 60,
+                httponly=True,
+                samesite="Lax",
+                secure=settings.SESSION_COOKIE_SECURE,
+            )
+        else:
+            response.delete_cookie(COOKIE_NAME, samesite="Lax")
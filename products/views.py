@@ -1,23 +1,35 @@
-from django.db.models import Max, Prefetch
-from django.shortcuts import render, get_object_or_404
+import math
+
+from django.db.models import Prefetch
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.shortcuts import render
+from django.utils.cache import get_conditional_response
+from django.utils.decorators import method_decorator
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition, require_GET
 from django.views.generic import DetailView, ListView
 
-from products import signals
+from products import (
+    api, autocomplete, conditional, inventory_index, page_cache, price_bounds, search, signals, spelling, taxonomy,
+    view_dedup
+)
+from products.facets import ProductFacets
 from products.filter import ProductFilter
-from products.models import Product, Category, Color, SizeGroup, Campaign, Stock
+from products.pagination import CursorPaginator
+from products.models import Product, Stock
 
 
+@condition(etag_func=lambda request: conditional.catalog_etag("main_page"))
 def main_page(request):
-
-    # fetch only main Categories (without parent)
-    categories = Category.objects.filter(parent__isnull=True)
-    # fetch only active Campaigns
-    campaigns = Campaign.objects.filter(is_active=True)
-
-    base_queryset = Product.custom_manager.available().select_related(
-        'parent').prefetch_related(
-        Prefetch("stock", queryset=Stock.objects.select_related("size")),
-    )
+    # Categories and Campaigns are served from cache (see products.taxonomy)
+    product_taxonomy = taxonomy.get_taxonomy()
+    # only main Categories (without parent)
+    categories = product_taxonomy.root_categories()
+    # only active Campaigns
+    campaigns = product_taxonomy.campaigns
+
+    # stock is only fetched for cards missing in cache (see products.cards)
+    base_queryset = Product.custom_manager.available().select_related('parent')
     new_arrivals = base_queryset.order_by('-pk')[:10]
     # ordering by the most popular Products is the default set in Meta, so no 'order_by' needed
     most_popular = base_queryset[:10]
@@ -34,48 +46,145 @@ def main_page(request):
     )
 
 
+@require_GET
+@cache_control(public=True, max_age=60)
+def autocomplete_suggestions(request):
+    """
+    Suggestions for the search bar, f.e. ?q=dre&limit=5 ->
+    {"suggestions": [{"text": "Pencil dress - deep blue", "kind": "product", "url": "/p/pencil-dress-deep-blue/"}, ...]}
+    Served from memory (see products.autocomplete), without db queries.
+    """
+    try:
+        limit = max(int(request.GET.get("limit", 8)), 1)
+    except ValueError:
+        limit = 8
+    suggestions = autocomplete.suggest(request.GET.get("q", ""), limit)
+
+    return JsonResponse({"suggestions": [suggestion._asdict() for suggestion in suggestions]})
+
+
 class ProductList(ListView):
     filter = ProductFilter
     context_object_name = "products"
     paginate_by = 24
+    # 'cursor' - keyset pagination (see products.pagination),
+    # 'offset' - django Paginator with page numbers
+    pagination_mode = "cursor"
+    cursor_param_name = "cursor"
     ordering_param_name = "sorting"
     ordering_options = {
-        "popularity": "-views",
+        "popularity": "-trending",
         "price_ascending": "effective_price",
         "price_descending": "-effective_price",
         "newest": "-pk",
     }
     template_name = 'products/product_list/product_list.html'
 
+    def get(self, request, *args, **kwargs):
+        """
+        Pages for anonymous visitors are served from cache, see products.page_cache,
+        with an ETag of the catalog version, see products.conditional.
+        """
+        params = self.get_page_params()
+        etag = conditional.catalog_etag(page_cache.make_key(request, page_cache.canonical_query(params)))
+        if not_modified := get_conditional_response(request, etag=etag):
+            not_modified["ETag"] = etag
+            return not_modified
+
+        if page_cache.is_cacheable(request):
+            response = page_cache.serve(
+                request, params, lambda: super(ProductList, self).get(request, *args, **kwargs)
+            )
+        else:
+            response = super().get(request, *args, **kwargs)
+        if response.status_code == 200 and not getattr(response, "stale", False):
+            response.headers.setdefault("ETag", etag)
+
+        return response
+
+    def get_page_params(self):
+        """ Query params which change the page, in a canonical form (unknown ones are left out). """
+        params = self.get_filter().get_params()
+        ordering = self.request.GET.get(self.ordering_param_name)
+        if ordering in self.ordering_options:
+            params[self.ordering_param_name] = ordering
+        for name in (self.page_kwarg, self.cursor_param_name):
+            if name in self.request.GET:
+                params[name] = self.request.GET[name]
+
+        return params
+
     def get_queryset(self):
         """
         Fetch only available Products.
         Prefetch relevant data to save db queries.
         """
-        self.queryset = Product.custom_manager.available().select_related(
-            'parent').prefetch_related(
-            Prefetch("stock", queryset=Stock.objects.select_related("size")),
-        )
+        if self.use_inventory_index():
+            # filtering and ordering is done in memory,
+            # only a single page is fetched from the db
+            pks = inventory_index.get_index().resolve(
+                self.get_filter(), self.get_ordering(), **self.get_index_scope()
+            )
+            self.queryset = inventory_index.IndexedProducts(pks, self.with_related(Product.objects.all()))
+            return self.queryset
 
-        # apply filters if applicable
-        if q := self.get_Q_object():
-            self.queryset = self.queryset.filter(q).distinct()
+        self.queryset = self.with_related(self.get_filtered_queryset())
 
         # apply ordering
-        ordering = self.get_ordering()
-        # if ordering by price, apply effective_price annotation
-        # for a correct comparison between discounted and regular price
-        if ordering.find('price') != -1:
-            self.queryset = self.queryset.effective_price()
+        return self.queryset.order_by(self.get_ordering())
 
-        return self.queryset.order_by(ordering)
+    def with_related(self, queryset):
+        """
+        Select relevant data to save db queries, stock is only
+        fetched for cards missing in cache (see products.cards).
+        """
+        return queryset.select_related('parent')
+
+    def get_filtered_queryset(self):
+        """ The scope with filters from query params applied. """
+        queryset = self.get_scope_queryset()
+        if q := self.get_Q_object():
+            queryset = queryset.filter(q)
+
+        return queryset
+
+    def get_scope_queryset(self):
+        """
+        Products listed by the view before applying filters from query params:
+        all available Products here, subclasses narrow it down
+        to a category, a campaign or search results.
+        """
+        return Product.custom_manager.available()
+
+    def get_index_scope(self):
+        """
+        Scope of the view as arguments for InventoryIndex.resolve(),
+        None if the scope can't be resolved by the index.
+        """
+        return {}
+
+    def use_inventory_index(self):
+        return inventory_index.is_enabled() and self.get_index_scope() is not None
+
+    def get_taxonomy(self):
+        """ Categories, colors, sizes and campaigns, served from cache. """
+        if not hasattr(self, "_taxonomy"):
+            self._taxonomy = taxonomy.get_taxonomy()
+
+        return self._taxonomy
+
+    def get_filter(self):
+        if not hasattr(self, "_product_filter"):
+            self._product_filter = self.filter(**self.request.GET)
+
+        return self._product_filter
 
     def get_Q_object(self):
         """
         Returns a django Q object for filtering
         based on query parameters
         """
-        return ProductFilter(**self.request.GET).get_Q()
+        return self.get_filter().get_Q()
 
     def get_context_data(self, *, object_list=None, **kwargs):
         """
@@ -83,12 +192,27 @@ class ProductList(ListView):
         """
         context = super().get_context_data(object_list=None, **kwargs)
 
-        context['categories'] = Category.objects.filter(parent__isnull=True)
-        context['colors'] = Color.objects.all()
-        context['size_groups'] = SizeGroup.objects.prefetch_related('sizes')
-        context["max_price"] = self.queryset.aggregate(Max("price"))['price__max'] or 999
+        context['categories'] = self.get_taxonomy().root_categories()
+        context['colors'] = self.get_taxonomy().colors
+        context['size_groups'] = self.get_taxonomy().size_groups
+        bounds = self.get_price_bounds()
+        context["min_price"] = max(math.floor(bounds.min), 1) if bounds.min is not None else 1
+        # thumbs of the slider are kept at least 10 apart
+        context["max_price"] = max(
+            math.ceil(bounds.max) if bounds.max is not None else 999, context["min_price"] + 10
+        )
         context['ordering_options'] = {k: k.replace("_", " ") for k in self.ordering_options}
         context['ordering_param_name'] = self.ordering_param_name
+        context['pagination_mode'] = self.get_pagination_mode()
+
+        # counts of results for the filter panel options
+        facets = ProductFacets(self.get_scope_queryset(), self.get_filter())
+        context['color_counts'] = facets.get_color_counts()
+        context['size_counts'] = facets.get_size_counts()
+        # selected options are shown even without results
+        context['selected_colors'] = self.get_filter().get_values().get('color', [])
+        context['selected_sizes'] = self.get_filter().get_values().get('size', [])
+        context['price_histogram'] = facets.get_price_histogram()
 
         return context
 
@@ -99,74 +223,226 @@ class ProductList(ListView):
         """
         ordering = self.request.GET.get(self.ordering_param_name) or ""
 
-        return self.ordering_options.get(ordering, "-views")
+        return self.ordering_options.get(ordering, "-trending")
+
+    def get_price_scope(self):
+        """ Key of the scope for cached price bounds, see products.price_bounds. """
+        return "all"
+
+    def get_price_bounds(self):
+        """
+        Bounds of effective prices of the whole scope (ignoring filters),
+        so that the slider doesn't shrink when a price filter is applied.
+        """
+        return price_bounds.get_price_bounds(self.get_price_scope(), self.get_scope_queryset())
+
+    def get_pagination_mode(self):
+        """
+        Links with a page number (f.e. bookmarked before cursor pagination
+        was introduced) are still served by the offset paginator.
+        Products resolved by the inventory index are already in memory,
+        so offset pagination is cheap for them at any depth.
+        """
+        if self.use_inventory_index():
+            return "offset"
+        if self.page_kwarg in self.request.GET and self.cursor_param_name not in self.request.GET:
+            return "offset"
+
+        return self.pagination_mode
+
+    def paginate_queryset(self, queryset, page_size):
+        if self.get_pagination_mode() != "cursor":
+            return super().paginate_queryset(queryset, page_size)
+
+        paginator = CursorPaginator(queryset, page_size, self.get_ordering())
+        page = paginator.page(self.request.GET.get(self.cursor_param_name))
+
+        return paginator, page, page.object_list, page.has_other_pages()
 
 
 class ProductByCampaignList(ProductList):
     template_name = 'products/product_list/product_list_campaign.html'
 
-    def get_queryset(self):
+    def get_scope_queryset(self):
         """
         Fetch Campaign object first instead of filtering directly:
-        - only one query is executed when Campaign object for a given slug
+        - no query for Products is executed when Campaign object for a given slug
           does not exist,
         - if filtering Product queryset directly results in an empty queryset,
           it's impossible to distinguish if the Campaign object does not exist
           or there are no results for a given query params.
         """
-        self.queryset = super().get_queryset()
-        slug = self.kwargs.get("slug")
-        campaign = get_object_or_404(Campaign, slug=slug, is_active=True)
+        return super().get_scope_queryset().for_campaign(self.get_campaign())
+
+    def get_campaign(self):
+        if not hasattr(self, "campaign"):
+            self.campaign = self.get_taxonomy().get_campaign(self.kwargs.get("slug"))
+            if self.campaign is None:
+                raise Http404("No Campaign matches the given query.")
+
+        return self.campaign
+
+    def get_index_scope(self):
+        return {"campaign": self.get_campaign().pk}
 
-        return self.queryset.for_campaign(campaign)
+    def get_price_scope(self):
+        return "campaign:%s" % self.get_campaign().pk
 
     def get_context_data(self, *, object_list=None, **kwargs):
         """ Add Campaign object """
         context = super().get_context_data(object_list=None, **kwargs)
-        context['campaign'] = Campaign.objects.get(slug=self.kwargs.get("slug"))
+        context['campaign'] = self.get_campaign()
 
         return context
 
 
 class ProductByCategoryList(ProductList):
-    def get_queryset(self):
+    def get_scope_queryset(self):
         """
         Same approach as in ProductByCampaignList.
         """
-        self.queryset = super().get_queryset()
+        categories = self.get_taxonomy().get_descendants(self.get_category(), include_self=True)
+
+        return super().get_scope_queryset().for_categories(categories)
+
+    def get_category(self):
         # example path: dresses/summer-dresses/floral-dresses,
         # then crumb = "floral-dresses"
-        crumb = self.kwargs.get("path", "").split("/")[-1]
-        category = get_object_or_404(Category, path_crumb=crumb)
-        categories = category.get_descendants(include_self=True)
+        if not hasattr(self, "category"):
+            crumb = self.kwargs.get("path", "").split("/")[-1]
+            self.category = self.get_taxonomy().get_category(crumb)
+            if self.category is None:
+                raise Http404("No Category matches the given query.")
 
-        return self.queryset.for_categories(categories)
+        return self.category
+
+    def get_index_scope(self):
+        return {"category": self.get_category().pk}
+
+    def get_price_scope(self):
+        return "category:%s" % self.get_category().pk
 
     def get_context_data(self, *, object_list=None, **kwargs):
-        """ Add Categories queryset """
+        """ Add root Categories and the tree of the selected one """
 
         context = super().get_context_data(object_list=None, **kwargs)
         crumb = self.kwargs.get("path", "").split("/")[0]
-        context['categories'] = Category.objects.root_and_path_categories(crumb)
+        root = self.get_taxonomy().get_category(crumb)
+        if root is None:
+            raise Http404("No Category matches the given query.")
+        context['categories'] = self.get_taxonomy().root_and_path_categories(root)
 
         return context
 
 
 class ProductSearchList(ProductList):
+    """
+    Products of ParentProducts found by the search backend (see products.search),
+    by default ranked by relevance blended with views.
+    Misspelled words are corrected before searching (see products.spelling).
+    An empty query has no results.
+    """
     template_name = 'products/product_list/search_list.html'
+    ordering_options = {"relevance": None, **ProductList.ordering_options}
 
     def get_queryset(self):
-        self.queryset = super().get_queryset()
-        user_input = self.request.GET.get('q', '')
-        keywords = user_input.strip(" ").split(" ")
+        if not self.is_ranked():
+            return super().get_queryset()
+
+        # ranked in memory like Products resolved by the inventory index,
+        # only a single page is fetched from the db
+        pks = search.rank_products(self.get_filtered_queryset(), self.get_search_results())
+        self.queryset = inventory_index.IndexedProducts(pks, self.with_related(Product.objects.all()))
+
+        return self.queryset
+
+    def get_scope_queryset(self):
+        queryset = super().get_scope_queryset()
+        # an empty (or whitespace only) query doesn't match everything
+        if self.get_query() and (results := self.get_search_results()):
+            return queryset.filter(parent__in=list(results))
+
+        return queryset.none()
+
+    def get_query(self):
+        return self.request.GET.get('q', '').strip()
+
+    def get_page_params(self):
+        params = super().get_page_params()
+        if query := self.get_query():
+            params['q'] = query
+
+        return params
+
+    def get_corrected_query(self):
+        if not hasattr(self, "_corrected_query"):
+            self._corrected_query = spelling.correct(self.get_query())
+
+        return self._corrected_query
+
+    def get_keywords(self):
+        return self.get_corrected_query().split()
+
+    def get_search_results(self):
+        """ {ParentProduct pk: relevance} """
+        if not hasattr(self, "_search_results"):
+            self._search_results = search.search(self.get_corrected_query())
+
+        return self._search_results
+
+    def get_context_data(self, *, object_list=None, **kwargs):
+        """ Add the corrected query if any word was misspelled """
+        context = super().get_context_data(object_list=None, **kwargs)
+        corrected = self.get_corrected_query()
+        if corrected != " ".join(search.tokenize(self.get_query())):
+            context['corrected_query'] = corrected
+
+        return context
 
-        return self.queryset.for_search(keywords)
+    def get_ordering(self):
+        """ Relevance (None) by default, popularity when there's nothing to rank. """
+        ordering = self.request.GET.get(self.ordering_param_name) or "relevance"
+        if ordering == "relevance" and not self.get_query():
+            ordering = "popularity"
+
+        return self.ordering_options.get(ordering, "-trending")
+
+    def is_ranked(self):
+        return self.get_ordering() is None
+
+    def get_pagination_mode(self):
+        if self.is_ranked():
+            return "offset"
+
+        return super().get_pagination_mode()
+
+    def get_price_scope(self):
+        return price_bounds.search_scope(self.get_keywords())
+
+    def get_index_scope(self):
+        # keywords are not indexed
+        return None
 
 
 class ProductDetail(DetailView):
     context_object_name = "product"
     template_name = 'products/product_detail/product_detail.html'
 
+    def get(self, request, *args, **kwargs):
+        """
+        A 304 when the page of the Product in If-None-Match hasn't changed,
+        without fetching it (see products.conditional), the view is still counted.
+        """
+        pk = conditional.requested_product(request)
+        if pk is not None:
+            etag = conditional.product_etag(pk, self.kwargs["slug"])
+            if not_modified := get_conditional_response(request, etag=etag):
+                not_modified["ETag"] = etag
+                self.count_view(not_modified, Product(pk=pk))
+                return not_modified
+
+        return super().get(request, *args, **kwargs)
+
     def get_queryset(self):
         """
         Fetch all products (not only available like in ListViews)
@@ -187,16 +463,88 @@ class ProductDetail(DetailView):
         context = super().get_context_data(**kwargs)
         # get object from context to avoid unnecessary db queries
         obj = context.get('object')
-        categories = obj.parent.category.get_ancestors(include_self=True)
-        context["categories"] = categories
+        category = obj.parent.category
+        context["categories"] = (
+            taxonomy.get_taxonomy().get_ancestors(category, include_self=True) if category else []
+        )
 
         return context
 
     def render_to_response(self, context, **response_kwargs):
-        """ Send signal to increment views counter """
+        product = context.get(self.context_object_name)
+        response = super().render_to_response(context, **response_kwargs)
+        response["ETag"] = conditional.product_etag(product.pk, product.slug)
+        self.count_view(response, product)
+
+        return response
+
+    def count_view(self, response, product):
+        """
+        Send signal to increment views counter, with recently viewed
+        products in a signed cookie instead of the session for visitors without one.
+        """
+        if view_dedup.uses_cookie(self.request):
+            session = view_dedup.CookieStore(signals.VIEWED, self.request)
+        else:
+            session = self.request.session
         signals.product_viewed.send(
             sender=self.model,
-            session=self.request.session,
-            product=context.get(self.context_object_name),
+            session=session,
+            product=product,
         )
-        return super().render_to_response(context, **response_kwargs)
+        if isinstance(session, view_dedup.CookieStore):
+            session.save(response)
+
+
+@method_decorator(api.json_errors, name="get")
+class ProductListApi(ProductList):
+    """
+    Products filtered and ordered like in ProductList, as JSON (see products.api),
+    streamed while they are fetched, f.e. ?color=1,3&sorting=newest&fields=id,slug,price.
+    """
+    http_method_names = ["get", "head", "options"]
+
+    def get(self, request, *args, **kwargs):
+        names = api.parse_fields(request.GET.get("fields"), api.FIELDS)
+        queryset = api.paginate(self.get_filtered_queryset().order_by(self.get_ordering(), "-pk"), request.GET)
+
+        return StreamingHttpResponse(
+            api.stream(api.rows(queryset, api.FIELDS, names)), content_type="application/json"
+        )
+
+    def get_scope_queryset(self):
+        """ Narrowed down to the 'category' (with subcategories) or the 'campaign' from query params. """
+        queryset = super().get_scope_queryset()
+        if crumb := self.request.GET.get("category"):
+            category = self.get_taxonomy().get_category(crumb)
+            if category is None:
+                raise api.ApiError("No Category matches the given query.", status=404)
+            queryset = queryset.for_categories(self.get_taxonomy().get_descendants(category, include_self=True))
+        if slug := self.request.GET.get("campaign"):
+            campaign = self.get_taxonomy().get_campaign(slug)
+            if campaign is None:
+                raise api.ApiError("No Campaign matches the given query.", status=404)
+            queryset = queryset.for_campaign(campaign)
+
+        return queryset
+
+
+@require_GET
+@api.json_errors
+def product_detail_api(request, slug):
+    """ A Product as JSON, f.e. ?fields=name,price,sizes (see products.api). """
+    return JsonResponse(api.product_detail(slug, request.GET))
+
+
+@require_GET
+@api.json_errors
+def categories_api(request):
+    """ All Categories in tree order as JSON (see products.api). """
+    return JsonResponse({"results": api.list_categories(request.GET)})
+
+
+@require_GET
+@api.json_errors
+def campaigns_api(request):
+    """ Active Campaigns as JSON (see products.api). """
+    return JsonResponse({"results": api.list_campaigns(request.GET)})
@@ -0,0 +1,20 @@
+function autocomplete(url) {
+    return {
+        query: '',
+        suggestions: [],
+        open: false,
+        async fetchSuggestions() {
+            const query = this.query.trim();
+            if (query.length < 2) {
+                this.suggestions = [];
+                return
+            }
+            const response = await fetch(url + '?' + new URLSearchParams({q: query}));
+            // ignore responses for older input
+            if (response.ok && query === this.query.trim()) {
+                this.suggestions = (await response.json()).suggestions;
+                this.open = true;
+            }
+        },
+    }
+}
@@ -27,6 +27,12 @@ function range(priceObj) {
         this.maxThumb = 100 - (((this.maxPrice - this.min) / (this.max - this.min)) * 100);
         priceObj[1] = this.maxPrice;
       },
+      setMinPrice(minPrice) {
+        this.min = parseInt(minPrice);
+        if (this.min > this.minPrice) {
+          this.minPrice = this.min;
+        }
+      },
       setMaxPrice(maxPrice) {
         this.max = parseInt(maxPrice);
         if (this.max < this.maxPrice) {